@@ -3,26 +3,36 @@
 Чат-квиз для составления и отправки жалоб
 """
 import os
+import json
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 from flask_session import Session
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from config import Config
 from services.orchestrator import orchestrator, FlowStep
 from services.dadata_service import dadata_service
+from services.suggest_guard import suggest_guard, Superseded
 from services.payment_service import payment_service
+from services.payment_ledger import payment_ledger
 from services.user_service import user_service
 from services.analytics_service import analytics_service
+from services.job_queue import job_queue
+from services.dialog_log import dialog_log
 from functools import wraps
 
 # Создаём приложение
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Инициализируем сессии (файловая система)
-os.makedirs(Config.SESSION_FILE_DIR, exist_ok=True)
-Session(app)
+# Инициализируем сессии: SQLite (по умолчанию) или файловая система Flask-Session
+if Config.SESSION_TYPE == 'sqlite':
+    from services.session_store import SqliteSessionInterface
+    app.session_interface = SqliteSessionInterface(
+        Config.SESSION_DB, gc_interval=Config.SESSION_GC_INTERVAL, legacy_dir=Config.SESSION_FILE_DIR)
+else:
+    os.makedirs(Config.SESSION_FILE_DIR, exist_ok=True)
+    Session(app)
 
 # Rate limiting
 limiter = Limiter(
@@ -258,14 +268,54 @@ def get_state():
         state.add_message("assistant", response["message"], response.get("options"), response.get("input_type", "options"))
         state.step = response.get("step", "registration")
         session['dialog_state'] = state.to_dict()
+        etag = None
     else:
+        # Состояние не менялось с прошлого запроса — 304 без чтения истории и сериализации
+        etag = _dialog_state_etag(request.query_string)
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return resp
         state = DialogStateV2.from_dict(session['dialog_state'])
     
-    return jsonify({
-        "history": state.history,
-        "step": state.step,
-        "data": state.data
-    })
+    since = request.args.get('since', 0, type=int)
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    resp = jsonify(_project_state(state, since, fields))
+    if etag:
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def _dialog_state_etag(extra: bytes = b'') -> str:
+    """ETag состояния диалога: хэш сохранённого dialog_state (и параметров запроса)"""
+    import hashlib
+    stored = getattr(session, 'stored', {}).get('dialog_state')
+    if stored is None:
+        stored = json.dumps(session.get('dialog_state'), sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(stored + b'|' + extra).hexdigest()[:20]
+
+
+def _project_state(state, since=0, fields=None):
+    """
+    Ответ /api/state: история с номера since (клиент догружает только новые сообщения)
+    и, если заданы fields, только нужные поля — history, step, data или data.<ключ>.
+    history_rev меняется, когда сообщения перезаписаны на месте — тогда клиент перечитывает историю
+    """
+    result = {"state_id": state.id, "history_len": len(state.history),
+              "history_rev": state.history.revision, "since": since}
+    wanted = set(fields or ["history", "step", "data"])
+    if "history" in wanted:
+        result["history"] = state.history.page(since)
+    if "step" in wanted:
+        result["step"] = state.step
+    if "data" in wanted:
+        result["data"] = state.data
+    else:
+        data_keys = [f[5:] for f in wanted if f.startswith("data.")]
+        if data_keys:
+            result["data"] = {k: state.data[k] for k in data_keys if k in state.data}
+    return result
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -502,8 +552,12 @@ def chat():
             elif user_input == "back":
                 state.step = "recipients"
         
-        # Вызываем оркестратор
-        response = orchestrator.process(state.to_dict(), user_input)
+        # Долгие шаги — в фоновую очередь: клиент получает id задачи и опрашивает /api/jobs/<id>
+        if data.get('async') and _runs_as_job(state.step, user_input, bool(data.get('stream'))):
+            return jsonify(_enqueue_chat_job(state, current_step, user_input, bool(data.get('stream'))))
+        
+        # Вызываем оркестратор (stream — жалобу браузер дочитает по SSE из /api/chat/stream)
+        response = orchestrator.process(dict(state.to_dict(), stream=bool(data.get('stream'))), user_input)
         
         # Автоматическая регистрация при завершении сбора профиля
         if response.get('step') == 'registration_complete':
@@ -566,148 +620,322 @@ def chat():
             state.add_message('assistant', f'✅ Профиль создан! Добро пожаловать, **{name}**!', None, 'options')
             response = orchestrator.process(state.to_dict(), None)
         
-        # Сохраняем результат генерации жалобы
-        if response.get("complaint_text"):
-            state.data["complaint_text"] = response["complaint_text"]
+        return jsonify(_finalize_chat_response(state, current_step, user_input, response))
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Ошибка: {str(e)}"}), 500
+
+
+def _finalize_chat_response(state, current_step, user_input, response):
+    """
+    Общий хвост /api/chat и /api/chat/stream: сохранить ответ оркестратора в состоянии
+    диалога, залогировать шаг воронки и собрать JSON для фронтенда
+    """
+    # Сохраняем результат генерации жалобы
+    if response.get("complaint_text"):
+        state.data["complaint_text"] = response["complaint_text"]
+    
+    # Сохраняем опции получателей
+    if response.get("step") == "recipients" and response.get("options"):
+        state.data["recipient_options"] = response["options"]
+    
+    # Обновляем шаг
+    new_step = response.get("step", state.step)
+    state.step = new_step
+    
+    # Добавляем ответ в историю
+    state.add_message("assistant", response["message"], response.get("options"), response.get("input_type", "options"))
+    
+    # Сохраняем состояние
+    session['dialog_state'] = state.to_dict()
+    session.modified = True
+    
+    # === ANALYTICS: log funnel step ===
+    try:
+        sid = session.sid if hasattr(session, 'sid') else str(id(session))
+        utm_data = state.data.get('utm_data', {})
+        ip = request.remote_addr or ''
+        ua = request.headers.get('User-Agent', '')
         
-        # Сохраняем опции получателей
-        if response.get("step") == "recipients" and response.get("options"):
-            state.data["recipient_options"] = response["options"]
+        # Map orchestrator steps to funnel steps
+        if current_step == 'registration':
+            reg = state.data.get('registration', {})
+            if user_input == 'consent_accept':
+                analytics_service.log_event(sid, 'consent', '', utm_data, ip, ua)
+            elif reg.get('consent_given'):
+                # Determine sub-step based on what was just filled
+                if not reg.get('user_type') or user_input in ('individual', 'ip', 'organization'):
+                    analytics_service.log_event(sid, 'reg_user_type', user_input, utm_data, ip, ua)
+                elif reg.get('fio') and not reg.get('address'):
+                    analytics_service.log_event(sid, 'reg_fio', '', utm_data, ip, ua)
+                elif reg.get('address') and not reg.get('phone'):
+                    analytics_service.log_event(sid, 'reg_address', '', utm_data, ip, ua)
+                elif reg.get('phone') and not reg.get('email'):
+                    analytics_service.log_event(sid, 'reg_phone', '', utm_data, ip, ua)
+                elif reg.get('email') and not reg.get('password'):
+                    analytics_service.log_event(sid, 'reg_email', '', utm_data, ip, ua)
+                elif reg.get('password'):
+                    analytics_service.log_event(sid, 'reg_password', '', utm_data, ip, ua)
         
-        # Обновляем шаг
-        new_step = response.get("step", state.step)
-        state.step = new_step
+        if new_step == 'category' and current_step != 'category':
+            analytics_service.log_event(sid, 'category', state.data.get('category', ''), utm_data, ip, ua)
         
-        # Добавляем ответ в историю
-        state.add_message("assistant", response["message"], response.get("options"), response.get("input_type", "options"))
+        if current_step == 'category' and new_step == 'quiz':
+            analytics_service.log_event(sid, 'category', state.data.get('category', ''), utm_data, ip, ua)
         
-        # Сохраняем состояние
-        session['dialog_state'] = state.to_dict()
-        session.modified = True
+        if current_step == 'quiz':
+            q_num = len(state.qa_pairs)
+            q_key = f'quiz_q{min(q_num, 5)}'
+            analytics_service.log_event(sid, q_key, f'q{q_num}', utm_data, ip, ua)
+        
+        if new_step == 'preview' and response.get('complaint_text'):
+            analytics_service.log_event(sid, 'complaint_generated', '', utm_data, ip, ua)
         
-        # === ANALYTICS: log funnel step ===
+        if new_step == 'recipients':
+            analytics_service.log_event(sid, 'recipients_selected', '', utm_data, ip, ua)
+        
+        if response.get('input_type') == 'sending_results':
+            analytics_service.log_event(sid, 'complaint_sent', '', utm_data, ip, ua)
+    except Exception as e:
+        print(f'[ANALYTICS] Error: {e}')
+    
+    # === ТРЕКИНГ СОБЫТИЙ ВОРОНКИ ===
+    email_user = session.get('user_email')
+    resp_step = response.get('step', '')
+    resp_input_type = response.get('input_type', '')
+    
+    if email_user:
         try:
-            sid = session.sid if hasattr(session, 'sid') else str(id(session))
-            utm_data = state.data.get('utm_data', {})
-            ip = request.remote_addr or ''
-            ua = request.headers.get('User-Agent', '')
-            
-            # Map orchestrator steps to funnel steps
-            if current_step == 'registration':
-                reg = state.data.get('registration', {})
-                if user_input == 'consent_accept':
-                    analytics_service.log_event(sid, 'consent', '', utm_data, ip, ua)
-                elif reg.get('consent_given'):
-                    # Determine sub-step based on what was just filled
-                    if not reg.get('user_type') or user_input in ('individual', 'ip', 'organization'):
-                        analytics_service.log_event(sid, 'reg_user_type', user_input, utm_data, ip, ua)
-                    elif reg.get('fio') and not reg.get('address'):
-                        analytics_service.log_event(sid, 'reg_fio', '', utm_data, ip, ua)
-                    elif reg.get('address') and not reg.get('phone'):
-                        analytics_service.log_event(sid, 'reg_address', '', utm_data, ip, ua)
-                    elif reg.get('phone') and not reg.get('email'):
-                        analytics_service.log_event(sid, 'reg_phone', '', utm_data, ip, ua)
-                    elif reg.get('email') and not reg.get('password'):
-                        analytics_service.log_event(sid, 'reg_email', '', utm_data, ip, ua)
-                    elif reg.get('password'):
-                        analytics_service.log_event(sid, 'reg_password', '', utm_data, ip, ua)
-            
-            if new_step == 'category' and current_step != 'category':
-                analytics_service.log_event(sid, 'category', state.data.get('category', ''), utm_data, ip, ua)
-            
-            if current_step == 'category' and new_step == 'quiz':
-                analytics_service.log_event(sid, 'category', state.data.get('category', ''), utm_data, ip, ua)
-            
-            if current_step == 'quiz':
-                q_num = len(state.qa_pairs)
-                q_key = f'quiz_q{min(q_num, 5)}'
-                analytics_service.log_event(sid, q_key, f'q{q_num}', utm_data, ip, ua)
+            # 1. Жалоба сгенерирована (показан preview)
+            if resp_step == 'preview' and response.get('complaint_text'):
+                user_service.add_event(email_user, 'complaint_generated', {
+                    'category': state.data.get('category_name', '')
+                })
             
-            if new_step == 'preview' and response.get('complaint_text'):
-                analytics_service.log_event(sid, 'complaint_generated', '', utm_data, ip, ua)
+            # 2. Открыт выбор получателей
+            if resp_step == 'recipients' and resp_input_type == 'multi_select':
+                user_service.add_event(email_user, 'recipients_opened')
             
-            if new_step == 'recipients':
-                analytics_service.log_event(sid, 'recipients_selected', '', utm_data, ip, ua)
+            # 3. Получатели выбраны → переход к отправке
+            if resp_step == 'sending' and state.data.get('selected_recipients'):
+                recipients_names = [r.get('name', '') for r in state.data.get('selected_recipients', [])]
+                user_service.add_event(email_user, 'channels_selected', {
+                    'recipients': recipients_names
+                })
             
-            if response.get('input_type') == 'sending_results':
-                analytics_service.log_event(sid, 'complaint_sent', '', utm_data, ip, ua)
-        except Exception as e:
-            print(f'[ANALYTICS] Error: {e}')
-        
-        # === ТРЕКИНГ СОБЫТИЙ ВОРОНКИ ===
-        email_user = session.get('user_email')
-        resp_step = response.get('step', '')
-        resp_input_type = response.get('input_type', '')
-        
-        if email_user:
-            try:
-                # 1. Жалоба сгенерирована (показан preview)
-                if resp_step == 'preview' and response.get('complaint_text'):
-                    user_service.add_event(email_user, 'complaint_generated', {
-                        'category': state.data.get('category_name', '')
-                    })
-                
-                # 2. Открыт выбор получателей
-                if resp_step == 'recipients' and resp_input_type == 'multi_select':
-                    user_service.add_event(email_user, 'recipients_opened')
-                
-                # 3. Получатели выбраны → переход к отправке
-                if resp_step == 'sending' and state.data.get('selected_recipients'):
-                    recipients_names = [r.get('name', '') for r in state.data.get('selected_recipients', [])]
-                    user_service.add_event(email_user, 'channels_selected', {
-                        'recipients': recipients_names
-                    })
-                
-                # 4. Результаты отправки (жалоба отправлена)
-                if resp_input_type == 'sending_results' and response.get('results'):
-                    user_service.add_event(email_user, 'complaint_sent', {
-                        'recipients_count': len(response.get('results', []))
-                    })
-            except Exception as e:
-                print(f'[EVENT TRACK] Error: {e}')
-        
-        # Сохраняем sending_results в state.data для восстановления при перезагрузке страницы
-        if response.get('input_type') == 'sending_results' and response.get('results'):
-            state.data['sending_results'] = response['results']
-            session['dialog_state'] = state.to_dict()
-            session.modified = True
-        
-        # Автосохранение жалобы в профиль пользователя
-        if response.get('input_type') == 'sending_results' and response.get('results') and email_user:
-            try:
-                user_service.save_complaint(email_user, {
-                    'category_name': state.data.get('category_name', ''),
-                    'complaint_text': state.data.get('complaint_text', ''),
-                    'recipients': response.get('results', []),
+            # 4. Результаты отправки (жалоба отправлена)
+            if resp_input_type == 'sending_results' and response.get('results'):
+                user_service.add_event(email_user, 'complaint_sent', {
+                    'recipients_count': len(response.get('results', []))
                 })
-            except Exception as e:
-                print(f'[COMPLAINT SAVE] Error: {e}')
-        
-        # Формируем ответ
-        resp = {
-            "message": response["message"],
-            "options": response.get("options"),
-            "input_type": response.get("input_type", "options"),
-            "step": response.get("step"),
-            "complaint_text": response.get("complaint_text"),
-            "can_go_back": response.get("can_go_back", True),
-            "results": response.get("results"),
-            "pdf_download_url": response.get("pdf_download_url")
-        }
+        except Exception as e:
+            print(f'[EVENT TRACK] Error: {e}')
+    
+    # Сохраняем sending_results в state.data для восстановления при перезагрузке страницы
+    if response.get('input_type') == 'sending_results' and response.get('results'):
+        state.data['sending_results'] = response['results']
+        session['dialog_state'] = state.to_dict()
+        session.modified = True
+    
+    # Автосохранение жалобы в профиль пользователя
+    if response.get('input_type') == 'sending_results' and response.get('results') and email_user:
+        try:
+            user_service.save_complaint(email_user, {
+                'category_name': state.data.get('category_name', ''),
+                'complaint_text': state.data.get('complaint_text', ''),
+                'recipients': response.get('results', []),
+            })
+        except Exception as e:
+            print(f'[COMPLAINT SAVE] Error: {e}')
+    
+    # Формируем ответ
+    resp = {
+        "message": response["message"],
+        "options": response.get("options"),
+        "input_type": response.get("input_type", "options"),
+        "step": response.get("step"),
+        "complaint_text": response.get("complaint_text"),
+        "can_go_back": response.get("can_go_back", True),
+        "results": response.get("results"),
+        "pdf_download_url": response.get("pdf_download_url"),
+        "stream_url": response.get("stream_url")
+    }
+    
+    # Передаём данные пользователя для обновления шапки
+    if session.get('user_email'):
+        user = user_service.get_user(session['user_email'])
+        if user:
+            resp['user_name'] = user.get('name', '') or session['user_email'].split('@')[0]
+            resp['user_email'] = session['user_email']
+    
+    return resp
+
+
+# Шаги с долгими вызовами LLM/API, которые выполняет очередь задач, и что показать, пока ждём
+JOB_STEPS = {
+    'quiz': '🤔 Обдумываю ответ...',
+    'generating_complaint': '✍️ Составляю жалобу...',
+    'edit_complaint': '✍️ Обновляю жалобу...',
+    'recipients': '🔎 Подбираю адресатов и проверяю их контакты...',
+    'sending': '📨 Отправляю жалобу...',
+}
+
+
+def _runs_as_job(step, user_input, stream):
+    if step not in JOB_STEPS:
+        return False
+    if step == 'edit_complaint' and user_input == 'edit':
+        return False  # Только приглашение ввести правки
+    if stream and step in ('generating_complaint', 'edit_complaint'):
+        return False  # Жалоба и так придёт потоком по SSE
+    return True
+
+
+def _session_owner():
+    return getattr(session, 'sid', '') or ''
+
+
+def _enqueue_chat_job(state, current_step, user_input, stream):
+    """
+    Поставить шаг оркестратора в очередь. В сессии остаётся исходный шаг и
+    сообщение-заглушка; результат применяется к сессии при опросе /api/jobs/<id>
+    """
+    job_id = job_queue.enqueue('chat', {
+        'state': dict(state.to_dict(), stream=stream),
+        'current_step': current_step,
+        'user_input': user_input,
+    }, owner=_session_owner(), progress=JOB_STEPS[state.step])
+    
+    message = JOB_STEPS[state.step]
+    state.step = current_step
+    state.data['pending_job'] = job_id
+    state.add_message('assistant', message, None, 'job')
+    session['dialog_state'] = state.to_dict()
+    session.modified = True
+    return {
+        "message": message,
+        "input_type": "job",
+        "job_id": job_id,
+        "job_url": f"/api/jobs/{job_id}",
+        "step": current_step,
+        "can_go_back": False
+    }
+
+
+def _run_chat_job(payload, progress):
+    """Исполнитель задачи 'chat' — тот же вызов оркестратора, что и в /api/chat"""
+    state = payload['state']
+    response = orchestrator.process(state, payload['user_input'])
+    return {'state': state, 'response': response}
+
+
+job_queue.register('chat', _run_chat_job)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@limiter.exempt  # Опрос раз в секунду
+def job_status(job_id):
+    """
+    Опрос задачи из /api/chat. Пока идёт — status queued/running и progress;
+    по готовности результат один раз применяется к диалогу и возвращается как response
+    """
+    job = job_queue.get(job_id)
+    if not job or job['owner'] != _session_owner():
+        return jsonify({"error": "Задача не найдена"}), 404
+    
+    status = job['status']
+    if status == 'delivered':
+        return jsonify({"status": "done", "response": job['result']})
+    if status in ('queued', 'running', 'delivering'):
+        return jsonify({
+            "status": 'running' if status == 'delivering' else status,
+            "progress": job['progress'],
+            "position": job.get('position')
+        })
+    
+    state = DialogStateV2.from_dict(session.get('dialog_state', {}))
+    if state.data.get('pending_job') != job_id:
+        return jsonify({"error": "Задача устарела. Обновите страницу."}), 409
+    payload = job['payload']
+    
+    if status == 'done':
+        if not job_queue.claim_delivery(job_id):
+            return jsonify({"status": "running", "progress": job['progress']})
+        state = DialogStateV2.from_dict(job['result']['state'])
+        state.data.pop('pending_job', None)
+        resp = _finalize_chat_response(state, payload['current_step'], payload['user_input'],
+                                       job['result']['response'])
+        job_queue.mark_delivered(job_id, resp)
+        return jsonify({"status": "done", "response": resp})
+    
+    # failed — убираем заглушку и даём повторить последнее действие
+    state.data.pop('pending_job', None)
+    if state.history and state.history[-1].get('input_type') == 'job':
+        state.history.pop()
+    if state.history and state.history[-1].get('role') == 'user':
+        state.history.pop()
+    previous = next((m for m in reversed(state.history) if m.get('role') == 'assistant'), {})
+    response = {
+        "message": "❌ Не удалось выполнить запрос. Попробуйте ещё раз.",
+        "options": previous.get('options'),
+        "input_type": previous.get('input_type', 'options'),
+        "step": payload['current_step'],
+        "can_go_back": True
+    }
+    state.step = payload['current_step']
+    state.add_message("assistant", response["message"], response["options"], response["input_type"])
+    session['dialog_state'] = state.to_dict()
+    session.modified = True
+    return jsonify({"status": "failed", "error": job['error'], "response": response})
+
+
+@app.route('/api/chat/stream', methods=['GET'])
+@limiter.limit("10 per minute")
+def chat_stream():
+    """
+    SSE-поток генерации жалобы после ответа /api/chat с input_type=stream.
+    События: delta {"text"} — очередной кусок текста, done — итоговый ответ
+    в формате /api/chat, failed {"error"} — генерацию запустить нельзя
+    """
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    state_dict = session.get('dialog_state')
+    pending = (state_dict or {}).get('data', {}).get('pending_complaint')
+    if not pending:
+        return Response(sse('failed', {"error": "Нет жалобы в процессе генерации. Обновите страницу."}),
+                        mimetype='text/event-stream')
+    
+    def generate():
+        state = DialogStateV2.from_dict(state_dict)
+        user_edits = pending.get('user_edits')
+        context = orchestrator.complaint_context(state.to_dict(), user_edits)
         
-        # Передаём данные пользователя для обновления шапки
-        if session.get('user_email'):
-            user = user_service.get_user(session['user_email'])
-            if user:
-                resp['user_name'] = user.get('name', '') or session['user_email'].split('@')[0]
-                resp['user_email'] = session['user_email']
+        chunks = []
+        try:
+            for delta in orchestrator.agents["complaint"].stream(context):
+                chunks.append(delta)
+                yield sse('delta', {"text": delta})
+        except Exception as e:
+            print(f"[STREAM] Complaint generation failed: {e}")
+            chunks = []
         
-        return jsonify(resp)
-    
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Ошибка: {str(e)}"}), 500
+        state.data.pop('pending_complaint', None)
+        # Заглушка «Составляю жалобу...» заменяется итоговым сообщением
+        if state.history and state.history[-1].get('input_type') == 'stream':
+            state.history.pop()
+        response = orchestrator.finish_complaint(''.join(chunks) or None, edited=bool(user_edits))
+        resp = _finalize_chat_response(state, pending.get('step', state.step), user_edits, response)
+        # Flask-Session сохранил сессию ещё до начала потока — сохраняем итог явно
+        app.session_interface.save_session(app, session, Response())
+        yield sse('done', resp)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # nginx не должен буферизовать поток
+    })
 
 
 @app.route('/api/back', methods=['POST'])
@@ -729,7 +957,7 @@ def go_back():
         session.modified = True
         return jsonify({
             "success": True,
-            "history": state.history,
+            "history": state.history.page(),
             "step": state.step
         })
     return jsonify({"success": False, "error": "Невозможно вернуться назад"})
@@ -762,7 +990,7 @@ def restart():
     
     return jsonify({
         "success": True,
-        "history": state.history,
+        "history": state.history.page(),
         "step": state.step
     })
 
@@ -867,6 +1095,7 @@ def admin_user_detail(email):
     if not user:
         return jsonify({"error": "User not found"}), 404
     user['email'] = email
+    user['events'] = user_service.get_events(email)
     return jsonify({"user": user})
 
 @app.route('/admin/logout')
@@ -889,21 +1118,7 @@ def admin_login_as(email):
     is_standard = any(p.get('tariff') == 'standard' for p in payments)
     if is_standard:
         # Сбрасываем счётчик: помечаем текущие стандартные платежи как succeeded
-        import json
-        users_file = getattr(Config, 'USERS_FILE', './data/users.json')
-        with open(users_file, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        
-        e = email.strip().lower()
-        if e in users:
-            for p in users[e].get('payments', []):
-                if p.get('tariff') == 'standard':
-                    p['status'] = 'succeeded'
-                    p['recorded_at'] = datetime.now().isoformat()
-            # Сбрасываем complaints чтобы лимит обнулился
-            users[e]['complaints_used'] = 0
-            with open(users_file, 'w', encoding='utf-8') as f:
-                json.dump(users, f, ensure_ascii=False, indent=2)
+        user_service.renew_standard_payments(email)
     
     # Устанавливаем сессию как этого пользователя
     session['user_email'] = email.strip().lower()
@@ -919,11 +1134,6 @@ def admin_seed_test():
         return jsonify({"error": "Forbidden"}), 403
     
     from werkzeug.security import generate_password_hash
-    import json, os
-    
-    users_file = getattr(Config, 'USERS_FILE', './data/users.json')
-    with open(users_file, 'r', encoding='utf-8') as f:
-        users = json.load(f)
     
     now = datetime.now().isoformat()
     
@@ -933,11 +1143,7 @@ def admin_seed_test():
     
     for acc in accounts:
         email = acc['email'].strip().lower()
-        if email in users:
-            created.append(f"{email}: уже существует")
-            continue
-        
-        users[email] = {
+        ok = user_service.import_user(email, {
             'name': acc.get('name', ''),
             'password_hash': generate_password_hash(acc.get('password', 'test123')),
             'password_raw': acc.get('password', 'test123'),
@@ -949,13 +1155,10 @@ def admin_seed_test():
             'payments': acc.get('payments', []),
             'complaints': [],
             'events': [],
-        }
-        created.append(f"{email}: создан")
-    
-    with open(users_file, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+        })
+        created.append(f"{email}: создан" if ok else f"{email}: уже существует")
     
-    return jsonify({"created": created, "total": len(users)})
+    return jsonify({"created": created, "total": user_service.store.count()})
 
 
 # ==================== ANALYTICS ADMIN API ====================
@@ -999,6 +1202,42 @@ def admin_visitor_detail(visitor_id):
     return jsonify({"events": events})
 
 
+@app.route('/api/admin/http-stats')
+def admin_http_stats():
+    """Статистика пулов исходящих HTTP-соединений (текущий воркер)"""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Forbidden"}), 403
+    from services.http_client import http_client
+    return jsonify(http_client.stats())
+
+
+@app.route('/api/admin/cache-stats')
+def admin_cache_stats():
+    """Попадания в кэш контактов госорганов, ответов LLM, подсказок DaData и PDF (текущий воркер)"""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Forbidden"}), 403
+    from services.contact_verification_service import contact_verification_service
+    from services.llm_service import llm_service
+    from services.pdf_cache import pdf_cache
+    return jsonify({
+        "contacts": contact_verification_service.contacts_cache.stats(),
+        "llm": llm_service.response_cache.stats(),
+        "suggest": dadata_service.cache.stats(),
+        "suggest_guard": suggest_guard.stats(),
+        "pdf": pdf_cache.stats(),
+    })
+
+
+@app.route('/api/admin/session-stats')
+def admin_session_stats():
+    """Размеры серверных сессий в байтах (только для SQLite-сессий)"""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Forbidden"}), 403
+    if not hasattr(app.session_interface, 'stats'):
+        return jsonify({"error": "Статистика доступна только для SESSION_TYPE=sqlite"}), 400
+    return jsonify(app.session_interface.stats())
+
+
 # ==================== YANDEX METRIKA ADMIN API ====================
 
 from services.metrika_service import metrika_service
@@ -1141,6 +1380,27 @@ def admin_direct_keywords():
 
 
 # ==================== AUTOCOMPLETE API ====================
+# Клиент передаёт seq — номер запроса поля. Устаревшие запросы (пришёл seq новее)
+# отбрасываются до похода в DaData: ответ {"superseded": true}, клиент его игнорирует
+
+def _suggest(kind, lookup):
+    """Ответ подсказок: lookup(gate) → список; gate — очередь запросов поля в этой сессии"""
+    seq = request.args.get('seq', type=int)
+    if seq is None:
+        return jsonify({"suggestions": lookup(None)})  # Старый клиент — без очереди
+    
+    owner = getattr(session, 'sid', '')
+    if not owner or getattr(session, 'new', False):
+        # Cookie сессии ещё нет — очередь не с чем связать (по IP нельзя: за одним NAT много пользователей)
+        return jsonify({"suggestions": lookup(None), "seq": seq})
+    if not suggest_guard.admit(owner, kind, seq):
+        return jsonify({"suggestions": [], "seq": seq, "superseded": True})
+    try:
+        suggestions = lookup(suggest_guard.gate(owner, kind, seq))
+    except Superseded:
+        return jsonify({"suggestions": [], "seq": seq, "superseded": True})
+    return jsonify({"suggestions": suggestions, "seq": seq})
+
 
 @app.route('/api/suggest/company', methods=['GET'])
 @limiter.limit("60 per minute")
@@ -1153,14 +1413,13 @@ def suggest_company():
     
     # Если похоже на ИНН (только цифры), ищем по ИНН
     if query.isdigit() and len(query) >= 10:
-        company = dadata_service.find_company_by_inn(query)
-        if company:
-            return jsonify({"suggestions": [company]})
-        return jsonify({"suggestions": []})
+        def by_inn(gate):
+            company = dadata_service.find_company_by_inn(query, gate=gate)
+            return [company] if company else []
+        return _suggest('company', by_inn)
     
     # Иначе ищем по названию
-    suggestions = dadata_service.suggest_company(query, count=7)
-    return jsonify({"suggestions": suggestions})
+    return _suggest('company', lambda gate: dadata_service.suggest_company(query, count=7, gate=gate))
 
 
 @app.route('/api/suggest/address', methods=['GET'])
@@ -1172,8 +1431,7 @@ def suggest_address():
     if not query or len(query) < 3:
         return jsonify({"suggestions": []})
     
-    suggestions = dadata_service.suggest_address(query, count=7)
-    return jsonify({"suggestions": suggestions})
+    return _suggest('address', lambda gate: dadata_service.suggest_address(query, count=7, gate=gate))
 
 
 @app.route('/api/suggest/fio', methods=['GET'])
@@ -1185,8 +1443,7 @@ def suggest_fio():
     if not query or len(query) < 2:
         return jsonify({"suggestions": []})
     
-    suggestions = dadata_service.suggest_fio(query, count=5)
-    return jsonify({"suggestions": suggestions})
+    return _suggest('fio', lambda gate: dadata_service.suggest_fio(query, count=5, gate=gate))
 
 
 # ==================== PAYMENT API ====================
@@ -1217,7 +1474,9 @@ def create_payment():
     
     try:
         session_id = session.sid if hasattr(session, 'sid') else 'unknown'
-        result = payment_service.create_payment(tariff_id, session_id)
+        user_email = session.get('user_email', '')
+        result = payment_service.create_payment(tariff_id, session_id, email=user_email)
+        payment_ledger.register(result['payment_id'], tariff_id, session_id, user_email)
         
         # Сохраняем payment_id в сессию
         if 'dialog_state' in session:
@@ -1243,59 +1502,27 @@ def create_payment():
         return jsonify({"error": "Ошибка создания платежа"}), 500
 
 
+def _entitlement_response(entitlement):
+    """Ответ /api/payment/status по записи прав пользователя"""
+    return {
+        "paid": True,
+        "status": "succeeded",
+        "tariff": entitlement['tariff'],
+        "tariff_level": entitlement['tariff_level'],
+        "can_send": entitlement['can_send'],
+        "can_download": entitlement['can_download'],
+        "has_channels": entitlement['has_channels'],
+    }
+
+
 @app.route('/api/payment/status')
 def payment_status():
     """Проверить статус оплаты"""
     
-    # === 1. СНАЧАЛА проверяем сохранённые платежи пользователя ===
-    user_email = session.get('user_email')
-    if user_email:
-        user = user_service.get_user(user_email)
-        if user:
-            payments = user.get('payments', [])
-            # Ищем лучший активный платёж
-            best_tariff = None
-            for p in payments:
-                if p.get('status') != 'succeeded':
-                    continue
-                tariff_id = p.get('tariff', '')
-                
-                # Маппинг tariff из платежа → tariff_id из Config.TARIFFS
-                # 'annual' → 'premium', 'standard' → 'standard'
-                config_tariff_id = tariff_id
-                if tariff_id == 'annual':
-                    config_tariff_id = 'premium'
-                
-                tariff_config = Config.TARIFFS.get(config_tariff_id, {})
-                
-                # Проверяем срок для тарифов с ограничением по дням
-                days_limit = tariff_config.get('days')
-                if days_limit:
-                    paid_at = p.get('recorded_at') or p.get('paid_at') or p.get('created_at', '')
-                    if paid_at:
-                        try:
-                            expiry = datetime.fromisoformat(paid_at) + timedelta(days=days_limit)
-                            if datetime.now() > expiry:
-                                continue  # Истёк
-                        except:
-                            pass
-                
-                # premium > standard > free
-                priority = {'premium': 2, 'standard': 1}.get(config_tariff_id, 0)
-                if best_tariff is None or priority > best_tariff[0]:
-                    best_tariff = (priority, config_tariff_id, tariff_config)
-            
-            if best_tariff:
-                _, tariff_level, tariff_config = best_tariff
-                return jsonify({
-                    "paid": True,
-                    "status": "succeeded",
-                    "tariff": tariff_config.get('name', ''),
-                    "tariff_level": tariff_level,
-                    "can_send": tariff_config.get('sending', False),
-                    "can_download": tariff_config.get('download', False),
-                    "has_channels": tariff_config.get('channels', False),
-                })
+    # === 1. СНАЧАЛА проверяем права пользователя (пересчитываются при изменении платежей) ===
+    entitlement = user_service.get_entitlement(session.get('user_email'))
+    if entitlement and entitlement['paid']:
+        return jsonify(_entitlement_response(entitlement))
     
     # === 2. Фолбэк: проверяем текущую сессию (для in-progress оплаты) ===
     state_data = session.get('dialog_state', {})
@@ -1318,15 +1545,25 @@ def payment_status():
             "has_channels": payment_service.has_channels(state_data),
         })
     
-    # Проверяем в ЮКассе
-    result = payment_service.check_payment(payment_info['payment_id'])
-    if result and result.get('paid'):
+    # Статус — из локального реестра (его обновляет уведомление ЮКассы), без запроса в ЮКассу
+    ledger_state = payment_ledger.get(payment_info['payment_id'])
+    if ledger_state and ledger_state['status'] == 'succeeded':
         payment_info['status'] = 'succeeded'
-        payment_info['paid_at'] = datetime.now().isoformat()
+        payment_info['paid_at'] = ledger_state['paid_at'] or datetime.now().isoformat()
         payment_info['complaints_used'] = 0
         session['dialog_state'] = state_data
         session.modified = True
         
+        # Вошёл после оплаты — платёж тоже в профиль
+        user_email = session.get('user_email')
+        if user_email and ledger_state['email'] != user_email.strip().lower():
+            user_service.record_payment(user_email, {
+                'payment_id': payment_info['payment_id'],
+                'tariff': payment_info.get('tariff_id', ''),
+                'status': 'succeeded',
+                'paid_at': payment_info['paid_at'],
+            })
+        
         tariff = Config.TARIFFS.get(payment_info.get('tariff_id', ''), {})
         tariff_level = payment_service.get_tariff_level(state_data)
         return jsonify({
@@ -1339,11 +1576,50 @@ def payment_status():
             "has_channels": payment_service.has_channels(state_data),
         })
     
-    status = result.get('status', 'pending') if result else 'error'
+    status = ledger_state['status'] if ledger_state else 'pending'
     tariff_level = payment_service.get_tariff_level(state_data)
     return jsonify({"paid": False, "status": status, "tariff_level": tariff_level})
 
 
+def _on_payment_final(state):
+    """Платёж завершён (уведомление или сверка) — обновляем платежи и права пользователя"""
+    payment = {
+        'payment_id': state['payment_id'],
+        'tariff': state['tariff_id'] or '',
+        'status': state['status'],
+    }
+    if state['paid_at']:
+        payment['paid_at'] = state['paid_at']
+    if state['status'] == 'succeeded' and state['email']:
+        user_service.record_payment(state['email'], payment)
+    else:
+        # Отмена или анонимный платёж — обновляем, только если платёж уже записан в профиль
+        user_service.update_payment(state['payment_id'], {'status': state['status']})
+
+
+payment_ledger.on_final(_on_payment_final)
+
+
+@app.route('/api/payment/webhook', methods=['POST'])
+@limiter.exempt
+def payment_webhook():
+    """Уведомления ЮКассы (payment.succeeded, payment.canceled, ...)"""
+    ip = request.remote_addr or ''
+    if ip in ('127.0.0.1', '::1'):
+        ip = request.headers.get('X-Real-IP', ip)  # за nginx
+    if not payment_service.is_webhook_ip_trusted(ip):
+        print(f'[PAYMENT] Webhook from untrusted IP {ip}')
+        return jsonify({"error": "forbidden"}), 403
+    
+    notification = request.get_json(silent=True)
+    if not isinstance(notification, dict) or not isinstance(notification.get('object'), dict):
+        return jsonify({"error": "bad notification"}), 400
+    
+    # Повтор уведомления — тоже 200, иначе ЮКасса будет слать его снова
+    applied = payment_ledger.ingest(notification)
+    return jsonify({"ok": True, "applied": applied is not None})
+
+
 # ==================== DialogStateV2 ======================================
 
 class DialogStateV2:
@@ -1354,7 +1630,7 @@ class DialogStateV2:
         from datetime import datetime
         self.id = str(uuid.uuid4())
         self.step = "registration"
-        self.history = []
+        self.history = dialog_log.history(self.id)  # Сообщения — в журнале, в сессии только их число
         self.data = {}
         self.qa_pairs = []
         self.created_at = datetime.now().isoformat()
@@ -1364,7 +1640,7 @@ class DialogStateV2:
         return {
             "id": self.id,
             "step": self.step,
-            "history": self.history,
+            "history_len": len(self.history),
             "data": self.data,
             "qa_pairs": self.qa_pairs,
             "created_at": self.created_at,
@@ -1376,7 +1652,11 @@ class DialogStateV2:
         state = cls()
         state.id = data.get("id", state.id)
         state.step = data.get("step", "registration")
-        state.history = data.get("history", [])
+        state.history = dialog_log.history(state.id, data.get("history_len", 0))
+        if "history" in data:
+            # Сессия старого формата — история целиком в сессии, переносим в журнал
+            state.history.clear()
+            state.history.extend(data["history"])
         state.data = data.get("data", {})
         state.qa_pairs = data.get("qa_pairs", [])
         state.created_at = data.get("created_at", state.created_at)
@@ -1462,13 +1742,16 @@ def download_pdf():
     """Скачать жалобу в формате PDF для конкретного получателя"""
     from flask import send_file
     from io import BytesIO
-    from services.pdf_service import pdf_service
+    from werkzeug.exceptions import RequestedRangeNotSatisfiable
+    from services.pdf_service import pdf_service, LAYOUT_VERSION
+    from services.pdf_cache import pdf_cache, pdf_cache_key
     
     if 'dialog_state' not in session:
         return jsonify({"error": "Сессия не найдена"}), 400
     
-    # Проверяем оплату (standard или premium)
-    if not payment_service.can_download(session.get('dialog_state', {})):
+    # Проверяем оплату (standard или premium): в сессии или в правах пользователя
+    entitlement = user_service.get_entitlement(session.get('user_email'))
+    if not payment_service.can_download(session.get('dialog_state', {})) and not (entitlement and entitlement['can_download']):
         return jsonify({"error": "Оплатите тариф для скачивания PDF", "payment_required": True}), 403
     
     state_dict = session['dialog_state']
@@ -1530,33 +1813,54 @@ def download_pdf():
         final_text = final_text.replace("[адрес органа, если известен]", "")
         final_text = final_text.replace("[адрес органа]", "")
     
-    # Генерируем PDF
+    # Готовый PDF с теми же данными — с диска, иначе генерируем и кладём в кэш
+    render_date = datetime.now().strftime("%d.%m.%Y")
+    cache_key = pdf_cache_key(final_text, recipient_name, user_data, category_name,
+                              render_date, LAYOUT_VERSION)
     try:
-        pdf_bytes = pdf_service.generate_complaint_pdf(
-            complaint_text=final_text,
-            recipient_name=recipient_name,
-            user_data=user_data,
-            category_name=category_name
-        )
-        
-        # Отправляем файл
-        buffer = BytesIO(pdf_bytes)
-        buffer.seek(0)
-        
-        # Имя файла с названием получателя
-        safe_name = recipient_name.replace(" ", "_").replace("/", "_")[:30]
-        filename = f"complaint_{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=filename
-        )
+        # Файл открыт сразу: если другой воркер его вытеснит, отдача всё равно дойдёт до конца
+        pdf_file = pdf_cache.get(cache_key)
+        if pdf_file is not None:
+            stat = os.fstat(pdf_file.fileno())
+            size, modified = stat.st_size, stat.st_mtime
+        else:
+            pdf_bytes = pdf_service.generate_complaint_pdf(
+                complaint_text=final_text,
+                recipient_name=recipient_name,
+                user_data=user_data,
+                category_name=category_name,
+                render_date=render_date
+            )
+            pdf_cache.put(cache_key, pdf_bytes)  # Не удалось записать — просто отдаём из памяти
+            pdf_file, size, modified = BytesIO(pdf_bytes), len(pdf_bytes), datetime.now().timestamp()
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Ошибка генерации PDF: {str(e)}"}), 500
+    
+    # Имя файла с названием получателя
+    safe_name = recipient_name.replace(" ", "_").replace("/", "_")[:30]
+    filename = f"complaint_{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    
+    # ETag — ключ содержимого, Last-Modified — время генерации.
+    # Для открытого файла send_file не знает размер, поэтому 304 и Range включаем сами
+    response = send_file(
+        pdf_file,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=filename,
+        etag=cache_key,
+        last_modified=modified,
+        max_age=0
+    )
+    response.content_length = size
+    try:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        pdf_file.close()
+        raise
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 # ==================== ERROR HANDLERS ====================
@@ -11,9 +11,13 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'complaint-chat-secret-key-change-in-production')
     
     # Session
-    SESSION_TYPE = 'filesystem'
-    SESSION_FILE_DIR = './flask_session'
+    SESSION_TYPE = os.getenv('SESSION_TYPE', 'sqlite')  # sqlite — services/session_store.py, filesystem — Flask-Session
+    SESSION_DB = os.getenv('SESSION_DB', './data/sessions.db')
+    SESSION_GC_INTERVAL = int(os.getenv('SESSION_GC_INTERVAL', '600'))  # сек между удалениями просроченных сессий
+    SESSION_FILE_DIR = './flask_session'  # filesystem-сессии; в режиме sqlite читаются как старые при переходе
     SESSION_PERMANENT = False
+    DIALOG_LOG_DB = os.getenv('DIALOG_LOG_DB', './data/dialogs.db')  # история чатов: сообщения отдельно от сессии
+    DIALOG_LOG_TTL = int(os.getenv('DIALOG_LOG_TTL', str(90 * 86400)))  # сек: удалять диалоги без новых сообщений
     
     # LLM (OpenRouter)
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
@@ -30,6 +34,31 @@ class Config:
     
     # Perplexity для поиска контактов
     PERPLEXITY_MODEL = os.getenv('PERPLEXITY_MODEL', 'perplexity/sonar')
+    RECIPIENT_ENRICH_DEADLINE = float(os.getenv('RECIPIENT_ENRICH_DEADLINE', '25'))  # сек на обогащение всех адресатов
+    RECIPIENT_ENRICH_WORKERS = int(os.getenv('RECIPIENT_ENRICH_WORKERS', '8'))  # параллельных запросов к Perplexity
+    RECIPIENT_DETAILS_MAX_AGE = int(os.getenv('RECIPIENT_DETAILS_MAX_AGE', '86400'))  # сек: контакты с шага адресатов не перепроверяются при отправке
+    
+    # Кэш ответов внешних API
+    CACHE_DB = os.getenv('CACHE_DB', './data/cache.db')
+    CONTACTS_CACHE_TTL = int(os.getenv('CONTACTS_CACHE_TTL', str(7 * 86400)))  # контакты органа свежие неделю
+    CONTACTS_CACHE_STALE_TTL = int(os.getenv('CONTACTS_CACHE_STALE_TTL', str(30 * 86400)))  # потом ещё месяц отдаём и обновляем в фоне
+    CONTACTS_CACHE_NEGATIVE_TTL = int(os.getenv('CONTACTS_CACHE_NEGATIVE_TTL', '900'))  # неудачный поиск не повторяем 15 минут
+    CONTACTS_CACHE_MAX_ENTRIES = int(os.getenv('CONTACTS_CACHE_MAX_ENTRIES', '5000'))
+    LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(86400)))  # ответы LLM на одинаковые промпты (0 — выключить)
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+    PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', './data/pdf_cache')  # готовые PDF жалоб (services/pdf_cache.py)
+    PDF_CACHE_MAX_MB = int(os.getenv('PDF_CACHE_MAX_MB', '500'))  # сверх — удаляются давно не скачанные
+    
+    # Фоновые задачи (генерация, подбор адресатов, отправка вне HTTP-запроса)
+    JOBS_DB = os.getenv('JOBS_DB', './data/jobs.db')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))  # потоков-исполнителей на воркер gunicorn
+    JOB_LEASE = float(os.getenv('JOB_LEASE', '60'))  # сек: задачу умершего воркера подхватят после истечения аренды
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '2'))
+    
+    # Исходящие HTTP-запросы (общий пул keep-alive соединений на воркер)
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))  # сколько хостов держать в пуле
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))  # соединений на хост
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))  # сек на установку соединения
     
     # Email
     SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
@@ -40,6 +69,10 @@ class Config:
     
     # DaData API (для подсказок организаций и адресов)
     DADATA_API_KEY = os.getenv('DADATA_API_KEY', '')
+    SUGGEST_CACHE_TTL = int(os.getenv('SUGGEST_CACHE_TTL', str(6 * 3600)))  # сек: подсказки DaData в кэше воркера
+    SUGGEST_CACHE_SIZE = int(os.getenv('SUGGEST_CACHE_SIZE', '5000'))  # запросов в кэше воркера
+    EGRUL_INDEX_DIR = os.getenv('EGRUL_INDEX_DIR', './data/egrul')  # локальный индекс организаций (tools/egrul_import.py); нет каталога — только DaData
+    SUGGEST_MIN_INTERVAL = float(os.getenv('SUGGEST_MIN_INTERVAL', '0.3'))  # сек между запросами к DaData от одного поля
     
     # Beget API (автоматическое создание почты)
     BEGET_LOGIN = os.getenv('BEGET_LOGIN', '')
@@ -50,6 +83,10 @@ class Config:
     YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID', '')
     YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY', '')
     YOOKASSA_RETURN_URL = os.getenv('YOOKASSA_RETURN_URL', 'https://stuchim.ru/')
+    YOOKASSA_API_URL = os.getenv('YOOKASSA_API_URL', '')  # пусто — боевой API; для локального стенда tools/yookassa_stub.py
+    YOOKASSA_WEBHOOK_TRUSTED_IPS = os.getenv('YOOKASSA_WEBHOOK_TRUSTED_IPS', '')  # доп. адреса уведомлений (через запятую), кроме сетей ЮКассы
+    PAYMENTS_DB = os.getenv('PAYMENTS_DB', './data/payments.db')  # реестр платежей и журнал уведомлений
+    PAYMENT_RECONCILE_INTERVAL = int(os.getenv('PAYMENT_RECONCILE_INTERVAL', '60'))  # сек: сверка платежей без уведомления
     
     # Тарифы (цены в рублях)
     TARIFFS = {
@@ -117,9 +154,19 @@ class Config:
     RATELIMIT_DEFAULT = "60 per minute"
     RATELIMIT_SEND = "5 per minute"
     
+    # Analytics
+    ANALYTICS_COMPACT_INTERVAL = int(os.getenv('ANALYTICS_COMPACT_INTERVAL', '600'))  # сек между проходами компактора
+    ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '1.0'))  # сек между сбросами буфера событий
+    ANALYTICS_FLUSH_BATCH = int(os.getenv('ANALYTICS_FLUSH_BATCH', '200'))  # сбросить раньше, если накопилось столько
+    ANALYTICS_BUFFER_MAX = int(os.getenv('ANALYTICS_BUFFER_MAX', '10000'))  # ёмкость кольцевого буфера
+    
     # Drafts
     DRAFTS_DIR = './drafts'
     
     # Users
-    USERS_FILE = './data/users.json'
+    USERS_FILE = './data/users.json'  # Старый формат — переносится в USERS_DB при старте
+    USERS_DB = os.getenv('USERS_DB', './data/users.db')
+    USER_EVENTS_DIR = './data/user_events'  # Append-only лог событий, по файлу на день
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1000'))  # профилей в кэше воркера
+    USER_CACHE_CHECK_INTERVAL = float(os.getenv('USER_CACHE_CHECK_INTERVAL', '2'))  # сек: как часто сверять версию профиля с БД
 
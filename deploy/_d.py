@@ -28,13 +28,32 @@ files = [
     ('services/llm_service.py', '/opt/complaint-chat/services/llm_service.py'),
     ('services/orchestrator.py', '/opt/complaint-chat/services/orchestrator.py'),
     ('services/payment_service.py', '/opt/complaint-chat/services/payment_service.py'),
+    ('services/payment_ledger.py', '/opt/complaint-chat/services/payment_ledger.py'),
     ('services/contact_verification_service.py', '/opt/complaint-chat/services/contact_verification_service.py'),
     ('services/user_service.py', '/opt/complaint-chat/services/user_service.py'),
+    ('services/user_store.py', '/opt/complaint-chat/services/user_store.py'),
+    ('services/entitlements.py', '/opt/complaint-chat/services/entitlements.py'),
+    ('services/sqlite_db.py', '/opt/complaint-chat/services/sqlite_db.py'),
+    ('services/http_client.py', '/opt/complaint-chat/services/http_client.py'),
+    ('services/cache_store.py', '/opt/complaint-chat/services/cache_store.py'),
+    ('services/job_queue.py', '/opt/complaint-chat/services/job_queue.py'),
+    ('services/session_store.py', '/opt/complaint-chat/services/session_store.py'),
+    ('services/dialog_log.py', '/opt/complaint-chat/services/dialog_log.py'),
+    ('services/user_event_log.py', '/opt/complaint-chat/services/user_event_log.py'),
+    ('deploy/migrate_users.py', '/opt/complaint-chat/deploy/migrate_users.py'),
+    ('services/pdf_service.py', '/opt/complaint-chat/services/pdf_service.py'),
+    ('services/pdf_cache.py', '/opt/complaint-chat/services/pdf_cache.py'),
     ('services/dadata_service.py', '/opt/complaint-chat/services/dadata_service.py'),
+    ('services/suggest_cache.py', '/opt/complaint-chat/services/suggest_cache.py'),
+    ('services/suggest_guard.py', '/opt/complaint-chat/services/suggest_guard.py'),
+    ('services/egrul_index.py', '/opt/complaint-chat/services/egrul_index.py'),
     ('services/agents.py', '/opt/complaint-chat/services/agents.py'),
     ('services/beget_service.py', '/opt/complaint-chat/services/beget_service.py'),
     ('services/yandex_direct_service.py', '/opt/complaint-chat/services/yandex_direct_service.py'),
     ('services/analytics_service.py', '/opt/complaint-chat/services/analytics_service.py'),
+    ('services/analytics_storage.py', '/opt/complaint-chat/services/analytics_storage.py'),
+    ('services/analytics_index.py', '/opt/complaint-chat/services/analytics_index.py'),
+    ('services/funnel_engine.py', '/opt/complaint-chat/services/funnel_engine.py'),
     ('services/metrika_service.py', '/opt/complaint-chat/services/metrika_service.py'),
     ('data/__init__.py', '/opt/complaint-chat/data/__init__.py'),
     ('static/css/style.css', '/opt/complaint-chat/static/css/style.css'),
@@ -48,6 +67,9 @@ files = [
     ('templates/account.html', '/opt/complaint-chat/templates/account.html'),
     ('templates/admin.html', '/opt/complaint-chat/templates/admin.html'),
     ('templates/admin_login.html', '/opt/complaint-chat/templates/admin_login.html'),
+    ('deploy/gunicorn.conf.py', '/opt/complaint-chat/deploy/gunicorn.conf.py'),
+    ('deploy/complaint-chat.service', '/etc/systemd/system/complaint-chat.service'),
+    ('deploy/complaint-chat-async.service', '/etc/systemd/system/complaint-chat-async.service'),
     ('deploy/nginx-complaint-chat.conf', '/etc/nginx/sites-available/complaint-chat'),
 ]
 
@@ -88,9 +110,13 @@ out = stdout.read().decode().strip()
 print(out)
 
 print("\nRestarting service...")
-stdin, stdout, stderr = ssh.exec_command("systemctl restart complaint-chat && sleep 3 && systemctl is-active complaint-chat 2>&1; echo EXIT:$?", timeout=30)
+stdin, stdout, stderr = ssh.exec_command("systemctl daemon-reload && systemctl restart complaint-chat && sleep 3 && systemctl is-active complaint-chat 2>&1; echo EXIT:$?", timeout=30)
 print("Result:", stdout.read().decode().strip())
 
+# Асинхронный сервис необязателен — перезапускаем, только если он включён (systemctl enable complaint-chat-async)
+stdin, stdout, stderr = ssh.exec_command("systemctl is-enabled --quiet complaint-chat-async && systemctl restart complaint-chat-async && sleep 3 && systemctl is-active complaint-chat-async 2>&1; echo EXIT:$?", timeout=30)
+print("Async:", stdout.read().decode().strip())
+
 print("Reloading nginx...")
 stdin, stdout, stderr = ssh.exec_command("nginx -t 2>&1 && systemctl reload nginx && echo OK; echo EXIT:$?", timeout=20)
 print("nginx:", stdout.read().decode().strip())
@@ -1,14 +1,12 @@
 """Создание тестовых аккаунтов"""
-import json, os, sys
+import os, sys
 sys.path.insert(0, '/opt/complaint-chat')
+os.chdir('/opt/complaint-chat')
 from werkzeug.security import generate_password_hash
 from datetime import datetime
+from services.user_service import user_service
 
-users_file = '/opt/complaint-chat/data/users.json'
-with open(users_file, 'r', encoding='utf-8') as f:
-    users = json.load(f)
-
-users['test-annual@stuchim.ru'] = {
+user_service.import_user('test-annual@stuchim.ru', {
     'name': 'Тест Годовой',
     'password_hash': generate_password_hash('test123'),
     'password_raw': 'test123',
@@ -19,9 +17,9 @@ users['test-annual@stuchim.ru'] = {
     'address': 'г. Москва, ул. Тестовая, д. 1',
     'payments': [{'amount': 2900, 'status': 'succeeded', 'tariff': 'annual', 'tariff_name': 'Годовой', 'payment_id': 'test_annual_001', 'recorded_at': datetime.now().isoformat()}],
     'complaints': [], 'events': [],
-}
+})
 
-users['test-basic@stuchim.ru'] = {
+user_service.import_user('test-basic@stuchim.ru', {
     'name': 'Тест Базовый',
     'password_hash': generate_password_hash('test123'),
     'password_raw': 'test123',
@@ -32,9 +30,6 @@ users['test-basic@stuchim.ru'] = {
     'address': 'г. Челябинск, ул. Примерная, д. 5',
     'payments': [{'amount': 290, 'status': 'succeeded', 'tariff': 'standard', 'tariff_name': 'Стандартный', 'payment_id': 'test_basic_001', 'recorded_at': datetime.now().isoformat()}],
     'complaints': [], 'events': [],
-}
-
-with open(users_file, 'w', encoding='utf-8') as f:
-    json.dump(users, f, ensure_ascii=False, indent=2)
+})
 
-print(f'OK! Users: {len(users)}')
+print(f'OK! Users: {user_service.store.count()}')
@@ -0,0 +1,53 @@
+"""
+Конфигурация gunicorn для complaint-chat
+Запуск: gunicorn -c deploy/gunicorn.conf.py app:app
+
+Асинхронный режим (complaint-chat-async.service): GUNICORN_WORKER_CLASS=gevent.
+gevent подменяет сокеты и потоки на кооперативные, поэтому один воркер держит
+сотни одновременных ожиданий OpenRouter/Perplexity/DaData без изменения кода.
+SQLite под gevent не кооперативен: запрос и ожидание блокировки (busy_timeout до 10 с)
+выполняются в C и останавливают весь воркер, а не один запрос. Поэтому в транзакциях
+нельзя ходить в сеть, а долгие записи лучше оставить sync-сервису.
+Соединения SQLite берутся из пула процесса (services/sqlite_db.py), а не открываются на каждый greenlet.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+timeout = 120
+
+if worker_class == 'gevent':
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))  # одновременных запросов на воркер
+
+
+def worker_exit(server, worker):
+    """Дописать буфер событий аналитики и вернуть в очередь незавершённые задачи"""
+    try:
+        from services.analytics_service import analytics_service
+        analytics_service.flush()
+    except Exception as e:
+        print(f'[gunicorn] Analytics flush on exit failed: {e}')
+    try:
+        # Незавершённые задачи этого воркера сразу вернуть в очередь
+        from services.job_queue import job_queue
+        job_queue.release()
+    except Exception as e:
+        print(f'[gunicorn] Job queue release failed: {e}')
+
+
+def post_worker_init(worker):
+    """
+    Запустить исполнителей очереди задач сразу — подхватить задачи, оставшиеся от прошлого воркера.
+    Прогреть генератор PDF: импорт reportlab и разбор TTF не должны достаться первой загрузке
+    """
+    try:
+        from services.job_queue import job_queue
+        job_queue.start()
+    except Exception as e:
+        print(f'[gunicorn] Job queue start failed: {e}')
+    try:
+        from services.pdf_service import pdf_service
+        pdf_service.warm_up()
+    except Exception as e:
+        print(f'[gunicorn] PDF warm-up failed: {e}')
@@ -0,0 +1,22 @@
+"""Перенос data/users.json в SQLite (data/users.db)
+
+Обычно миграция выполняется автоматически при старте приложения.
+Скрипт нужен для ручного запуска: python deploy/migrate_users.py [users.json] [users.db]
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+from services.user_store import UserStore
+from services.user_event_log import UserEventLog
+
+json_path = sys.argv[1] if len(sys.argv) > 1 else Config.USERS_FILE
+db_path = sys.argv[2] if len(sys.argv) > 2 else Config.USERS_DB
+
+store = UserStore(db_path)
+# События пользователей — в тот же лог, что пишет UserService, иначе они пропадут вместе с users.json
+event_log = UserEventLog(getattr(Config, 'USER_EVENTS_DIR', './data/user_events'))
+migrated = store.migrate_from_json(json_path, event_sink=event_log.append)
+if migrated:
+    print(f'OK! Migrated {migrated} users into {db_path}')
+else:
+    print(f'Nothing to migrate (users in DB: {store.count()})')
@@ -4,8 +4,9 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
 import json
+import time
 from services.llm_service import llm_service
 from data.recipients import RECIPIENTS, RECIPIENT_RECOMMENDATIONS
 from config import Config
@@ -22,13 +23,14 @@ class SubAgent(ABC):
         """Основной метод обработки"""
         pass
     
-    def _call_llm(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, model: Optional[str] = None) -> Optional[str]:
-        """Вызов LLM с заданными промптами"""
+    def _call_llm(self, system_prompt: str, user_prompt: str, temperature: float = 0.7, model: Optional[str] = None,
+                  cache: bool = False) -> Optional[str]:
+        """Вызов LLM с заданными промптами (cache=True — одинаковые промпты из кэша)"""
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
-        return llm_service._make_request(messages, temperature=temperature, model_override=model)
+        return llm_service._make_request(messages, temperature=temperature, model_override=model, cache=cache)
 
 
 class QuizAgent(SubAgent):
@@ -305,7 +307,8 @@ class QuizAgent(SubAgent):
 
 JSON:"""
         
-        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.4)
+        # Тот же контекст (категория, заявитель, ответы) — тот же вопрос: берём из кэша
+        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.4, cache=True)
         
         if result:
             json_str = llm_service._extract_json(result)
@@ -449,7 +452,33 @@ email: [email]
 
     def process(self, context: Dict) -> Dict:
         """Генерирует текст жалобы (или перегенерирует с учётом правок)"""
+        user_prompt = self._build_prompt(context)
         
+        # Используем Claude Sonnet 4.5 для написания текста жалобы
+        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.7, model=Config.COMPLAINT_MODEL)
+        
+        if result:
+            return {
+                "success": True,
+                "complaint_text": result.strip(),
+                "can_edit": True
+            }
+        
+        return {
+            "success": False,
+            "error": "Не удалось сгенерировать жалобу"
+        }
+    
+    def stream(self, context: Dict) -> Iterator[str]:
+        """То же, что process, но текст жалобы отдаётся кусками по мере генерации"""
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self._build_prompt(context)}
+        ]
+        return llm_service.stream_request(messages, temperature=0.7, model_override=Config.COMPLAINT_MODEL)
+    
+    def _build_prompt(self, context: Dict) -> str:
+        """Промпт для генерации (или перегенерации с правками) жалобы"""
         qa_pairs = context.get("qa_pairs", [])
         category_name = context.get("category_name", "Общая жалоба")
         user_data = context.get("user_data", {})
@@ -550,20 +579,7 @@ Email: {user_data.get('email', '[Email]')}
 ⚠️ ВАЖНО: Текст должен быть БЕЗ MARKDOWN — никаких звёздочек, решёток, форматирования!
 Напиши ПОЛНЫЙ текст жалобы. Шапку оставь с плейсхолдером [название органа] — получатель будет выбран позже."""
         
-        # Используем Claude Sonnet 4.5 для написания текста жалобы
-        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.7, model=Config.COMPLAINT_MODEL)
-        
-        if result:
-            return {
-                "success": True,
-                "complaint_text": result.strip(),
-                "can_edit": True
-            }
-        
-        return {
-            "success": False,
-            "error": "Не удалось сгенерировать жалобу"
-        }
+        return user_prompt
 
 
 class RecipientAgent(SubAgent):
@@ -708,7 +724,8 @@ class RecipientAgent(SubAgent):
 JSON:"""
         
         # Используем Claude Opus 4.6 для определения адресатов
-        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.3, model=Config.RECIPIENT_MODEL)
+        # Возврат назад и повторный выбор адресатов не оплачиваются заново
+        result = self._call_llm(self.system_prompt, user_prompt, temperature=0.3, model=Config.RECIPIENT_MODEL, cache=True)
         
         if result:
             json_str = llm_service._extract_json(result)
@@ -801,6 +818,7 @@ class SendAgent(SubAgent):
         recipients = context.get("selected_recipients", [])
         user_data = context.get("user_data", {})
         category_name = context.get("category_name", "")
+        recipient_details = dict(context.get("recipient_details") or {})
         
         results = []
         
@@ -818,12 +836,8 @@ class SendAgent(SubAgent):
                 "status": "ready"
             }
             
-            # СНАЧАЛА получаем актуальные контакты через Perplexity
-            print(f"SendAgent: Fetching fresh contacts for {recipient_name} via Perplexity...")
-            verified = self.verification_service.verify_and_get_contacts(
-                recipient_name, 
-                category_name
-            )
+            # Контакты с шага выбора адресатов, если они есть и не устарели
+            verified = self._resolve_contacts(recipient_id, recipient_name, category_name, recipient_details)
             
             # Используем свежие данные от Perplexity если получены
             if verified.get("verified"):
@@ -883,9 +897,25 @@ class SendAgent(SubAgent):
             "results": results,
             "total_recipients": len(results),
             "user_data": user_data,
-            "category_name": category_name
+            "category_name": category_name,
+            "recipient_details": recipient_details
         }
     
+    def _resolve_contacts(self, recipient_id: str, recipient_name: str, category_name: str,
+                          recipient_details: Dict) -> Dict:
+        """Уже найденные контакты адресата или свежий запрос через Perplexity (если нет / устарели)"""
+        details = recipient_details.get(recipient_id) if recipient_id else None
+        max_age = getattr(Config, 'RECIPIENT_DETAILS_MAX_AGE', 86400)
+        if details and not details.get("error") and time.time() - details.get("fetched_at", 0) < max_age:
+            print(f"SendAgent: Reusing contacts for {recipient_name} from recipients step")
+            return details
+        
+        print(f"SendAgent: Fetching fresh contacts for {recipient_name} via Perplexity...")
+        verified = self.verification_service.verify_and_get_contacts(recipient_name, category_name)
+        if recipient_id and verified and not verified.get("error"):
+            recipient_details[recipient_id] = verified  # fetched_at проставлен кэшем контактов
+        return verified
+    
     def _generate_mailto_link(
         self, 
         email: str, 
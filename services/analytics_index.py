@@ -0,0 +1,119 @@
+"""
+Индекс посетителей аналитики — vid -> (партиция, смещение строки)
+data/analytics/visitors.db (SQLite). Сырые партиции остаются источником истины:
+индекс дописывается при сбросе буфера log_event и догоняет хвосты партиций перед чтением,
+а если БД пропала или партиция переписана — перестраивается из сырого лога.
+"""
+import json
+import os
+from typing import Dict, List, Tuple
+
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visitor_events (
+    vid     TEXT NOT NULL,
+    day     TEXT NOT NULL,
+    offset  INTEGER NOT NULL,
+    PRIMARY KEY (day, offset)
+);
+CREATE INDEX IF NOT EXISTS idx_visitor_events_vid ON visitor_events(vid, day, offset);
+
+-- Сколько байт каждой партиции уже проиндексировано
+CREATE TABLE IF NOT EXISTS indexed_parts (
+    day   TEXT PRIMARY KEY,
+    size  INTEGER NOT NULL
+);
+"""
+
+
+class VisitorIndex:
+    """Постоянный индекс событий по visitor_id поверх дневных партиций"""
+
+    def __init__(self, storage, db_path: str):
+        self.storage = storage
+        self.db_path = db_path
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def add_batch(self, day: str, rows: List[Tuple[str, int]], start: int, end: int):
+        """Проиндексировать только что записанную пачку строк [start, end) партиции"""
+        with transaction(self._conn()) as conn:
+            conn.executemany('INSERT OR IGNORE INTO visitor_events (vid, day, offset) VALUES (?, ?, ?)',
+                             [(str(vid), day, offset) for vid, offset in rows])
+            # Сдвигаем границу, только если пачка легла сразу за проиндексированной частью,
+            # иначе пробел закроет catch_up
+            if start == 0:
+                conn.execute('INSERT OR IGNORE INTO indexed_parts (day, size) VALUES (?, 0)', (day,))
+            conn.execute('UPDATE indexed_parts SET size = ? WHERE day = ? AND size = ?',
+                         (end, day, start))
+
+    def catch_up(self):
+        """Дочитать непроиндексированные хвосты партиций; переписанные партиции — заново"""
+        days = self.storage.days()
+        with transaction(self._conn()) as conn:
+            indexed = {r['day']: r['size'] for r in conn.execute('SELECT day, size FROM indexed_parts')}
+            for day in set(indexed) - set(days):
+                conn.execute('DELETE FROM visitor_events WHERE day = ?', (day,))
+                conn.execute('DELETE FROM indexed_parts WHERE day = ?', (day,))
+            for day in days:
+                try:
+                    size = os.path.getsize(self.storage.raw_path(day))
+                except OSError:
+                    continue
+                start = indexed.get(day, 0)
+                if size < start:
+                    # Партиция стала короче — индекс по ней устарел
+                    print(f'[Analytics] Visitor index for {day} is stale, rebuilding')
+                    conn.execute('DELETE FROM visitor_events WHERE day = ?', (day,))
+                    start = 0
+                if size == start and day in indexed:
+                    continue
+                end = self._index_tail(conn, day, start)
+                conn.execute('INSERT OR REPLACE INTO indexed_parts (day, size) VALUES (?, ?)', (day, end))
+
+    def _index_tail(self, conn, day: str, start: int) -> int:
+        """Проиндексировать строки партиции с позиции start; вернуть конец последней целой строки"""
+        with open(self.storage.raw_path(day), 'rb') as f:
+            f.seek(start)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1
+        rows = []
+        offset = start
+        for raw in chunk[:end].splitlines(keepends=True):
+            try:
+                vid = json.loads(raw).get('vid')
+            except ValueError:
+                vid = None
+            if vid:
+                rows.append((str(vid), day, offset))
+            offset += len(raw)
+        conn.executemany('INSERT OR IGNORE INTO visitor_events (vid, day, offset) VALUES (?, ?, ?)', rows)
+        return start + end
+
+    def get_events(self, vid: str) -> List[Dict]:
+        """События посетителя: выборка смещений из индекса и чтение строк по ним"""
+        self.catch_up()
+        refs = self._conn().execute(
+            'SELECT day, offset FROM visitor_events WHERE vid = ? ORDER BY day, offset', (vid,)).fetchall()
+        events = []
+        handles = {}
+        try:
+            for r in refs:
+                f = handles.get(r['day'])
+                if f is None:
+                    f = handles[r['day']] = open(self.storage.raw_path(r['day']), 'rb')
+                f.seek(r['offset'])
+                try:
+                    events.append(json.loads(f.readline()))
+                except ValueError:
+                    continue
+        except OSError as e:
+            print(f'[Analytics] Error reading visitor {vid}: {e}')
+        finally:
+            for f in handles.values():
+                f.close()
+        return events
@@ -1,14 +1,21 @@
 """
 Сервис аналитики воронки — JSON-based event logging
-Логирует каждый переход шага для каждого посетителя
+Логирует каждый переход шага для каждого посетителя.
+События лежат в дневных партициях (см. services/analytics_storage.py).
+log_event только кладёт событие в кольцевой буфер — на диск пачками пишет фоновый поток
 """
+import atexit
 import json
 import os
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, deque, OrderedDict
 import threading
+from config import Config
+from services.analytics_storage import AnalyticsStorage, utm_key
+from services.analytics_index import VisitorIndex
+from services.funnel_engine import FunnelEngine
 
 
 class AnalyticsService:
@@ -37,17 +44,33 @@ class AnalyticsService:
     
     def __init__(self, data_dir='./data'):
         self.data_dir = data_dir
-        self.events_file = os.path.join(data_dir, 'analytics_events.jsonl')
+        self.engine = FunnelEngine(self.FUNNEL_STEPS.keys())
         self._lock = threading.Lock()
         os.makedirs(data_dir, exist_ok=True)
+        self.storage = AnalyticsStorage(
+            data_dir, list(self.FUNNEL_STEPS.keys()),
+            compact_interval=getattr(Config, 'ANALYTICS_COMPACT_INTERVAL', 600))
+        self.visitor_index = VisitorIndex(self.storage, os.path.join(self.storage.base_dir, 'visitors.db'))
+        
+        # Кольцевой буфер (day, vid, line): при переполнении вытесняются самые старые события
+        self._buffer = deque(maxlen=getattr(Config, 'ANALYTICS_BUFFER_MAX', 10000))
+        self._dropped = 0
+        self.flush_interval = getattr(Config, 'ANALYTICS_FLUSH_INTERVAL', 1.0)
+        self.flush_batch = getattr(Config, 'ANALYTICS_FLUSH_BATCH', 200)
+        self._flush_wakeup = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+        atexit.register(self.flush)
     
     def log_event(self, visitor_id: str, step: str, sub_step: str = '',
                   utm_data: Optional[Dict] = None, ip: str = '', 
                   user_agent: str = '', extra: Optional[Dict] = None):
-        """Записать одно событие в JSONL файл"""
+        """Записать одно событие в партицию текущего дня"""
+        now = datetime.now()
         event = {
             'vid': visitor_id,
-            'ts': datetime.now().isoformat(),
+            'ts': now.isoformat(),
             'step': step,
             'sub': sub_step,
             'utm_term': (utm_data or {}).get('utm_term', ''),
@@ -60,35 +83,87 @@ class AnalyticsService:
         if extra:
             event['extra'] = extra
         
+        self.storage.ensure_compactor()
+        self._ensure_flusher()
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append((now.strftime('%Y-%m-%d'), visitor_id,
+                             json.dumps(event, ensure_ascii=False) + '\n'))
+        if len(self._buffer) >= self.flush_batch:
+            self._flush_wakeup.set()
+    
+    def flush(self):
+        """Записать накопленные события: одна пачка на партицию дня, затем индекс посетителей"""
         with self._lock:
+            batch = []
+            while self._buffer:
+                try:
+                    batch.append(self._buffer.popleft())
+                except IndexError:
+                    break
+            if self._dropped:
+                print(f"[Analytics] Buffer overflow, dropped {self._dropped} events")
+                self._dropped = 0
+            if not batch:
+                return
+            
+            by_day = OrderedDict()
+            for day, vid, line in batch:
+                by_day.setdefault(day, []).append((vid, line.encode('utf-8')))
+            
+            for day, items in by_day.items():
+                data = b''.join(raw for _, raw in items)
+                try:
+                    start = self.storage.append_bytes(day, data)
+                except Exception as e:
+                    print(f"[Analytics] Error writing {len(items)} events: {e}")
+                    continue
+                rows = []
+                offset = start
+                for vid, raw in items:
+                    rows.append((vid, offset))
+                    offset += len(raw)
+                try:
+                    self.visitor_index.add_batch(day, rows, start, offset)
+                except Exception as e:
+                    # Не критично: индекс догонит партицию при следующем чтении
+                    print(f"[Analytics] Error indexing events: {e}")
+    
+    def _ensure_flusher(self):
+        """Запустить фоновый поток сброса буфера в текущем процессе (лениво, после fork)"""
+        pid = os.getpid()
+        if self._flusher is not None and self._flusher_pid == pid and self._flusher.is_alive():
+            return
+        with self._flusher_lock:
+            if self._flusher is not None and self._flusher_pid == pid and self._flusher.is_alive():
+                return
+            self._flusher_pid = pid
+            self._flusher = threading.Thread(target=self._flusher_loop, name='analytics-flusher', daemon=True)
+            self._flusher.start()
+    
+    def _flusher_loop(self):
+        while True:
+            self._flush_wakeup.wait(self.flush_interval)
+            self._flush_wakeup.clear()
             try:
-                with open(self.events_file, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+                self.flush()
             except Exception as e:
-                print(f"[Analytics] Error writing event: {e}")
+                print(f"[Analytics] Flusher error: {e}")
     
     def _read_events(self, date_from: Optional[str] = None, 
                      date_to: Optional[str] = None) -> List[Dict]:
-        """Прочитать все события, опционально с фильтром по дате"""
+        """Прочитать события, опционально с фильтром по дате (читаются только нужные партиции)"""
         events = []
-        if not os.path.exists(self.events_file):
-            return events
-        
         try:
-            with open(self.events_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        ev = json.loads(line)
+            for day in self.storage.days_in_range(self.storage.days(), date_from, date_to):
+                full_day = self.storage.day_fully_covered(day, date_from, date_to)
+                for ev in self.storage.iter_day(day):
+                    if not full_day:
                         if date_from and ev['ts'] < date_from:
                             continue
                         if date_to and ev['ts'] > date_to:
                             continue
-                        events.append(ev)
-                    except json.JSONDecodeError:
-                        continue
+                    events.append(ev)
         except Exception as e:
             print(f"[Analytics] Error reading events: {e}")
         
@@ -98,29 +173,40 @@ class AnalyticsService:
                    date_to: Optional[str] = None,
                    utm_filter: Optional[str] = None) -> Dict:
         """Агрегированная воронка: сколько уникальных посетителей на каждом шаге"""
-        events = self._read_events(date_from, date_to)
+        self.storage.ensure_compactor()
+        self.flush()
+        step_bits = self.engine.step_bits
+        utm_needle = utm_filter.lower() if utm_filter else None
         
-        if utm_filter:
-            events = [e for e in events if utm_filter.lower() in 
-                      (e.get('utm_term', '') + e.get('utm_campaign', '')).lower()]
-        
-        # Для каждого visitor_id найти максимальный достигнутый шаг
-        visitor_max_step = {}  # vid -> set of reached steps
-        step_keys = list(self.FUNNEL_STEPS.keys())
-        
-        for ev in events:
-            vid = ev['vid']
-            step = ev['step']
-            if vid not in visitor_max_step:
-                visitor_max_step[vid] = set()
-            visitor_max_step[vid].add(step)
+        # vid -> битовая маска достигнутых шагов (объединяем по всем дням)
+        visitor_max_step = {}
+        for day in self.storage.days_in_range(self.storage.days(), date_from, date_to):
+            rollup = None
+            if self.storage.day_fully_covered(day, date_from, date_to):
+                rollup = self.storage.read_rollup(day)
+            if rollup is not None:
+                # Закрытый день целиком — берём готовую свёртку
+                for vid, key, mask in rollup:
+                    if utm_needle and utm_needle not in key:
+                        continue
+                    visitor_max_step[vid] = visitor_max_step.get(vid, 0) | mask
+                continue
+            for ev in self.storage.iter_day(day):
+                if date_from and ev['ts'] < date_from:
+                    continue
+                if date_to and ev['ts'] > date_to:
+                    continue
+                if utm_needle and utm_needle not in utm_key(ev):
+                    continue
+                vid = ev['vid']
+                visitor_max_step[vid] = visitor_max_step.get(vid, 0) | step_bits.get(ev['step'], 0)
         
         total = len(visitor_max_step)
         
-        # Считаем сколько посетителей достигли каждого шага
+        # Сколько посетителей достигли каждого шага — один проход по маскам
+        counts = self.engine.count(visitor_max_step.values())
         funnel = []
-        for step_key, step_name in self.FUNNEL_STEPS.items():
-            count = sum(1 for steps in visitor_max_step.values() if step_key in steps)
+        for (step_key, step_name), count in zip(self.FUNNEL_STEPS.items(), counts):
             pct = round(count / total * 100, 1) if total > 0 else 0
             funnel.append({
                 'step': step_key,
@@ -143,18 +229,19 @@ class AnalyticsService:
                      date_to: Optional[str] = None,
                      utm_filter: Optional[str] = None) -> Dict:
         """Список уникальных посетителей с их последним шагом"""
+        self.flush()
         events = self._read_events(date_from, date_to)
         
         if utm_filter:
-            events = [e for e in events if utm_filter.lower() in
-                      (e.get('utm_term', '') + e.get('utm_campaign', '')).lower()]
+            events = [e for e in events if utm_filter.lower() in utm_key(e)]
         
         # Группируем по visitor_id
         visitors = {}
-        step_keys = list(self.FUNNEL_STEPS.keys())
+        step_id = self.engine.step_id
         
         for ev in events:
             vid = ev['vid']
+            cur_idx = step_id(ev['step'])
             if vid not in visitors:
                 visitors[vid] = {
                     'id': vid,
@@ -169,6 +256,7 @@ class AnalyticsService:
                     'steps': set(),
                     'last_step': ev['step'],
                     'last_sub': ev.get('sub', ''),
+                    'last_idx': cur_idx,
                     'event_count': 0,
                 }
             v = visitors[vid]
@@ -176,17 +264,17 @@ class AnalyticsService:
             v['steps'].add(ev['step'])
             v['event_count'] += 1
             # Track deepest step
-            cur_idx = step_keys.index(ev['step']) if ev['step'] in step_keys else -1
-            last_idx = step_keys.index(v['last_step']) if v['last_step'] in step_keys else -1
-            if cur_idx >= last_idx:
+            if cur_idx >= v['last_idx']:
                 v['last_step'] = ev['step']
                 v['last_sub'] = ev.get('sub', '')
+                v['last_idx'] = cur_idx
         
         # Convert sets and sort by last_seen DESC
         visitor_list = []
         for v in visitors.values():
             v['step_count'] = len(v['steps'])
-            v['steps'] = sorted(v['steps'], key=lambda s: step_keys.index(s) if s in step_keys else 999)
+            del v['last_idx']
+            v['steps'] = sorted(v['steps'], key=lambda s: step_id(s) if s in self.engine.step_ids else 999)
             v['last_step_name'] = self.FUNNEL_STEPS.get(v['last_step'], v['last_step'])
             # Duration
             try:
@@ -219,9 +307,13 @@ class AnalyticsService:
         }
     
     def get_visitor_events(self, visitor_id: str) -> List[Dict]:
-        """Все события конкретного посетителя"""
-        events = self._read_events()
-        return [e for e in events if e['vid'] == visitor_id]
+        """Все события конкретного посетителя (по индексу, без полного скана)"""
+        self.flush()
+        try:
+            return self.visitor_index.get_events(visitor_id)
+        except Exception as e:
+            print(f"[Analytics] Visitor index unavailable, scanning partitions: {e}")
+            return [e for e in self._read_events() if e['vid'] == visitor_id]
 
 
 # Singleton
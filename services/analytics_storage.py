@@ -0,0 +1,333 @@
+"""
+Хранилище событий аналитики — дневные партиции + колоночные файлы + роллапы
+
+data/analytics/raw/YYYY-MM-DD.jsonl     — сырые события дня (источник истины, append-only)
+data/analytics/columnar/YYYY-MM-DD.json — закрытый день в колоночном виде:
+                                          словари строк (vid/step/utm...) + массивы id и времени
+data/analytics/rollups/YYYY-MM-DD.json  — свёртка дня для воронки: [vid, utm_key, маска шагов]
+
+Колоночные файлы и роллапы строит фоновый компактор для уже закончившихся дней.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl  # Нет на Windows — там межпроцессная блокировка не нужна (один процесс)
+except ImportError:
+    fcntl = None
+
+
+# Строковые колонки, которые кодируются через словарь
+DICT_COLUMNS = ('vid', 'step', 'sub', 'utm_term', 'utm_source', 'utm_medium', 'utm_campaign', 'ip', 'ua')
+
+
+def _day_start(day: str) -> datetime:
+    return datetime.strptime(day, '%Y-%m-%d')
+
+
+def _ts_to_offset(ts: str, day_start: datetime) -> int:
+    """Время события -> микросекунды от начала дня партиции"""
+    delta = datetime.fromisoformat(ts) - day_start
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def utm_key(event: Dict) -> str:
+    """Строка, по которой работает фильтр utm в админке"""
+    return (event.get('utm_term', '') + event.get('utm_campaign', '')).lower()
+
+
+def _write_json_atomic(path: str, data):
+    tmp = f'{path}.tmp.{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+class _FileLock:
+    """Неблокирующий flock: компактирует только один воркер"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def acquire(self) -> bool:
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            os.close(self.fd)
+            self.fd = None
+            return False
+
+    def release(self):
+        if self.fd is not None:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class AnalyticsStorage:
+    """Партиционированное хранилище событий воронки"""
+
+    def __init__(self, data_dir: str, funnel_steps: List[str], compact_interval: int = 600):
+        self.data_dir = data_dir
+        self.base_dir = os.path.join(data_dir, 'analytics')
+        self.raw_dir = os.path.join(self.base_dir, 'raw')
+        self.columnar_dir = os.path.join(self.base_dir, 'columnar')
+        self.rollup_dir = os.path.join(self.base_dir, 'rollups')
+        for d in (self.raw_dir, self.columnar_dir, self.rollup_dir):
+            os.makedirs(d, exist_ok=True)
+        self.funnel_steps = list(funnel_steps)
+        self.compact_interval = compact_interval
+        self._compactor = None
+        self._compactor_pid = None
+        self._migrate_legacy(os.path.join(data_dir, 'analytics_events.jsonl'))
+
+    # ==================== PATHS ====================
+
+    def raw_path(self, day: str) -> str:
+        return os.path.join(self.raw_dir, f'{day}.jsonl')
+
+    def columnar_path(self, day: str) -> str:
+        return os.path.join(self.columnar_dir, f'{day}.json')
+
+    def rollup_path(self, day: str) -> str:
+        return os.path.join(self.rollup_dir, f'{day}.json')
+
+    def days(self) -> List[str]:
+        """Все дни, за которые есть события (по возрастанию)"""
+        return sorted(name[:-len('.jsonl')] for name in os.listdir(self.raw_dir) if name.endswith('.jsonl'))
+
+    @staticmethod
+    def days_in_range(days: List[str], date_from: Optional[str], date_to: Optional[str]) -> List[str]:
+        """Отсечение партиций по диапазону (границы — строки ISO, как ts событий)"""
+        return [d for d in days
+                if (not date_from or d >= date_from[:10]) and (not date_to or d <= date_to[:10])]
+
+    @staticmethod
+    def day_fully_covered(day: str, date_from: Optional[str], date_to: Optional[str]) -> bool:
+        """Весь день попадает в диапазон — можно брать роллап без пособытийного фильтра"""
+        if date_from and date_from > day:
+            return False
+        if date_to and date_to < f'{day}T23:59:59.999999':
+            return False
+        return True
+
+    # ==================== WRITE ====================
+
+    def append_line(self, day: str, line: str) -> Tuple[int, int]:
+        """Дописать строку в партицию дня одной операцией write; вернуть (смещение, длину)"""
+        data = line.encode('utf-8')
+        return self.append_bytes(day, data), len(data)
+
+    def append_bytes(self, day: str, data: bytes) -> int:
+        """
+        Дописать пачку строк в партицию одним write (O_APPEND) под flock,
+        чтобы строки разных воркеров не перемешивались. Вернуть смещение начала пачки
+        """
+        fd = os.open(self.raw_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            # После записи с O_APPEND позиция — конец именно нашей пачки
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)  # flock снимается вместе с закрытием дескриптора
+        return end - len(data)
+
+    def _migrate_legacy(self, legacy_path: str):
+        """Разложить старый analytics_events.jsonl по дневным партициям (один раз)"""
+        if not os.path.exists(legacy_path):
+            return
+        lock = _FileLock(os.path.join(self.base_dir, '.migrate.lock'))
+        if not lock.acquire():
+            return
+        try:
+            if not os.path.exists(legacy_path):
+                return
+            by_day: Dict[str, List[str]] = {}
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        ts = json.loads(line).get('ts', '')
+                    except json.JSONDecodeError:
+                        continue
+                    by_day.setdefault(ts[:10] or 'unknown', []).append(line + '\n')
+            for day, lines in by_day.items():
+                self.append_line(day, ''.join(lines))
+            os.replace(legacy_path, legacy_path + '.migrated')
+            print(f'[Analytics] Migrated {sum(len(v) for v in by_day.values())} events into {len(by_day)} daily partitions')
+        finally:
+            lock.release()
+
+    # ==================== READ ====================
+
+    def _columnar_fresh(self, day: str) -> Optional[Dict]:
+        """Колоночный файл дня, если он построен по актуальной версии сырой партиции"""
+        try:
+            with open(self.columnar_path(day), 'r', encoding='utf-8') as f:
+                col = json.load(f)
+            if col.get('source_size') == os.path.getsize(self.raw_path(day)):
+                return col
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _iter_raw(self, day: str) -> Iterator[Dict]:
+        try:
+            with open(self.raw_path(day), 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except OSError as e:
+            print(f"[Analytics] Error reading partition {day}: {e}")
+
+    @staticmethod
+    def _iter_columnar(col: Dict) -> Iterator[Dict]:
+        dicts = col['dict']
+        cols = col['cols']
+        day_start = _day_start(col['day'])
+        extra = col.get('extra', {})
+        for i in range(col['rows']):
+            ev = {
+                'vid': dicts['vid'][cols['vid'][i]],
+                'ts': (day_start + timedelta(microseconds=cols['ts'][i])).isoformat(),
+            }
+            for name in DICT_COLUMNS[1:]:
+                ev[name] = dicts[name][cols[name][i]]
+            if str(i) in extra:
+                ev['extra'] = extra[str(i)]
+            yield ev
+
+    def iter_day(self, day: str) -> Iterator[Dict]:
+        """События дня: из колоночного файла, если он свежий, иначе из JSONL"""
+        col = self._columnar_fresh(day)
+        if col is not None:
+            return self._iter_columnar(col)
+        return self._iter_raw(day)
+
+    def read_rollup(self, day: str) -> Optional[List[list]]:
+        """Свёртка дня [[vid, utm_key, mask], ...] в битах текущего порядка шагов"""
+        try:
+            with open(self.rollup_path(day), 'r', encoding='utf-8') as f:
+                rollup = json.load(f)
+            if rollup.get('source_size') != os.path.getsize(self.raw_path(day)):
+                return None
+        except (OSError, ValueError):
+            return None
+        rows = rollup['visitors']
+        if rollup.get('steps') != self.funnel_steps:
+            # Порядок шагов поменялся — перекладываем биты
+            bit_map = [(1 << self.funnel_steps.index(s)) if s in self.funnel_steps else 0
+                       for s in rollup.get('steps', [])]
+            remapped = []
+            for vid, key, mask in rows:
+                new_mask = 0
+                for i, bit in enumerate(bit_map):
+                    if mask >> i & 1:
+                        new_mask |= bit
+                remapped.append([vid, key, new_mask])
+            rows = remapped
+        return rows
+
+    # ==================== COMPACTION ====================
+
+    def compact_day(self, day: str):
+        """Построить колоночный файл и роллап воронки для одного дня"""
+        source_size = os.path.getsize(self.raw_path(day))
+        day_start = _day_start(day)
+        step_bits = {s: 1 << i for i, s in enumerate(self.funnel_steps)}
+
+        dicts = {name: [] for name in DICT_COLUMNS}
+        ids = {name: {} for name in DICT_COLUMNS}
+        cols = {name: [] for name in DICT_COLUMNS}
+        cols['ts'] = []
+        extra = {}
+        masks: Dict[tuple, int] = {}
+
+        rows = 0
+        for ev in self._iter_raw(day):
+            for name in DICT_COLUMNS:
+                value = ev.get(name, '')
+                idx = ids[name].get(value)
+                if idx is None:
+                    idx = ids[name][value] = len(dicts[name])
+                    dicts[name].append(value)
+                cols[name].append(idx)
+            cols['ts'].append(_ts_to_offset(ev['ts'], day_start))
+            if ev.get('extra'):
+                extra[str(rows)] = ev['extra']
+            key = (ev.get('vid', ''), utm_key(ev))
+            masks[key] = masks.get(key, 0) | step_bits.get(ev.get('step'), 0)
+            rows += 1
+
+        _write_json_atomic(self.columnar_path(day), {
+            'day': day,
+            'rows': rows,
+            'source_size': source_size,
+            'dict': dicts,
+            'cols': cols,
+            'extra': extra,
+        })
+        _write_json_atomic(self.rollup_path(day), {
+            'day': day,
+            'source_size': source_size,
+            'steps': self.funnel_steps,
+            'visitors': [[vid, key, mask] for (vid, key), mask in masks.items()],
+        })
+
+    def compact(self):
+        """Сжать все закрытые дни, у которых нет свежего колоночного файла"""
+        lock = _FileLock(os.path.join(self.base_dir, '.compact.lock'))
+        if not lock.acquire():
+            return  # Уже компактирует другой воркер
+        try:
+            today = datetime.now().strftime('%Y-%m-%d')
+            for day in self.days():
+                if day >= today:
+                    continue
+                try:
+                    if self._columnar_fresh(day) is not None and self.read_rollup(day) is not None:
+                        continue
+                    self.compact_day(day)
+                    print(f'[Analytics] Compacted partition {day}')
+                except Exception as e:
+                    print(f'[Analytics] Compaction failed for {day}: {e}')
+        finally:
+            lock.release()
+
+    def ensure_compactor(self):
+        """Запустить фоновый компактор в текущем процессе (лениво, после fork)"""
+        pid = os.getpid()
+        if self._compactor is not None and self._compactor_pid == pid and self._compactor.is_alive():
+            return
+        self._compactor_pid = pid
+        self._compactor = threading.Thread(target=self._compactor_loop, name='analytics-compactor', daemon=True)
+        self._compactor.start()
+
+    def _compactor_loop(self):
+        while True:
+            try:
+                self.compact()
+            except Exception as e:
+                print(f'[Analytics] Compactor error: {e}')
+            time.sleep(self.compact_interval)
@@ -7,7 +7,7 @@ import re
 import json
 import string
 import secrets
-import requests
+from services.http_client import http_client
 from config import Config
 
 
@@ -71,7 +71,7 @@ class BegetService:
 
         url = f'{self.API_URL}/{method}'
         try:
-            resp = requests.get(url, params=params, timeout=15)
+            resp = http_client.get(url, params=params, timeout=15)
             data = resp.json()
             if data.get('status') == 'success':
                 return data.get('answer', {}).get('result', data.get('answer'))
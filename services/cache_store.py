@@ -0,0 +1,229 @@
+"""
+Постоянный кэш ответов внешних API — SQLite + LRU в памяти воркера
+TTL, ограничение размера (вытесняются давно не читанные записи),
+негативное кэширование ошибок и stale-while-revalidate:
+устаревшая запись отдаётся сразу, а обновляется в фоне.
+"""
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns          TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    negative    INTEGER NOT NULL DEFAULT 0,
+    fetched_at  REAL NOT NULL,
+    expires_at  REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache(ns, last_access);
+"""
+
+TOUCH_FLUSH_INTERVAL = 30  # сек: как часто переносить в БД время чтения записей из памяти
+
+
+class CacheStore:
+    """Кэш одного пространства имён (ns) с загрузкой через loader при промахе"""
+
+    def __init__(self, db_path: str, ns: str, ttl: float, negative_ttl: float = 600,
+                 stale_ttl: float = 0, max_entries: int = 5000, memory_entries: int = 500):
+        self.db_path = db_path
+        self.ns = ns
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()  # key -> (value, negative, expires_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._touched: Dict[str, float] = {}  # key -> время чтения из памяти, ещё не записанное в БД
+        self._touch_flushed_at = time.time()
+        self._stats = {'hits': 0, 'memory_hits': 0, 'negative_hits': 0, 'stale_hits': 0,
+                       'misses': 0, 'loads': 0, 'refreshes': 0, 'evictions': 0}
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    # ==================== READ ====================
+
+    def _lookup(self, key: str) -> Optional[tuple]:
+        """(value, negative, expires_at) из памяти или БД"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                now = time.time()
+                if entry[2] > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    self._touched[key] = now
+                    flush = now - self._touch_flushed_at >= TOUCH_FLUSH_INTERVAL
+                else:
+                    # Истекла — возможно, другой воркер уже обновил запись в БД
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            if flush:
+                self._flush_touches()
+            return entry
+        row = self._conn().execute(
+            'SELECT value, negative, expires_at FROM cache WHERE ns = ? AND key = ?', (self.ns, key)).fetchone()
+        if row is None:
+            return None
+        self._conn().execute('UPDATE cache SET last_access = ? WHERE ns = ? AND key = ?',
+                             (time.time(), self.ns, key))
+        entry = (json.loads(row['value']), bool(row['negative']), row['expires_at'])
+        self._remember(key, entry)
+        return entry
+
+    def _flush_touches(self, conn=None):
+        """
+        Записать в БД last_access записей, прочитанных из памяти.
+        Иначе самые популярные записи (они всегда в памяти) выглядели бы давно не читанными
+        и вытеснялись первыми
+        """
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touch_flushed_at = time.time()
+        if not touched:
+            return
+        try:
+            (conn or self._conn()).executemany(
+                'UPDATE cache SET last_access = MAX(last_access, ?) WHERE ns = ? AND key = ?',
+                [(at, self.ns, key) for key, at in touched.items()])
+        except Exception as e:
+            print(f'[CACHE] {self.ns}: last_access update failed: {e}')
+
+    def _remember(self, key: str, entry: tuple):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_or_load(self, key: str, loader: Callable[[], Any],
+                    is_failure: Callable[[Any], bool] = lambda v: v is None) -> Any:
+        """
+        Значение из кэша или loader().
+        Свежая запись — сразу; устаревшая в пределах stale_ttl — сразу + фоновое обновление;
+        иначе — синхронная загрузка. Ошибки (is_failure) кэшируются на negative_ttl
+        """
+        now = time.time()
+        try:
+            entry = self._lookup(key)
+        except Exception as e:
+            print(f'[CACHE] {self.ns}: read failed for {key!r}: {e}')
+            entry = None
+
+        if entry is not None:
+            value, negative, expires_at = entry
+            if now < expires_at:
+                self._count('negative_hits' if negative else 'hits')
+                return copy.deepcopy(value)
+            if not negative and now < expires_at + self.stale_ttl:
+                self._count('stale_hits')
+                self._refresh_async(key, loader, is_failure)
+                return copy.deepcopy(value)
+
+        self._count('misses')
+        return self._load(key, loader, is_failure)
+
+    # ==================== WRITE ====================
+
+    def _load(self, key: str, loader: Callable[[], Any], is_failure: Callable[[Any], bool]) -> Any:
+        self._count('loads')
+        value = loader()
+        negative = is_failure(value)
+        if negative and self.negative_ttl <= 0:
+            # Ошибки не кэшируются — не пишем заведомо истёкшую строку и не вытесняем ради неё живые
+            return value
+        try:
+            self.set(key, value, negative=negative)
+        except Exception as e:
+            print(f'[CACHE] {self.ns}: write failed for {key!r}: {e}')
+        return value
+
+    def _refresh_async(self, key: str, loader: Callable[[], Any], is_failure: Callable[[Any], bool]):
+        """Обновить устаревшую запись в фоне (одно обновление на ключ в процессе)"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                value = loader()
+                if is_failure(value):
+                    # Старое значение лучше свежей ошибки — оставляем его до конца stale-окна
+                    return
+                self.set(key, value)
+                self._count('refreshes')
+            except Exception as e:
+                print(f'[CACHE] {self.ns}: refresh failed for {key!r}: {e}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f'cache-refresh-{self.ns}', daemon=True).start()
+
+    def set(self, key: str, value: Any, negative: bool = False):
+        now = time.time()
+        expires_at = now + (self.negative_ttl if negative else self.ttl)
+        with transaction(self._conn()) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (ns, key, value, negative, fetched_at, expires_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.ns, key, json.dumps(value, ensure_ascii=False), int(negative), now, expires_at, now))
+            evicted = self._evict_locked(conn)
+        self._remember(key, (copy.deepcopy(value), negative, expires_at))
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _evict_locked(self, conn) -> int:
+        """Удалить самые давно читанные записи сверх max_entries"""
+        count = conn.execute('SELECT COUNT(*) FROM cache WHERE ns = ?', (self.ns,)).fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self._flush_touches(conn)
+        conn.execute(
+            'DELETE FROM cache WHERE ns = ? AND key IN '
+            '(SELECT key FROM cache WHERE ns = ? ORDER BY last_access LIMIT ?)',
+            (self.ns, self.ns, excess))
+        with self._lock:
+            self._memory.clear()  # Память пересоберётся из БД
+        return excess
+
+    def invalidate(self, key: str):
+        self._conn().execute('DELETE FROM cache WHERE ns = ? AND key = ?', (self.ns, key))
+        with self._lock:
+            self._memory.pop(key, None)
+
+    # ==================== STATS ====================
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        try:
+            stats['entries'] = self._conn().execute(
+                'SELECT COUNT(*) FROM cache WHERE ns = ?', (self.ns,)).fetchone()[0]
+        except Exception:
+            stats['entries'] = None
+        lookups = stats['hits'] + stats['negative_hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0
+        return stats
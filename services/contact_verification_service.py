@@ -2,10 +2,22 @@
 Сервис верификации контактов государственных органов
 Использует Perplexity API через OpenRouter для real-time поиска
 """
-import requests
+from services.http_client import http_client
 import json
+import re
+import time
 from typing import Dict, Optional
 from config import Config
+from services.cache_store import CacheStore
+
+
+def contact_cache_key(org_name: str, category: str = "") -> str:
+    """Нормализованный ключ кэша: регистр, ё/е, кавычки и лишние пробелы не важны"""
+    def norm(text: str) -> str:
+        text = (text or "").lower().replace("ё", "е")
+        text = re.sub(r"[\"'«»“”„]", "", text)
+        return re.sub(r"\s+", " ", text).strip()
+    return f"{norm(org_name)}|{norm(category)}"
 
 
 class ContactVerificationService:
@@ -15,6 +27,12 @@ class ContactVerificationService:
         self.api_key = Config.OPENROUTER_API_KEY
         self.base_url = Config.OPENROUTER_BASE_URL
         self.model = Config.PERPLEXITY_MODEL
+        self.contacts_cache = CacheStore(
+            Config.CACHE_DB, 'contacts',
+            ttl=Config.CONTACTS_CACHE_TTL,
+            negative_ttl=Config.CONTACTS_CACHE_NEGATIVE_TTL,
+            stale_ttl=Config.CONTACTS_CACHE_STALE_TTL,
+            max_entries=Config.CONTACTS_CACHE_MAX_ENTRIES)
         
     def _call_perplexity(self, prompt: str) -> Optional[str]:
         """Вызов Perplexity через OpenRouter"""
@@ -78,7 +96,7 @@ class ContactVerificationService:
         
         try:
             print(f"ContactVerification: Calling Perplexity for contact lookup...")
-            response = requests.post(
+            response = http_client.post(
                 f"{self.base_url}/chat/completions",
                 headers=headers,
                 json=payload,
@@ -99,6 +117,24 @@ class ContactVerificationService:
             return None
     
     def verify_and_get_contacts(self, org_name: str, category: str = "") -> Dict:
+        """
+        Контакты органа из кэша (Perplexity — только при промахе).
+        Ответ с ошибкой кэшируется ненадолго, чтобы не долбить API при сбое.
+        fetched_at — время реального запроса к Perplexity (хранится в кэше вместе с контактами),
+        а не время выдачи из кэша
+        """
+        return self.contacts_cache.get_or_load(
+            contact_cache_key(org_name, category),
+            lambda: self._fetch_contacts(org_name, category),
+            is_failure=lambda details: not details or bool(details.get("error")))
+    
+    def _fetch_contacts(self, org_name: str, category: str = "") -> Dict:
+        details = self._lookup_contacts(org_name, category)
+        if details and not details.get("error"):
+            details["fetched_at"] = time.time()
+        return details
+    
+    def _lookup_contacts(self, org_name: str, category: str = "") -> Dict:
         """
         Поиск полной информации об органе для подачи жалобы
         
@@ -191,12 +227,12 @@ class ContactVerificationService:
         }
             
         try:
-            response = requests.head(url, headers=headers, timeout=10, allow_redirects=True)
+            response = http_client.head(url, headers=headers, timeout=10, allow_redirects=True)
             return response.status_code < 400
         except:
             # Пробуем GET если HEAD не работает
             try:
-                response = requests.get(url, headers=headers, timeout=10, allow_redirects=True)
+                response = http_client.get(url, headers=headers, timeout=10, allow_redirects=True)
                 return response.status_code < 400
             except:
                 return False
@@ -257,7 +293,7 @@ class ContactVerificationService:
         
         try:
             print(f"ContactVerification: Identifying target from: '{free_text}'")
-            response = requests.post(
+            response = http_client.post(
                 f"{self.base_url}/chat/completions",
                 headers=headers,
                 json=payload,
@@ -356,7 +392,7 @@ class ContactVerificationService:
         
         try:
             print(f"[RESEARCH] Perplexity research: '{research_query}'")
-            response = requests.post(
+            response = http_client.post(
                 f"{self.base_url}/chat/completions",
                 headers=headers,
                 json=payload,
@@ -2,10 +2,48 @@
 Сервис интеграции с DaData API
 Подсказки для организаций (по ИНН/названию) и адресов
 Бесплатно до 10,000 запросов в день
+Ответы кэшируются в воркере (services/suggest_cache.py): автодополнение шлёт запрос
+на каждую букву, а большая часть из них отвечается из кэша.
+Организации сначала ищутся в локальном индексе ЕГРЮЛ (services/egrul_index.py), если он собран
 """
-import requests
-from typing import Optional, List, Dict
+from services.http_client import http_client
+from typing import Callable, Optional, List, Dict
 from config import Config
+from services.suggest_cache import SuggestCache
+from services.egrul_index import egrul_index
+
+
+def company_from_party(s: Dict) -> Dict:
+    """Организация из подсказки DaData (party) — в формате ответов /api/suggest/company"""
+    data = s.get("data") or {}
+    address = data.get("address") or {}
+    address_data = address.get("data") or {}  # Структурированные данные адреса
+    management = data.get("management") or {}
+    
+    # Извлекаем структурированную информацию о местоположении
+    region = address_data.get("region_with_type", "") or address_data.get("region", "")
+    city = address_data.get("city_with_type", "") or address_data.get("city", "")
+    city_district = address_data.get("city_district_with_type", "") or address_data.get("city_district", "")
+    settlement = address_data.get("settlement_with_type", "") or address_data.get("settlement", "")
+    area = address_data.get("area_with_type", "") or address_data.get("area", "")  # Район области
+    
+    return {
+        "name": s.get("value", ""),
+        "inn": data.get("inn", ""),
+        "ogrn": data.get("ogrn", ""),
+        "kpp": data.get("kpp", ""),
+        "address": address.get("value", ""),
+        # Структурированные данные для подведомственности
+        "region": region,  # Регион (область, республика, край)
+        "city": city,  # Город
+        "city_district": city_district,  # Район города (для крупных городов)
+        "area": area,  # Район области (для сельской местности)
+        "settlement": settlement,  # Населённый пункт
+        "type": data.get("type", ""),  # LEGAL или INDIVIDUAL
+        "status": (data.get("state") or {}).get("status", ""),
+        "director": management.get("name", ""),
+        "director_post": management.get("post", "")
+    }
 
 
 class DaDataService:
@@ -14,13 +52,27 @@ class DaDataService:
     def __init__(self):
         self.api_key = Config.DADATA_API_KEY
         self.base_url = "https://suggestions.dadata.ru/suggestions/api/4_1/rs"
+        self.cache = SuggestCache(ttl=Config.SUGGEST_CACHE_TTL, max_entries=Config.SUGGEST_CACHE_SIZE)
         
-    def _make_request(self, endpoint: str, query: str, count: int = 5) -> Optional[List[Dict]]:
-        """Отправка запроса к DaData API"""
+    def _make_request(self, endpoint: str, query: str, count: int = 5,
+                      gate: Optional[Callable[[], None]] = None) -> Optional[List[Dict]]:
+        """
+        Запрос к DaData через кэш подсказок.
+        gate() вызывается перед походом в DaData, если в кэше ответа нет
+        (очередь запросов сессии — services/suggest_guard.py, может бросить Superseded)
+        """
         if not self.api_key:
             print("DaData API: No API key configured")
             return None
-            
+        if gate is not None:
+            cached = self.cache.peek(endpoint, query, count)
+            if cached is not None:
+                return cached
+            gate()
+        return self.cache.get(endpoint, query, count, lambda: self._fetch(endpoint, query, count))
+    
+    def _fetch(self, endpoint: str, query: str, count: int) -> Optional[List[Dict]]:
+        """Отправка запроса к DaData API"""
         headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
@@ -33,7 +85,7 @@ class DaDataService:
         }
         
         try:
-            response = requests.post(
+            response = http_client.post(
                 f"{self.base_url}/{endpoint}",
                 headers=headers,
                 json=payload,
@@ -51,79 +103,44 @@ class DaDataService:
             print(f"DaData API Error: {e}")
             return None
     
-    def suggest_company(self, query: str, count: int = 5) -> List[Dict]:
+    def suggest_company(self, query: str, count: int = 5, gate: Optional[Callable[[], None]] = None) -> List[Dict]:
         """
         Поиск организаций по названию, ИНН, ОГРН
         
         Returns:
             List of companies with structured location data for jurisdiction
         """
-        suggestions = self._make_request("suggest/party", query, count)
+        local, complete = egrul_index.search_ranked(query, count)
+        if local and complete:
+            return local
         
-        if not suggestions:
-            return []
+        suggestions = self._make_request("suggest/party", query, count, gate=gate)
         
-        result = []
-        for s in suggestions:
-            data = s.get("data", {})
-            address = data.get("address", {})
-            address_data = address.get("data", {}) or {}  # Структурированные данные адреса
-            management = data.get("management", {})
-            
-            # Извлекаем структурированную информацию о местоположении
-            region = address_data.get("region_with_type", "") or address_data.get("region", "")
-            city = address_data.get("city_with_type", "") or address_data.get("city", "")
-            city_district = address_data.get("city_district_with_type", "") or address_data.get("city_district", "")
-            settlement = address_data.get("settlement_with_type", "") or address_data.get("settlement", "")
-            area = address_data.get("area_with_type", "") or address_data.get("area", "")  # Район области
-            
-            result.append({
-                "name": s.get("value", ""),
-                "inn": data.get("inn", ""),
-                "ogrn": data.get("ogrn", ""),
-                "kpp": data.get("kpp", ""),
-                "address": address.get("value", ""),
-                # Структурированные данные для подведомственности
-                "region": region,  # Регион (область, республика, край)
-                "city": city,  # Город
-                "city_district": city_district,  # Район города (для крупных городов)
-                "area": area,  # Район области (для сельской местности)
-                "settlement": settlement,  # Населённый пункт
-                "type": data.get("type", ""),  # LEGAL или INDIVIDUAL
-                "status": data.get("state", {}).get("status", ""),
-                "director": management.get("name", ""),
-                "director_post": management.get("post", "")
-            })
+        if not suggestions:
+            return local  # DaData недоступна — хотя бы неполный локальный список
         
-        return result
+        # Локальный поиск упёрся в лимит кандидатов — порядок DaData, локальные добавляем после
+        result = [company_from_party(s) for s in suggestions]
+        seen = {c["inn"] for c in result if c["inn"]}
+        result.extend(c for c in local if c.get("inn") not in seen)
+        return result[:count]
     
-    def find_company_by_inn(self, inn: str) -> Optional[Dict]:
+    def find_company_by_inn(self, inn: str, gate: Optional[Callable[[], None]] = None) -> Optional[Dict]:
         """
         Найти компанию по точному ИНН
         """
-        suggestions = self._make_request("findById/party", inn, 1)
+        local = egrul_index.find_by_inn(inn)
+        if local:
+            return local
+        
+        suggestions = self._make_request("findById/party", inn, 1, gate=gate)
         
         if not suggestions:
             return None
         
-        s = suggestions[0]
-        data = s.get("data", {})
-        address = data.get("address", {})
-        management = data.get("management", {})
-        
-        return {
-            "name": s.get("value", ""),
-            "inn": data.get("inn", ""),
-            "ogrn": data.get("ogrn", ""),
-            "kpp": data.get("kpp", ""),
-            "address": address.get("value", ""),
-            "type": data.get("type", ""),
-            "status": data.get("state", {}).get("status", ""),
-            "director": management.get("name", ""),
-            "director_post": management.get("post", "")
-        }
+        return company_from_party(suggestions[0])
     
-    def suggest_address(self, query: str, count: int = 5) -> List[Dict]:
+    def suggest_address(self, query: str, count: int = 5, gate: Optional[Callable[[], None]] = None) -> List[Dict]:
         """
         Подсказки адресов
         
@@ -136,7 +153,7 @@ class DaDataService:
             - data.street: улица
             - data.house: дом
         """
-        suggestions = self._make_request("suggest/address", query, count)
+        suggestions = self._make_request("suggest/address", query, count, gate=gate)
         
         if not suggestions:
             return []
@@ -157,11 +174,11 @@ class DaDataService:
         
         return result
     
-    def suggest_fio(self, query: str, count: int = 5) -> List[Dict]:
+    def suggest_fio(self, query: str, count: int = 5, gate: Optional[Callable[[], None]] = None) -> List[Dict]:
         """
         Подсказки ФИО
         """
-        suggestions = self._make_request("suggest/fio", query, count)
+        suggestions = self._make_request("suggest/fio", query, count, gate=gate)
         
         if not suggestions:
             return []
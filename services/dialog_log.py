@@ -0,0 +1,181 @@
+"""
+Журнал сообщений диалога в SQLite
+История чата не хранится в сессии: сообщения пишутся по одному в журнал
+(state_id, seq), а в сессии остаётся только длина истории (курсор).
+Откат назад — уменьшение курсора; следующее сообщение перезапишет строку.
+Каждая перезапись уже существующей строки увеличивает ревизию истории диалога:
+по ней клиент понимает, что догрузки хвоста мало и историю надо перечитать.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from config import Config
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialog_messages (
+    state_id TEXT NOT NULL,
+    seq      INTEGER NOT NULL,
+    message  TEXT NOT NULL,
+    ts       REAL NOT NULL,
+    PRIMARY KEY (state_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dialog_revisions (
+    state_id TEXT PRIMARY KEY,
+    rev      INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class DialogLog:
+    """Хранилище сообщений всех диалогов"""
+
+    def __init__(self, db_path: str, ttl: float = 90 * 86400, prune_interval: float = 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._pruner_pid = None
+        self._pruner_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def write(self, state_id: str, start: int, messages: List[Dict]):
+        """Записать сообщения с номерами start, start+1, ... (старые строки с теми же номерами заменяются)"""
+        self._ensure_pruner()
+        now = time.time()
+        with transaction(self._conn()) as conn:
+            last = conn.execute('SELECT MAX(seq) FROM dialog_messages WHERE state_id = ?', (state_id,)).fetchone()[0]
+            if last is not None and start <= last:
+                # Сообщение на месте заглушки или после отката назад — клиенту нужна новая ревизия
+                conn.execute('INSERT INTO dialog_revisions (state_id, rev) VALUES (?, 1) '
+                             'ON CONFLICT(state_id) DO UPDATE SET rev = rev + 1', (state_id,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO dialog_messages (state_id, seq, message, ts) VALUES (?, ?, ?, ?)',
+                [(state_id, start + i, json.dumps(m, ensure_ascii=False, default=str), now)
+                 for i, m in enumerate(messages)])
+
+    def revision(self, state_id: str) -> int:
+        """Сколько раз в диалоге перезаписывались уже сохранённые сообщения"""
+        row = self._conn().execute('SELECT rev FROM dialog_revisions WHERE state_id = ?', (state_id,)).fetchone()
+        return row['rev'] if row else 0
+
+    def read(self, state_id: str, start: int, end: int) -> Dict[int, Dict]:
+        """Сообщения с номерами [start, end)"""
+        rows = self._conn().execute(
+            'SELECT seq, message FROM dialog_messages WHERE state_id = ? AND seq >= ? AND seq < ?',
+            (state_id, start, end))
+        return {r['seq']: json.loads(r['message']) for r in rows}
+
+    def history(self, state_id: str, length: int = 0) -> 'MessageHistory':
+        return MessageHistory(self, state_id, length)
+
+    def prune(self) -> int:
+        """Удалить диалоги, в которые не писали дольше ttl (сессии к этому времени уже истекли)"""
+        cur = self._conn().execute(
+            'DELETE FROM dialog_messages WHERE state_id IN '
+            '(SELECT state_id FROM dialog_messages GROUP BY state_id HAVING MAX(ts) < ?)',
+            (time.time() - self.ttl,))
+        self._conn().execute(
+            'DELETE FROM dialog_revisions WHERE state_id NOT IN (SELECT DISTINCT state_id FROM dialog_messages)')
+        return cur.rowcount
+
+    def _ensure_pruner(self):
+        pid = os.getpid()
+        if self._pruner_pid == pid:
+            return
+        with self._pruner_lock:
+            if self._pruner_pid == pid:
+                return
+            self._pruner_pid = pid
+            threading.Thread(target=self._pruner_loop, name='dialog-log-prune', daemon=True).start()
+
+    def _pruner_loop(self):
+        while True:
+            time.sleep(self.prune_interval)
+            try:
+                removed = self.prune()
+                if removed:
+                    print(f'[DIALOG LOG] Pruned {removed} old messages')
+            except Exception as e:
+                print(f'[DIALOG LOG] Prune error: {e}')
+
+
+class MessageHistory:
+    """
+    История одного диалога, ведёт себя как список сообщений.
+    Читается лениво (обычно нужен только хвост), append пишет сразу в журнал
+    """
+
+    TAIL = 8  # сколько последних сообщений подгружать при обращении к хвосту
+
+    def __init__(self, log: DialogLog, state_id: str, length: int = 0):
+        self.log = log
+        self.state_id = state_id
+        self.length = length
+        self._cache: Dict[int, Dict] = {}
+
+    def _load(self, start: int, end: int):
+        missing = [i for i in range(start, end) if i not in self._cache]
+        if missing:
+            self._cache.update(self.log.read(self.state_id, missing[0], missing[-1] + 1))
+
+    def page(self, start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """Сообщения [start, end) одним запросом"""
+        end = self.length if end is None else min(end, self.length)
+        start = max(start, 0)
+        self._load(start, end)
+        return [self._cache[i] for i in range(start, end) if i in self._cache]
+
+    @property
+    def revision(self) -> int:
+        return self.log.revision(self.state_id)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('history index out of range')
+        if index not in self._cache:
+            self._load(max(index - self.TAIL + 1, 0), index + 1)
+        return self._cache[index]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.page())
+
+    def __reversed__(self) -> Iterator[Dict]:
+        for i in range(self.length - 1, -1, -1):
+            yield self[i]
+
+    def append(self, message: Dict):
+        self.extend([message])
+
+    def extend(self, messages: List[Dict]):
+        if not messages:
+            return
+        self.log.write(self.state_id, self.length, messages)
+        for i, message in enumerate(messages):
+            self._cache[self.length + i] = message
+        self.length += len(messages)
+
+    def pop(self) -> Dict:
+        message = self[-1]
+        self.length -= 1
+        return message
+
+    def clear(self):
+        self.length = 0
+
+
+# Singleton
+dialog_log = DialogLog(Config.DIALOG_LOG_DB, ttl=Config.DIALOG_LOG_TTL)
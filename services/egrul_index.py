@@ -0,0 +1,272 @@
+"""
+Локальный индекс организаций из выгрузки ЕГРЮЛ/DaData (необязательный)
+Файлы в EGRUL_INDEX_DIR читаются через mmap — страницы общие для всех воркеров:
+    inn.bin   — отсортированные ИНН (uint64), номер записи = позиция в массиве
+    rec.bin   — (смещение uint64, длина uint32) записи в data.bin
+    data.bin  — записи в формате /api/suggest/company (JSON)
+    gram.bin  — отсортированная таблица (hash триграммы uint32, число uint32, смещение uint64)
+    post.bin  — номера записей (uint32) по триграммам названия
+    name.bin  — нормализованные названия (normalize_name, UTF-8) для ранжирования без разбора JSON
+    nrec.bin  — (смещение uint64, длина uint16, не действующая uint8) названия в name.bin
+    meta.json — число записей, источник, дата сборки
+Собирается tools/egrul_import.py; если каталога нет — индекс выключен, всё идёт в DaData.
+"""
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from struct import Struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+INN = Struct('<Q')
+REC = Struct('<QI')
+GRAM = Struct('<IIQ')
+NAME = Struct('<QHB')
+
+MAX_CANDIDATES = 500  # сколько подходящих записей ранжировать; больше — ответ неполный, спрашиваем DaData
+
+_NOISE_RE = re.compile(r'["\'«»“”„()]')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_name(text: str) -> str:
+    """Слова названия в нижнем регистре; дефис разделяет слова: «Ромашка-Плюс» находится по «плюс»"""
+    text = _NOISE_RE.sub(' ', (text or '').lower().replace('ё', 'е'))
+    return ' '.join(_WORD_RE.findall(text))
+
+
+def trigrams(text: str) -> set:
+    """Триграммы слов с пробелом в начале: запрос «ром» находит «ромашка»"""
+    grams = set()
+    for word in normalize_name(text).split():
+        padded = ' ' + word
+        for i in range(len(padded) - 2):
+            grams.add(zlib.crc32(padded[i:i + 3].encode('utf-8')))
+    return grams
+
+
+# ==================== BUILD ====================
+
+def build_index(companies: Iterable[Dict], out_dir: str, source: str = '') -> int:
+    """
+    Собрать индекс из записей company_from_party (нужны inn и name).
+    Пишет во временный каталог и подменяет out_dir целиком
+    """
+    by_inn = {}
+    for company in companies:
+        inn = str(company.get('inn') or '').strip()
+        if inn.isdigit() and company.get('name'):
+            by_inn[int(inn)] = company  # Дубли ИНН (филиалы) — остаётся последняя запись
+    keys = sorted(by_inn)
+
+    tmp_dir = out_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    postings: Dict[int, array] = {}
+    with open(os.path.join(tmp_dir, 'inn.bin'), 'wb') as f_inn, \
+            open(os.path.join(tmp_dir, 'rec.bin'), 'wb') as f_rec, \
+            open(os.path.join(tmp_dir, 'data.bin'), 'wb') as f_data, \
+            open(os.path.join(tmp_dir, 'name.bin'), 'wb') as f_name, \
+            open(os.path.join(tmp_dir, 'nrec.bin'), 'wb') as f_nrec:
+        offset = name_offset = 0
+        for rec_id, inn in enumerate(keys):
+            company = by_inn[inn]
+            raw = json.dumps(company, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            f_inn.write(INN.pack(inn))
+            f_rec.write(REC.pack(offset, len(raw)))
+            f_data.write(raw)
+            offset += len(raw)
+            name = normalize_name(company['name']).encode('utf-8')[:0xFFFF]
+            f_nrec.write(NAME.pack(name_offset, len(name), _inactive(company)))
+            f_name.write(name)
+            name_offset += len(name)
+            for gram in trigrams(company['name']):
+                postings.setdefault(gram, array('I')).append(rec_id)
+
+    with open(os.path.join(tmp_dir, 'gram.bin'), 'wb') as f_gram, \
+            open(os.path.join(tmp_dir, 'post.bin'), 'wb') as f_post:
+        offset = 0
+        for gram in sorted(postings):
+            ids = postings[gram]
+            f_gram.write(GRAM.pack(gram, len(ids), offset))
+            ids.tofile(f_post)
+            offset += len(ids) * ids.itemsize
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'count': len(keys), 'grams': len(postings), 'source': source,
+                   'built_at': datetime.now().isoformat()}, f, ensure_ascii=False)
+
+    old_dir = out_dir.rstrip('/') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(keys)
+
+
+# ==================== READ ====================
+
+def _contains(ids, rec_id: int) -> bool:
+    i = bisect_left(ids, rec_id)
+    return i < len(ids) and ids[i] == rec_id
+
+
+class EgrulIndex:
+    """Поиск по ИНН (бинарный поиск) и по названию (пересечение списков триграмм)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._maps: Optional[Dict[str, mmap.mmap]] = None
+        self._lock = threading.Lock()
+        self.meta: Dict = {}
+
+    @property
+    def available(self) -> bool:
+        return self._open() is not None
+
+    def _open(self) -> Optional[Dict[str, mmap.mmap]]:
+        if self._maps is not None:
+            return self._maps or None
+        with self._lock:
+            if self._maps is None:
+                self._maps = {}
+                if os.path.exists(os.path.join(self.path, 'meta.json')):
+                    try:
+                        with open(os.path.join(self.path, 'meta.json'), encoding='utf-8') as f:
+                            self.meta = json.load(f)
+                        maps = {}
+                        for name in ('inn', 'rec', 'data', 'gram', 'post', 'name', 'nrec'):
+                            path = os.path.join(self.path, f'{name}.bin')
+                            if name in ('name', 'nrec') and not os.path.exists(path):
+                                continue  # Индекс старого формата — названия берутся из записей
+                            with open(path, 'rb') as f:
+                                # Пустой файл mmap не открывает
+                                maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+                        self._maps = maps
+                        print(f'[EGRUL] Index {self.path}: {self.meta.get("count")} companies')
+                    except (OSError, ValueError) as e:
+                        print(f'[EGRUL] Cannot open index {self.path}: {e}')
+                        self._maps = {}
+        return self._maps or None
+
+    def _record(self, maps, rec_id: int) -> Dict:
+        offset, length = REC.unpack_from(maps['rec'], rec_id * REC.size)
+        return json.loads(maps['data'][offset:offset + length])
+
+    def find_by_inn(self, inn: str) -> Optional[Dict]:
+        maps = self._open()
+        inn = (inn or '').strip()
+        if maps is None or not inn.isdigit():
+            return None
+        key = int(inn)
+        lo, hi = 0, len(maps['inn']) // INN.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INN.unpack_from(maps['inn'], mid * INN.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo * INN.size < len(maps['inn']) and INN.unpack_from(maps['inn'], lo * INN.size)[0] == key:
+            return self._record(maps, lo)
+        return None
+
+    def _posting(self, maps, gram: int):
+        """Номера записей по триграмме — отсортированный memoryview поверх mmap (без копирования)"""
+        lo, hi = 0, len(maps['gram']) // GRAM.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if GRAM.unpack_from(maps['gram'], mid * GRAM.size)[0] < gram:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo * GRAM.size < len(maps['gram']):
+            found, count, offset = GRAM.unpack_from(maps['gram'], lo * GRAM.size)
+            if found == gram:
+                return memoryview(maps['post'])[offset:offset + count * 4].cast('I')
+        return ()
+
+    def search(self, query: str, count: int = 7) -> List[Dict]:
+        """Организации, в названии которых каждое слово запроса — начало слова (как у DaData)"""
+        return self.search_ranked(query, count)[0]
+
+    def search_ranked(self, query: str, count: int = 7) -> Tuple[List[Dict], bool]:
+        """
+        (лучшие count организаций, complete). Сначала собираются все подходящие записи
+        (не больше MAX_CANDIDATES), потом ранжируются: действующие выше, затем точное совпадение
+        названия, начало названия, совпадение целых слов, короткие названия.
+        complete=False — кандидатов больше лимита, список может быть неполным (стоит спросить DaData)
+        """
+        maps = self._open()
+        grams = trigrams(query)
+        if maps is None or not grams:
+            return [], True
+        lists = sorted((self._posting(maps, g) for g in grams), key=len)
+        if not lists[0]:
+            return [], True
+        # Идём по самому короткому списку, остальные проверяем бинарным поиском.
+        # Ранжируем по name.bin — JSON разбираем только у отобранных записей
+        words = normalize_name(query).split()
+        names = maps.get('name')
+        found = []
+        complete = True
+        for rec_id in lists[0]:
+            if not all(_contains(ids, rec_id) for ids in lists[1:]):
+                continue
+            if len(found) >= MAX_CANDIDATES:
+                complete = False
+                break
+            if names is not None:
+                offset, length, inactive = NAME.unpack_from(maps['nrec'], rec_id * NAME.size)
+                name_words = names[offset:offset + length].decode('utf-8').split()
+            else:
+                company = self._record(maps, rec_id)
+                name_words = normalize_name(company['name']).split()
+                inactive, length = _inactive(company), len(company['name'])
+            rank = _match_rank(words, name_words)
+            if rank is not None:
+                found.append((inactive, rank, length, rec_id))
+        found.sort()
+        return [self._record(maps, item[3]) for item in found[:count]], complete
+
+
+def _inactive(company: Dict) -> int:
+    return int(company.get('status') not in ('', None, 'ACTIVE'))
+
+
+# Организационно-правовые формы в начале названия — не учитываются при сравнении с запросом
+LEGAL_FORMS = {'ооо', 'ао', 'пао', 'зао', 'оао', 'нао', 'ип', 'нко', 'ано', 'муп', 'гуп', 'фгуп',
+               'гбу', 'гку', 'мбу', 'мку', 'мау', 'фгбу', 'тсж', 'снт', 'пк'}
+
+
+def _match_rank(words: List[str], name_words: List[str]) -> Optional[int]:
+    """
+    Качество совпадения запроса с названием (меньше — лучше), None — не подходит:
+    0 — название (без ОПФ) совпадает с запросом, 1 — начинается с запроса,
+    2 — все слова запроса есть целиком, 3 — слова запроса — начала слов названия
+    """
+    if not all(any(n.startswith(w) for n in name_words) for w in words):
+        return None
+    core = name_words
+    while core and core[0] in LEGAL_FORMS:
+        core = core[1:]
+    if core == words:
+        return 0
+    n = len(words)
+    if len(core) >= n and core[:n - 1] == words[:-1] and core[n - 1].startswith(words[-1]):
+        return 1
+    if all(w in name_words for w in words):
+        return 2
+    return 3
+
+
+# Singleton
+egrul_index = EgrulIndex(Config.EGRUL_INDEX_DIR)
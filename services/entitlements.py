@@ -0,0 +1,70 @@
+"""
+Права пользователя по его платежам: уровень тарифа, срок действия, флаги скачивания/рассылки/каналов
+Считается один раз при изменении платежей (services/user_store.py хранит результат
+в таблице entitlements), а не на каждый опрос /api/payment/status
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config import Config
+
+
+# Тариф из платежа → id тарифа в Config.TARIFFS
+TARIFF_ALIASES = {'annual': 'premium'}
+PRIORITY = {'premium': 2, 'standard': 1}
+
+
+def _paid_at(payment: Dict) -> Optional[datetime]:
+    paid_at = payment.get('recorded_at') or payment.get('paid_at') or payment.get('created_at', '')
+    if not paid_at:
+        return None
+    try:
+        return datetime.fromisoformat(paid_at)
+    except ValueError:
+        return None
+
+
+def compute_entitlement(payments: List[Dict], now: Optional[datetime] = None) -> Dict:
+    """Лучший действующий тариф среди успешных платежей (premium > standard > free)"""
+    now = now or datetime.now()
+    best = None
+    for p in payments:
+        if p.get('status') != 'succeeded':
+            continue
+        tariff_id = p.get('tariff') or p.get('tariff_id') or ''
+        tariff_id = TARIFF_ALIASES.get(tariff_id, tariff_id)
+        tariff = Config.TARIFFS.get(tariff_id, {})
+
+        expires_at = None
+        days_limit = tariff.get('days')
+        if days_limit:
+            paid_at = _paid_at(p)
+            if paid_at:
+                expires_at = paid_at + timedelta(days=days_limit)
+                if now > expires_at:
+                    continue  # Истёк
+
+        priority = PRIORITY.get(tariff_id, 0)
+        if best is None or priority > best[0]:
+            best = (priority, tariff_id, tariff, expires_at)
+
+    if best is None:
+        tariff_id, tariff, expires_at = 'free', Config.TARIFFS.get('free', {}), None
+    else:
+        _, tariff_id, tariff, expires_at = best
+    return {
+        'paid': best is not None,
+        'tariff_level': tariff_id,
+        'tariff': tariff.get('name', ''),
+        'expires_at': expires_at.isoformat() if expires_at else None,
+        'can_send': bool(tariff.get('sending', False)),
+        'can_download': bool(tariff.get('download', False)),
+        'has_channels': bool(tariff.get('channels', False)),
+        'computed_at': now.isoformat(),
+    }
+
+
+def is_expired(entitlement: Dict, now: Optional[datetime] = None) -> bool:
+    """Истёк ли срок тарифа, на котором основана запись (тогда её надо пересчитать)"""
+    expires_at = entitlement.get('expires_at')
+    return bool(expires_at) and (now or datetime.now()) > datetime.fromisoformat(expires_at)
@@ -0,0 +1,51 @@
+"""
+Движок агрегации воронки
+Шаги получают целочисленные id, достигнутые шаги посетителя — битовая маска.
+Счётчики по всем шагам считаются за один проход по посетителям
+(через NumPy, если он установлен).
+"""
+from collections import Counter
+from typing import Dict, Iterable, List
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен — чистый Python даёт тот же результат
+    np = None
+
+
+class FunnelEngine:
+    """Битовые маски шагов и подсчёт воронки"""
+
+    def __init__(self, steps: Iterable[str]):
+        self.steps = list(steps)
+        self.step_ids: Dict[str, int] = {s: i for i, s in enumerate(self.steps)}
+        self.step_bits: Dict[str, int] = {s: 1 << i for i, s in enumerate(self.steps)}
+
+    def step_id(self, step: str) -> int:
+        """Номер шага в воронке (-1 для неизвестных шагов)"""
+        return self.step_ids.get(step, -1)
+
+    def bit(self, step: str) -> int:
+        return self.step_bits.get(step, 0)
+
+    def count(self, masks: Iterable[int]) -> List[int]:
+        """Сколько масок содержит каждый шаг (по порядку self.steps)"""
+        n = len(self.steps)
+        if np is not None:
+            arr = np.fromiter(masks, dtype=np.int64)
+            if arr.size == 0:
+                return [0] * n
+            uniq, freq = np.unique(arr, return_counts=True)
+            bits = (uniq[:, None] >> np.arange(n, dtype=np.int64)) & 1
+            return [int(c) for c in freq @ bits]
+
+        # Различных масок мало (пути по воронке похожи) — раскладываем по битам только их
+        counts = [0] * n
+        for mask, freq in Counter(masks).items():
+            i = 0
+            while mask:
+                if mask & 1 and i < n:
+                    counts[i] += freq
+                mask >>= 1
+                i += 1
+        return counts
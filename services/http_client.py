@@ -0,0 +1,150 @@
+"""
+Общий HTTP-клиент для внешних API (OpenRouter, DaData, Метрика, Директ, Beget...)
+Одна requests.Session на воркер: keep-alive пулы соединений по хосту,
+так что повторные вызовы не платят за TCP+TLS рукопожатие.
+Статистика пулов: сколько запросов ушло по уже открытым соединениям.
+"""
+import http.cookiejar
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+
+def _host_key(host: str, port: Optional[int]) -> str:
+    """Ключ статистики: хост, порт — только нестандартный"""
+    return host if port in (None, 80, 443) else f'{host}:{port}'
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter, который не теряет статистику вытесненных пулов"""
+
+    def __init__(self, client: 'HttpClient', **kwargs):
+        self._client = client
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+
+        def dispose(pool):
+            self._client._retire_pool(pool)
+            pool.close()
+
+        pools.dispose_func = dispose
+
+
+class HttpClient:
+    """Пул keep-alive соединений на процесс (gunicorn форкает воркеры — сессия создаётся заново)"""
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10, connect_timeout: float = 5):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._adapters = []
+        self._retired: Dict[str, Dict[str, int]] = {}  # статистика закрытых пулов по хосту
+        self._errors: Dict[str, int] = {}
+
+    def session(self) -> requests.Session:
+        pid = os.getpid()
+        if self._session is not None and self._session_pid == pid:
+            return self._session
+        with self._lock:
+            if self._session is None or self._session_pid != pid:
+                # Соединения родителя после fork не используем
+                session = requests.Session()
+                # Сессия общая для всех пользователей воркера — cookies внешних API не сохраняем
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                self._adapters = []
+                for prefix in ('https://', 'http://'):
+                    adapter = _PooledAdapter(self, pool_connections=self.pool_connections,
+                                             pool_maxsize=self.pool_maxsize)
+                    session.mount(prefix, adapter)
+                    self._adapters.append(adapter)
+                self._retired = {}
+                self._errors = {}
+                self._session = session
+                self._session_pid = pid
+        return self._session
+
+    def request(self, method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+        """requests.request через общий пул; timeout — таймаут чтения, соединение — connect_timeout"""
+        if timeout is None:
+            timeout = 30
+        if not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+        try:
+            return self.session().request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            parts = urlsplit(url)
+            host = _host_key(parts.hostname or '', parts.port)
+            with self._lock:
+                self._errors[host] = self._errors.get(host, 0) + 1
+            raise
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    # ==================== STATS ====================
+
+    def _retire_pool(self, pool):
+        with self._lock:
+            s = self._retired.setdefault(_host_key(pool.host, pool.port), {'requests': 0, 'connections': 0})
+            s['requests'] += pool.num_requests
+            s['connections'] += pool.num_connections
+
+    def stats(self) -> Dict:
+        """Попадания в пул по хостам: hits — запросы по уже открытому соединению, misses — новые соединения"""
+        with self._lock:
+            totals = {host: dict(s) for host, s in self._retired.items()}
+            adapters = list(self._adapters) if self._session_pid == os.getpid() else []
+            errors = dict(self._errors)
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                s = totals.setdefault(_host_key(pool.host, pool.port), {'requests': 0, 'connections': 0})
+                s['requests'] += pool.num_requests
+                s['connections'] += pool.num_connections
+
+        hosts = {}
+        for host, s in sorted(totals.items()):
+            misses = s['connections']
+            hits = max(s['requests'] - misses, 0)
+            hosts[host] = {
+                'requests': s['requests'],
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / s['requests'], 3) if s['requests'] else 0,
+                'errors': errors.get(host, 0),
+            }
+        return {
+            'pid': os.getpid(),
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'hosts': hosts,
+        }
+
+
+# Singleton
+http_client = HttpClient(
+    pool_connections=getattr(Config, 'HTTP_POOL_CONNECTIONS', 10),
+    pool_maxsize=getattr(Config, 'HTTP_POOL_MAXSIZE', 10),
+    connect_timeout=getattr(Config, 'HTTP_CONNECT_TIMEOUT', 5),
+)
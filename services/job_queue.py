@@ -0,0 +1,239 @@
+"""
+Очередь фоновых задач на SQLite
+Долгие шаги оркестратора (генерация, подбор адресатов, отправка) выполняются
+пулом потоков в каждом воркере gunicorn, а не внутри HTTP-запроса.
+Задачи лежат в БД: если воркер умер посреди задачи, её аренда (lease) истекает
+и задачу подхватывает другой воркер — до max_attempts попыток.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    owner        TEXT NOT NULL DEFAULT '',
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL,            -- queued / running / done / failed / delivering / delivered
+    progress     TEXT NOT NULL DEFAULT '',
+    result       TEXT,
+    error        TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    worker       TEXT,
+    locked_until REAL,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+"""
+
+FINISHED = ('done', 'failed', 'delivering', 'delivered')
+
+
+class JobQueue:
+    """Очередь задач: enqueue из запроса, выполнение пулом потоков, опрос по id"""
+
+    def __init__(self, db_path: str, workers: int = 2, lease: float = 60, max_attempts: int = 2,
+                 poll_interval: float = 1.0, keep: float = 86400):
+        self.db_path = db_path
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.keep = keep
+        self._handlers: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._threads_pid = None
+        self._active = set()  # id задач, которые выполняет этот процесс
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def _worker_name(self) -> str:
+        return f'{os.uname().nodename}:{os.getpid()}'
+
+    def register(self, kind: str, handler: Callable[[Dict, Callable[[str], None]], Any]):
+        """handler(payload, progress) -> результат (JSON); progress(text) — статус для опроса"""
+        self._handlers[kind] = handler
+
+    # ==================== CLIENT ====================
+
+    def enqueue(self, kind: str, payload: Dict, owner: str = '', progress: str = '') -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            'INSERT INTO jobs (id, kind, owner, payload, status, progress, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, kind, owner, json.dumps(payload, ensure_ascii=False, default=str),
+             'queued', progress, now, now))
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Состояние задачи; для ждущих в очереди — position (сколько задач впереди)"""
+        self.start()
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            'id': row['id'],
+            'kind': row['kind'],
+            'owner': row['owner'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'payload': json.loads(row['payload']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+        if job['status'] == 'queued':
+            job['position'] = self._conn().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                (row['created_at'],)).fetchone()[0]
+        return job
+
+    def claim_delivery(self, job_id: str) -> bool:
+        """Забрать результат ровно один раз (done -> delivering); повторный опрос получит False"""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'delivering', updated_at = ? WHERE id = ? AND status = 'done'",
+            (time.time(), job_id))
+        return cur.rowcount == 1
+
+    def mark_delivered(self, job_id: str, result: Any):
+        """Сохранить то, что ушло клиенту, — чтобы повторный опрос вернул тот же ответ"""
+        self._conn().execute(
+            "UPDATE jobs SET status = 'delivered', result = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id))
+
+    def set_progress(self, job_id: str, text: str):
+        self._conn().execute('UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?',
+                             (text, time.time(), job_id))
+
+    # ==================== WORKERS ====================
+
+    def start(self):
+        """Запустить пул потоков в текущем процессе (лениво, после fork)"""
+        pid = os.getpid()
+        if self._threads_pid == pid:
+            return
+        with self._lock:
+            if self._threads_pid == pid:
+                return
+            self._threads_pid = pid
+            self._active = set()
+            self._threads = [threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True))
+            for t in self._threads:
+                t.start()
+
+    def release(self):
+        """Вернуть в очередь задачи этого процесса (при остановке воркера), не дожидаясь истечения аренды"""
+        with self._lock:
+            active = list(self._active) if self._threads_pid == os.getpid() else []
+        for job_id in active:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'queued', locked_until = NULL, worker = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def _claim(self) -> Optional[Dict]:
+        """Взять самую старую задачу из тех, что умеет выполнять этот процесс"""
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        with transaction(self._conn()) as conn:
+            # Задачи умерших воркеров: повторяем, пока не кончились попытки
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Воркер остановился во время выполнения', "
+                "updated_at = ? WHERE status = 'running' AND locked_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = conn.execute(
+                f"SELECT id, kind, payload FROM jobs WHERE kind IN ({', '.join('?' * len(kinds))}) "
+                "AND (status = 'queued' OR (status = 'running' AND locked_until < ?)) "
+                "ORDER BY created_at LIMIT 1", (*kinds, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "locked_until = ?, updated_at = ? WHERE id = ?",
+                (self._worker_name(), now + self.lease, now, row['id']))
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload'])}
+
+    def _run(self, job: Dict):
+        job_id = job['id']
+        handler = self._handlers[job['kind']]
+        with self._lock:
+            self._active.add(job_id)
+        try:
+            result = handler(job['payload'], lambda text: self.set_progress(job_id, text))
+            self._conn().execute(
+                "UPDATE jobs SET status = 'done', result = ?, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id))
+        except Exception as e:
+            print(f"[JOBS] {job['kind']} {job_id} failed: {e}")
+            self._conn().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'running'", (str(e)[:500], time.time(), job_id))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"[JOBS] Claim error: {e}")
+                job = None
+            if job is None:
+                # Новые задачи своего процесса будят сразу, чужих — ждём до poll_interval
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self):
+        """Продлевать аренду выполняемых задач и чистить старые завершённые"""
+        last_cleanup = 0.0
+        while True:
+            time.sleep(max(self.lease / 3, 1))
+            try:
+                with self._lock:
+                    active = list(self._active)
+                now = time.time()
+                for job_id in active:
+                    self._conn().execute(
+                        "UPDATE jobs SET locked_until = ? WHERE id = ? AND status = 'running'",
+                        (now + self.lease, job_id))
+                if now - last_cleanup > 3600:
+                    last_cleanup = now
+                    self._conn().execute(
+                        f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND updated_at < ?",
+                        (*FINISHED, now - self.keep))
+            except Exception as e:
+                print(f"[JOBS] Heartbeat error: {e}")
+
+
+# Singleton
+job_queue = JobQueue(
+    Config.JOBS_DB,
+    workers=Config.JOB_WORKERS,
+    lease=Config.JOB_LEASE,
+    max_attempts=Config.JOB_MAX_ATTEMPTS,
+)
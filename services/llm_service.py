@@ -1,11 +1,22 @@
 """
 Сервис интеграции с LLM (OpenRouter API)
 С динамической генерацией вопросов
+Ответы на одинаковые запросы (модель + сообщения + температура) можно брать из кэша —
+включается на месте вызова: _make_request(..., cache=True)
 """
-import requests
+from services.http_client import http_client
+import hashlib
 import json
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 from config import Config
+from services.cache_store import CacheStore
+
+
+def llm_cache_key(model: str, messages: List[Dict], temperature: float) -> str:
+    """Ключ по содержимому запроса: одинаковые промпты дают одинаковый ключ"""
+    raw = json.dumps([model, messages, round(float(temperature), 3)],
+                     ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
 
 
 class LLMService:
@@ -13,22 +24,52 @@ class LLMService:
         self.api_key = Config.OPENROUTER_API_KEY
         self.base_url = Config.OPENROUTER_BASE_URL
         self.model = Config.LLM_MODEL
-        
-    def _make_request(self, messages: List[Dict], temperature: float = 0.7, model_override: Optional[str] = None) -> Optional[str]:
-        """Отправка запроса к OpenRouter API с retry логикой"""
+        # Ошибки не кэшируем (negative_ttl=0): следующий такой же запрос снова пойдёт в API
+        self.response_cache = CacheStore(
+            Config.CACHE_DB, 'llm',
+            ttl=Config.LLM_CACHE_TTL,
+            negative_ttl=0,
+            max_entries=Config.LLM_CACHE_MAX_ENTRIES,
+            memory_entries=100)
+        
+    def _make_request(self, messages: List[Dict], temperature: float = 0.7, model_override: Optional[str] = None,
+                      cache: bool = False) -> Optional[str]:
+        """
+        Отправка запроса к OpenRouter API с retry логикой.
+        cache=True — для детерминированных промптов с JSON-ответом: повторный запрос с теми же
+        моделью, сообщениями и температурой отдаётся из кэша без оплаты токенов.
+        Ответ без разбираемого JSON не кэшируется (как и ошибка)
+        """
         if not self.api_key:
             print("LLM API Error: No API key configured")
             return None
         
         # Используем переданную модель или дефолтную
         model_to_use = model_override or self.model
-            
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost:5000",
-            "X-Title": "Complaint Chat Assistant"
-        }
+        
+        if cache and Config.LLM_CACHE_TTL > 0:
+            return self.response_cache.get_or_load(
+                llm_cache_key(model_to_use, messages, temperature),
+                lambda: self._send(messages, temperature, model_to_use),
+                is_failure=self._is_unusable)
+        return self._send(messages, temperature, model_to_use)
+    
+    def _is_unusable(self, text: Optional[str]) -> bool:
+        """Пустой ответ или JSON, который не разбирается, — в кэш не кладём, повтор снова спросит модель"""
+        if not text:
+            return True
+        extracted = self._extract_json(text)
+        if extracted is None:
+            return True
+        try:
+            json.loads(extracted)
+        except Exception:
+            return True
+        return False
+    
+    def _send(self, messages: List[Dict], temperature: float, model_to_use: str) -> Optional[str]:
+        """Запрос к API (до 3 попыток)"""
+        headers = self._headers()
         
         payload = {
             "model": model_to_use,
@@ -45,7 +86,7 @@ class LLMService:
         for attempt in range(max_retries):
             try:
                 print(f"LLM API: Attempt {attempt + 1}/{max_retries}...")
-                response = requests.post(
+                response = http_client.post(
                     f"{self.base_url}/chat/completions",
                     headers=headers,
                     json=payload,
@@ -70,6 +111,73 @@ class LLMService:
         print("LLM API: All retries failed")
         return None
     
+    def _headers(self) -> Dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost:5000",
+            "X-Title": "Complaint Chat Assistant"
+        }
+    
+    def stream_request(self, messages: List[Dict], temperature: float = 0.7,
+                       model_override: Optional[str] = None) -> Iterator[str]:
+        """
+        Потоковый запрос к OpenRouter (stream: true) — отдаёт куски текста по мере генерации.
+        Повторяет попытку, только пока не пришёл первый токен; обрыв посреди ответа — RuntimeError
+        """
+        if not self.api_key:
+            raise RuntimeError("LLM API: No API key configured")
+        
+        model_to_use = model_override or self.model
+        payload = {
+            "model": model_to_use,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 4000,
+            "stream": True
+        }
+        print(f"LLM API: Streaming with model {model_to_use}")
+        
+        import time
+        max_retries = 3
+        
+        for attempt in range(max_retries):
+            started = False
+            try:
+                response = http_client.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._headers(),
+                    json=payload,
+                    timeout=90,  # Таймаут между кусками, а не на весь ответ
+                    stream=True
+                )
+                with response:
+                    if not response.ok:
+                        raise RuntimeError(f"{response.status_code} - {response.text[:200]}")
+                    for raw in response.iter_lines():
+                        # SSE: "data: {...}", "data: [DONE]", комментарии ": OPENROUTER PROCESSING"
+                        if not raw or not raw.startswith(b"data:"):
+                            continue
+                        chunk = raw[5:].strip()
+                        if chunk == b"[DONE]":
+                            return
+                        data = json.loads(chunk)
+                        if data.get("error"):
+                            raise RuntimeError(str(data["error"])[:200])
+                        delta = (data.get("choices") or [{}])[0].get("delta", {}).get("content")
+                        if delta:
+                            started = True
+                            yield delta
+                return
+            except Exception as e:
+                if started:
+                    raise RuntimeError(f"LLM stream interrupted: {e}")
+                print(f"LLM API Stream Error (attempt {attempt + 1}): {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)
+        
+        raise RuntimeError("LLM API: All stream retries failed")
+    
     def generate_next_question(self, state) -> Optional[Dict]:
         """
         Генерация следующего вопроса или решение что информации достаточно.
@@ -555,7 +663,7 @@ JSON:"""
             {"role": "user", "content": user_prompt}
         ]
         
-        result = self._make_request(messages, temperature=0.3)
+        result = self._make_request(messages, temperature=0.3, cache=True)
         
         if result:
             json_str = self._extract_json(result)
@@ -2,7 +2,7 @@
 Сервис Яндекс Метрики — получение данных через API отчетов v1
 Поисковые запросы, источники трафика, UTM, визиты
 """
-import requests
+from services.http_client import http_client
 import os
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
@@ -28,7 +28,7 @@ class MetrikaService:
         """Выполнить запрос к API Метрики"""
         params['id'] = self.counter_id
         params.setdefault('limit', 100)
-        resp = requests.get(METRIKA_API, headers=self._headers(), params=params, timeout=15)
+        resp = http_client.get(METRIKA_API, headers=self._headers(), params=params, timeout=15)
         resp.raise_for_status()
         return resp.json()
 
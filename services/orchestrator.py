@@ -3,8 +3,11 @@
 Координирует flow: Registration → Category → Quiz → Complaint → Preview → Recipients → Send
 """
 
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, Optional, List
 from enum import Enum
+from config import Config
 from services.agents import quiz_agent, complaint_agent, recipient_agent, send_agent
 
 
@@ -383,36 +386,77 @@ class Orchestrator:
     
     def _handle_generating(self, state: Dict, user_input: Optional[str]) -> Dict:
         """Генерация текста жалобы"""
-        context = {
-            "category_name": state.get("data", {}).get("category_name", ""),
-            "qa_pairs": state.get("qa_pairs", []),
-            "user_data": state.get("data", {}).get("user_data", {}),
-            "company_data": state.get("data", {}).get("company_data", {})
-        }
+        if state.get("stream"):
+            return self._stream_stub(state, "generating_complaint", None)
         
-        result = self.agents["complaint"].process(context)
+        result = self.agents["complaint"].process(self.complaint_context(state))
         
         if result.get("success"):
-            complaint_text = result["complaint_text"]
-            return {
-                "message": f"✅ **Жалоба готова!** Проверьте текст:\n\n---\n\n{complaint_text}\n\n---",
-                "complaint_text": complaint_text,
-                "step": "preview",
-                "input_type": "preview",
-                "options": [
-                    {"id": "approve", "text": "✅ Всё верно, продолжить"},
-                    {"id": "edit", "text": "✏️ Хочу внести правки"}
-                ],
-                "can_go_back": True
-            }
-        
+            return self._complaint_ready(result["complaint_text"], edited=False)
+        return self._complaint_failed(edited=False)
+    
+    def complaint_context(self, state: Dict, user_edits: Optional[str] = None) -> Dict:
+        """Контекст для ComplaintAgent; с user_edits — перегенерация по замечаниям"""
+        data = state.get("data", {})
+        context = {
+            "category_name": data.get("category_name", ""),
+            "qa_pairs": state.get("qa_pairs", []),
+            "user_data": data.get("user_data", {}),
+            "company_data": data.get("company_data", {})
+        }
+        if user_edits:
+            context["previous_complaint"] = data.get("complaint_text", "")
+            context["user_edits"] = user_edits
+        return context
+    
+    def _stream_stub(self, state: Dict, step: str, user_edits: Optional[str]) -> Dict:
+        """
+        Ответ-заглушка для потоковой генерации: сам текст жалобы браузер
+        получает по SSE из /api/chat/stream, который потом вызывает finish_complaint
+        """
+        state.setdefault("data", {})["pending_complaint"] = {"step": step, "user_edits": user_edits}
+        return {
+            "message": "✍️ Составляю жалобу...",
+            "input_type": "stream",
+            "stream_url": "/api/chat/stream",
+            "step": step,
+            "can_go_back": False
+        }
+    
+    def finish_complaint(self, complaint_text: Optional[str], edited: bool) -> Dict:
+        """Ответ по итогам потоковой генерации (None — генерация не удалась)"""
+        if complaint_text and complaint_text.strip():
+            return self._complaint_ready(complaint_text.strip(), edited)
+        return self._complaint_failed(edited)
+    
+    def _complaint_ready(self, complaint_text: str, edited: bool) -> Dict:
+        if edited:
+            title = "✅ **Жалоба обновлена с учётом ваших правок!** Проверьте текст:"
+            edit_option = "✏️ Хочу внести ещё правки"
+        else:
+            title = "✅ **Жалоба готова!** Проверьте текст:"
+            edit_option = "✏️ Хочу внести правки"
+        return {
+            "message": f"{title}\n\n---\n\n{complaint_text}\n\n---",
+            "complaint_text": complaint_text,
+            "step": "preview",
+            "input_type": "preview",
+            "options": [
+                {"id": "approve", "text": "✅ Всё верно, продолжить"},
+                {"id": "edit", "text": edit_option}
+            ],
+            "can_go_back": True
+        }
+    
+    def _complaint_failed(self, edited: bool) -> Dict:
         return {
-            "message": "❌ Ошибка при генерации. Попробуем ещё раз?",
+            "message": ("❌ Ошибка при обновлении жалобы. Попробуем ещё раз?" if edited
+                        else "❌ Ошибка при генерации. Попробуем ещё раз?"),
             "options": [
                 {"id": "retry", "text": "🔄 Попробовать снова"},
                 {"id": "back", "text": "◀️ Вернуться назад"}
             ],
-            "step": "generating_complaint",
+            "step": "edit_complaint" if edited else "generating_complaint",
             "can_go_back": True
         }
     
@@ -446,40 +490,14 @@ class Orchestrator:
             }
         
         # Пользователь прислал замечания — перегенерируем жалобу
-        context = {
-            "category_name": state.get("data", {}).get("category_name", ""),
-            "qa_pairs": state.get("qa_pairs", []),
-            "user_data": state.get("data", {}).get("user_data", {}),
-            "company_data": state.get("data", {}).get("company_data", {}),
-            "previous_complaint": state.get("data", {}).get("complaint_text", ""),
-            "user_edits": user_input
-        }
+        if state.get("stream"):
+            return self._stream_stub(state, "edit_complaint", user_input)
         
-        result = self.agents["complaint"].process(context)
+        result = self.agents["complaint"].process(self.complaint_context(state, user_input))
         
         if result.get("success"):
-            complaint_text = result["complaint_text"]
-            return {
-                "message": f"✅ **Жалоба обновлена с учётом ваших правок!** Проверьте текст:\n\n---\n\n{complaint_text}\n\n---",
-                "complaint_text": complaint_text,
-                "step": "preview",
-                "input_type": "preview",
-                "options": [
-                    {"id": "approve", "text": "✅ Всё верно, продолжить"},
-                    {"id": "edit", "text": "✏️ Хочу внести ещё правки"}
-                ],
-                "can_go_back": True
-            }
-        
-        return {
-            "message": "❌ Ошибка при обновлении жалобы. Попробуем ещё раз?",
-            "options": [
-                {"id": "retry", "text": "🔄 Попробовать снова"},
-                {"id": "back", "text": "◀️ Вернуться назад"}
-            ],
-            "step": "edit_complaint",
-            "can_go_back": True
-        }
+            return self._complaint_ready(result["complaint_text"], edited=True)
+        return self._complaint_failed(edited=True)
     
     # ==================== RECIPIENTS ====================
     
@@ -499,21 +517,15 @@ class Orchestrator:
         
         # Обогащаем данными через Perplexity
         from services.contact_verification_service import contact_verification_service
-        recipient_details = {}
         category_name = state.get("data", {}).get("category_name", "")
+        recipient_details = self._enrich_recipients(
+            recipients, category_name, contact_verification_service.verify_and_get_contacts)
         
         options = []
         for rec in recipients:
             rec_id = rec["id"]
             rec_name = rec["name"]
-            
-            try:
-                details = contact_verification_service.verify_and_get_contacts(rec_name, category_name)
-                recipient_details[rec_id] = details
-                print(f"[Orchestrator] Got details for {rec_name}: addr={details.get('address')}")
-            except Exception as e:
-                print(f"[Orchestrator] Failed to get details for {rec_name}: {e}")
-                details = {}
+            details = recipient_details.get(rec_id, {})
             
             prefix = "⭐ " if rec.get("priority") == "primary" else ""
             options.append({
@@ -552,6 +564,35 @@ class Orchestrator:
             "can_go_back": True
         }
     
+    def _enrich_recipients(self, recipients: List[Dict], category_name: str, verify) -> Dict:
+        """
+        Параллельный запрос контактов для всех адресатов с общим дедлайном шага.
+        Кто не успел к дедлайну — остаётся без обогащения (карточка строится из ответа агента)
+        """
+        if not recipients:
+            return {}
+        deadline = getattr(Config, 'RECIPIENT_ENRICH_DEADLINE', 25)
+        workers = min(len(recipients), getattr(Config, 'RECIPIENT_ENRICH_WORKERS', 8))
+        
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='enrich')
+        futures = {executor.submit(verify, rec["name"], category_name): rec for rec in recipients}
+        done, pending = wait(futures, timeout=deadline)
+        # Не ждём опоздавших: потоки доработают в фоне, их результат отбрасывается
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+        recipient_details = {}
+        for future in done:
+            rec = futures[future]
+            try:
+                details = future.result()  # fetched_at — из кэша контактов (время запроса к Perplexity)
+                recipient_details[rec["id"]] = details
+                print(f"[Orchestrator] Got details for {rec['name']}: addr={details.get('address')}")
+            except Exception as e:
+                print(f"[Orchestrator] Failed to get details for {rec['name']}: {e}")
+        for future in pending:
+            print(f"[Orchestrator] Details for {futures[future]['name']} missed the {deadline}s deadline")
+        return recipient_details
+    
     # ==================== CONFIRM & SEND ====================
     
     def _handle_confirm(self, state: Dict, user_input: Optional[str]) -> Dict:
@@ -577,7 +618,9 @@ class Orchestrator:
             "complaint_text": state.get("data", {}).get("complaint_text", ""),
             "selected_recipients": state.get("data", {}).get("selected_recipients", []),
             "user_data": state.get("data", {}).get("user_data", {}),
-            "category_name": state.get("data", {}).get("category_name", "")
+            "category_name": state.get("data", {}).get("category_name", ""),
+            # Контакты, найденные на шаге выбора адресатов — повторно не запрашиваем
+            "recipient_details": state.get("data", {}).get("recipient_details", {})
         }
         
         result = self.agents["send"].process(context)
@@ -585,7 +628,8 @@ class Orchestrator:
         if result.get("success"):
             results = result.get("results", [])
             
-            recipient_details = state.get("data", {}).get("recipient_details", {})
+            recipient_details = result.get("recipient_details", {})
+            state.setdefault("data", {})["recipient_details"] = recipient_details
             enriched_results = []
             
             for r in results:
@@ -0,0 +1,202 @@
+"""
+Локальный реестр платежей ЮКассы и журнал уведомлений (webhook) в SQLite
+Статус платежа приходит уведомлением /api/payment/webhook; опрос /api/payment/status
+читает только этот реестр. Повторные уведомления не применяются второй раз.
+Если уведомление потерялось, фоновая сверка раз в reconcile_interval запрашивает
+в ЮКассе платежи, которые слишком долго висят в pending.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payment_state (
+    payment_id  TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    tariff_id   TEXT,
+    session_id  TEXT,
+    email       TEXT,
+    paid_at     TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    checked_at  REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_payment_state_pending ON payment_state(status, checked_at);
+
+CREATE TABLE IF NOT EXISTS payment_events (
+    event_id     TEXT PRIMARY KEY,
+    payment_id   TEXT NOT NULL,
+    event        TEXT NOT NULL,
+    status       TEXT,
+    source       TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    received_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payment_events_payment ON payment_events(payment_id);
+"""
+
+# Конечные статусы ЮКассы: после них платёж не меняется
+FINAL_STATUSES = ('succeeded', 'canceled')
+
+
+class PaymentLedger:
+    """Реестр платежей: payment_id → статус, тариф, сессия и email плательщика"""
+
+    def __init__(self, db_path: str, reconcile_interval: float = 60, reconcile_after: float = 120,
+                 reconcile_window: float = 86400):
+        self.db_path = db_path
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_after = reconcile_after      # сколько ждать уведомление, прежде чем спросить ЮКассу
+        self.reconcile_window = reconcile_window    # платежи старше не сверяем (брошенные)
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._reconciler_pid = None
+        self._reconciler_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def on_final(self, listener: Callable[[Dict], None]):
+        """Подписка на переход платежа в конечный статус: listener(запись payment_state)"""
+        self._listeners.append(listener)
+
+    # ==================== PAYMENTS ====================
+
+    def register(self, payment_id: str, tariff_id: str, session_id: str = '', email: str = ''):
+        """Платёж создан в ЮКассе — ждём уведомления"""
+        self._ensure_reconciler()
+        now = time.time()
+        self._conn().execute(
+            'INSERT OR IGNORE INTO payment_state '
+            '(payment_id, status, tariff_id, session_id, email, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (payment_id, 'pending', tariff_id, session_id, email or None, now, now))
+
+    def get(self, payment_id: str) -> Optional[Dict]:
+        self._ensure_reconciler()
+        row = self._conn().execute('SELECT * FROM payment_state WHERE payment_id = ?', (payment_id,)).fetchone()
+        return dict(row) if row else None
+
+    # ==================== EVENTS ====================
+
+    def ingest(self, notification: Dict, source: str = 'webhook') -> Optional[Dict]:
+        """
+        Применить уведомление ЮКассы {"event": "payment.succeeded", "object": {...}}.
+        Возвращает запись платежа, если уведомление новое, None — если повтор или не о платеже
+        """
+        obj = notification.get('object') or {}
+        event = notification.get('event', '')
+        payment_id = obj.get('id')
+        if not payment_id or not event.startswith('payment.'):
+            return None
+        status = obj.get('status', '')
+        metadata = obj.get('metadata') or {}
+        event_id = hashlib.sha1(f'{payment_id}:{event}:{status}'.encode()).hexdigest()
+        now = time.time()
+
+        with transaction(self._conn()) as conn:
+            cur = conn.execute(
+                'INSERT OR IGNORE INTO payment_events '
+                '(event_id, payment_id, event, status, source, payload, received_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (event_id, payment_id, event, status, source, json.dumps(notification, ensure_ascii=False), now))
+            if cur.rowcount == 0:
+                return None  # Уже получали
+
+            row = conn.execute('SELECT * FROM payment_state WHERE payment_id = ?', (payment_id,)).fetchone()
+            if row is None:
+                # Платёж создан не через нас (или реестр был пуст) — берём данные из metadata
+                conn.execute(
+                    'INSERT INTO payment_state '
+                    '(payment_id, status, tariff_id, session_id, email, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (payment_id, 'pending', metadata.get('tariff_id'), metadata.get('session_id'),
+                     metadata.get('email') or None, now, now))
+            elif row['status'] in FINAL_STATUSES:
+                return None  # Конечный статус не меняем
+
+            paid_at = datetime.now().isoformat() if status == 'succeeded' else None
+            conn.execute(
+                'UPDATE payment_state SET status = ?, paid_at = COALESCE(?, paid_at), updated_at = ?, '
+                'tariff_id = COALESCE(tariff_id, ?), email = COALESCE(email, ?) WHERE payment_id = ?',
+                (status, paid_at, now, metadata.get('tariff_id'), metadata.get('email') or None, payment_id))
+            state = dict(conn.execute('SELECT * FROM payment_state WHERE payment_id = ?', (payment_id,)).fetchone())
+
+        if state['status'] in FINAL_STATUSES:
+            print(f'[PAYMENT] {payment_id}: {state["status"]} ({source})')
+            for listener in self._listeners:
+                try:
+                    listener(state)
+                except Exception as e:
+                    print(f'[PAYMENT] Listener error for {payment_id}: {e}')
+        return state
+
+    def events(self, payment_id: str) -> List[Dict]:
+        return [dict(r) for r in self._conn().execute(
+            'SELECT event_id, event, status, source, received_at FROM payment_events '
+            'WHERE payment_id = ? ORDER BY received_at', (payment_id,))]
+
+    # ==================== RECONCILE ====================
+
+    def _claim_stale(self, limit: int = 20) -> List[str]:
+        """Pending-платежи без уведомления; checked_at не даёт другим воркерам взять их же"""
+        now = time.time()
+        with transaction(self._conn()) as conn:
+            rows = conn.execute(
+                "SELECT payment_id FROM payment_state WHERE status NOT IN ('succeeded', 'canceled') "
+                'AND created_at < ? AND created_at > ? AND checked_at < ? ORDER BY checked_at LIMIT ?',
+                (now - self.reconcile_after, now - self.reconcile_window,
+                 now - self.reconcile_interval, limit)).fetchall()
+            ids = [r['payment_id'] for r in rows]
+            conn.executemany('UPDATE payment_state SET checked_at = ? WHERE payment_id = ?',
+                             [(now, pid) for pid in ids])
+        return ids
+
+    def reconcile(self) -> int:
+        """Спросить ЮКассу о зависших платежах; ответ применяется как уведомление"""
+        from services.payment_service import payment_service
+        applied = 0
+        for payment_id in self._claim_stale():
+            result = payment_service.check_payment(payment_id)
+            if not result or result.get('status') not in FINAL_STATUSES:
+                continue
+            notification = {
+                'type': 'notification',
+                'event': f'payment.{result["status"]}',
+                'object': {'id': payment_id, 'status': result['status'], 'paid': result.get('paid'),
+                           'metadata': {'tariff_id': result.get('tariff_id')}},
+            }
+            if self.ingest(notification, source='reconcile'):
+                applied += 1
+        return applied
+
+    def _ensure_reconciler(self):
+        pid = os.getpid()
+        if self._reconciler_pid == pid:
+            return
+        with self._reconciler_lock:
+            if self._reconciler_pid == pid:
+                return
+            self._reconciler_pid = pid
+            threading.Thread(target=self._reconcile_loop, name='payment-reconcile', daemon=True).start()
+
+    def _reconcile_loop(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                applied = self.reconcile()
+                if applied:
+                    print(f'[PAYMENT] Reconciled {applied} payments without webhook')
+            except Exception as e:
+                print(f'[PAYMENT] Reconcile error: {e}')
+
+
+# Singleton
+payment_ledger = PaymentLedger(Config.PAYMENTS_DB, reconcile_interval=Config.PAYMENT_RECONCILE_INTERVAL)
@@ -1,9 +1,11 @@
 """
 Сервис оплаты через ЮКассу
 """
+import ipaddress
 import uuid
 from datetime import datetime, timedelta
 from yookassa import Configuration, Payment
+from yookassa.domain.common.security_helper import SecurityHelper
 from config import Config
 
 
@@ -11,12 +13,20 @@ from config import Config
 if Config.YOOKASSA_SHOP_ID and Config.YOOKASSA_SECRET_KEY:
     Configuration.account_id = Config.YOOKASSA_SHOP_ID
     Configuration.secret_key = Config.YOOKASSA_SECRET_KEY
+if Config.YOOKASSA_API_URL:
+    Configuration.api_url = Config.YOOKASSA_API_URL
+
+# Откуда принимаем уведомления: сети ЮКассы + адреса из настроек (локальный стенд)
+WEBHOOK_NETWORKS = [
+    ipaddress.ip_network(net)
+    for net in SecurityHelper.YOOKASSA_NETWORKS + [ip.strip() for ip in Config.YOOKASSA_WEBHOOK_TRUSTED_IPS.split(',') if ip.strip()]
+]
 
 
 class PaymentService:
     """Сервис для работы с ЮКассой"""
     
-    def create_payment(self, tariff_id, session_id, description=""):
+    def create_payment(self, tariff_id, session_id, description="", email=""):
         """Создать платёж в ЮКассе"""
         tariff = Config.TARIFFS.get(tariff_id)
         if not tariff:
@@ -38,6 +48,7 @@ class PaymentService:
             "metadata": {
                 "tariff_id": tariff_id,
                 "session_id": session_id,
+                "email": email,
             },
             "receipt": {
                 "customer": {
@@ -77,6 +88,14 @@ class PaymentService:
             print(f"[PAYMENT] Error checking payment {payment_id}: {e}")
             return None
     
+    def is_webhook_ip_trusted(self, ip):
+        """Пришло ли уведомление с адреса ЮКассы"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(addr in net for net in WEBHOOK_NETWORKS)
+    
     def is_paid(self, session_data):
         """Проверить, оплачена ли текущая сессия (standard или premium)"""
         return self.get_tariff_level(session_data) in ('standard', 'premium')
@@ -0,0 +1,151 @@
+"""
+Дисковый кэш готовых PDF жалоб (content-addressed)
+Ключ — хэш всего, из чего собирается документ: итоговый текст, получатель, данные
+пользователя, категория, дата в подписи и версия вёрстки. Повторное «Скачать PDF»
+отдаёт файл с диска (ETag = ключ, Last-Modified, Range), без рендера.
+Файлы — в PDF_CACHE_DIR, учёт размера и последнего чтения — в SQLite (общий для воркеров);
+при превышении PDF_CACHE_MAX_MB удаляются давно не скачанные.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, Optional
+
+from config import Config
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_cache (
+    key         TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pdf_cache_lru ON pdf_cache(last_access);
+"""
+
+
+def pdf_cache_key(final_text: str, recipient_name: str, user_data: Dict, category_name: str,
+                  render_date: str, layout_version: int) -> str:
+    """Ключ PDF: одинаковые входные данные дают один и тот же документ"""
+    raw = json.dumps([layout_version, render_date, final_text, recipient_name, user_data or {}, category_name],
+                     ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class PdfCache:
+    """PDF-файлы по ключу с вытеснением по суммарному размеру (LRU)"""
+
+    def __init__(self, cache_dir: str, db_path: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evictions': 0, 'errors': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def path(self, key: str) -> str:
+        # Подкаталог по первым символам — чтобы не держать тысячи файлов в одном каталоге
+        return os.path.join(self.cache_dir, key[:2], f'{key}.pdf')
+
+    def get(self, key: str) -> Optional[BinaryIO]:
+        """
+        Открытый на чтение PDF или None.
+        Файл открывается сразу: вытеснение другим воркером (unlink) его уже не затронет
+        """
+        try:
+            f = open(self.path(key), 'rb')
+        except OSError:
+            self._count('misses')
+            return None
+        now = time.time()
+        try:
+            stat = os.fstat(f.fileno())
+            # Файл мог остаться без строки (БД пересоздана) — тогда строку восстанавливаем
+            self._conn().execute(
+                'INSERT INTO pdf_cache (key, size, created_at, last_access) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET last_access = excluded.last_access',
+                (key, stat.st_size, stat.st_mtime, now))
+        except Exception as e:
+            print(f'[PDF_CACHE] Access update failed for {key[:12]}: {e}')
+        self._count('hits')
+        return f
+
+    def put(self, key: str, data: bytes) -> Optional[str]:
+        """Сохранить PDF; None — если записать не удалось (тогда отдаём из памяти)"""
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Пишем во временный файл и подменяем: другой воркер не увидит недописанный PDF
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            now = time.time()
+            with transaction(self._conn()) as conn:
+                conn.execute('INSERT OR REPLACE INTO pdf_cache (key, size, created_at, last_access) '
+                             'VALUES (?, ?, ?, ?)', (key, len(data), now, now))
+                evicted = self._evict_locked(conn, keep=key)
+        except Exception as e:
+            print(f'[PDF_CACHE] Store failed for {key[:12]}: {e}')
+            self._count('errors')
+            return None
+        self._count('stored')
+        self._remove_files(evicted)
+        return path
+
+    def _evict_locked(self, conn, keep: str) -> list:
+        """Удалить из учёта самые давно скачанные PDF сверх max_bytes; вернуть их ключи"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM pdf_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return []
+        evicted = []
+        for row in conn.execute('SELECT key, size FROM pdf_cache WHERE key != ? ORDER BY last_access', (keep,)):
+            if total <= self.max_bytes:
+                break
+            evicted.append(row['key'])
+            total -= row['size']
+        conn.executemany('DELETE FROM pdf_cache WHERE key = ?', [(key,) for key in evicted])
+        return evicted
+
+    def _remove_files(self, keys: list):
+        for key in keys:
+            try:
+                os.unlink(self.path(key))
+            except OSError:
+                pass  # Уже удалён другим воркером (или файл сейчас отдаётся под Windows)
+        if keys:
+            self._count('evictions', len(keys))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            row = self._conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_cache').fetchone()
+            stats['entries'], stats['bytes'] = row[0], row[1]
+        except Exception:
+            stats['entries'] = stats['bytes'] = None
+        stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
+
+
+# Singleton
+pdf_cache = PdfCache(Config.PDF_CACHE_DIR, Config.CACHE_DB, Config.PDF_CACHE_MAX_MB * 1024 * 1024)
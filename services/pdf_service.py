@@ -1,10 +1,16 @@
 """
 PDF сервис для генерации жалоб в формате PDF
 Использует reportlab для создания документов
+Шрифт и стили создаются один раз на процесс (TTF разбирается при регистрации),
+шаблон документа переиспользуется в пределах потока. Воркер прогревает сервис
+при старте (deploy/gunicorn.conf.py), и первая загрузка PDF не платит за инициализацию.
+Подмножество глифов шрифта всё равно собирается для каждого документа — оно зависит от текста.
 """
 
 import os
 import tempfile
+import threading
+import time
 from datetime import datetime
 from typing import Dict, Optional
 from io import BytesIO
@@ -13,102 +19,172 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm, mm
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 
+FONT_PATHS = [
+    # Windows
+    "C:/Windows/Fonts/arial.ttf",
+    "C:/Windows/Fonts/times.ttf",
+    "C:/Windows/Fonts/calibri.ttf",
+    # Linux
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+]
+
+# Версия вёрстки — входит в ключ кэша PDF (services/pdf_cache.py); увеличить при изменении шаблона/стилей
+LAYOUT_VERSION = 1
+
+_lock = threading.Lock()
+_default_font: Optional[str] = None
+_styles = None
+
+
+def register_fonts() -> str:
+    """Регистрация шрифта с поддержкой кириллицы — один раз на процесс"""
+    global _default_font
+    if _default_font is not None:
+        return _default_font
+    with _lock:
+        if _default_font is None:
+            font_name = "Helvetica"  # Если шрифты не найдены — встроенный (без кириллицы)
+            for font_path in FONT_PATHS:
+                if os.path.exists(font_path):
+                    try:
+                        name = os.path.basename(font_path).replace('.ttf', '')
+                        if name not in pdfmetrics.getRegisteredFontNames():
+                            pdfmetrics.registerFont(TTFont(name, font_path))
+                        font_name = name
+                        break
+                    except Exception:
+                        continue
+            _default_font = font_name
+    return _default_font
+
+
+def get_styles():
+    """Стили документа — общие для всех PDF процесса (reportlab их не изменяет)"""
+    global _styles
+    if _styles is not None:
+        return _styles
+    font = register_fonts()
+    with _lock:
+        if _styles is None:
+            styles = getSampleStyleSheet()
+            
+            # Основной текст
+            styles.add(ParagraphStyle(
+                name='RuNormal',
+                fontName=font,
+                fontSize=12,
+                leading=16,
+                alignment=TA_JUSTIFY,
+                spaceAfter=6
+            ))
+            
+            # Заголовок документа
+            styles.add(ParagraphStyle(
+                name='RuTitle',
+                fontName=font,
+                fontSize=14,
+                leading=18,
+                alignment=TA_CENTER,
+                spaceAfter=12,
+                spaceBefore=12,
+                fontWeight='bold'
+            ))
+            
+            # Шапка (адресная часть)
+            styles.add(ParagraphStyle(
+                name='RuHeader',
+                fontName=font,
+                fontSize=11,
+                leading=14,
+                alignment=TA_LEFT,
+                spaceAfter=4
+            ))
+            
+            # Подпись
+            styles.add(ParagraphStyle(
+                name='RuSignature',
+                fontName=font,
+                fontSize=11,
+                leading=14,
+                alignment=TA_LEFT,
+                spaceBefore=24
+            ))
+            _styles = styles
+    return _styles
+
+
+class ComplaintDocTemplate(BaseDocTemplate):
+    """
+    A4 с полями жалобы и одной рамкой на страницу (как SimpleDocTemplate).
+    Шаблон создаётся один раз и собирает документ за документом:
+    build() сбрасывает состояние, рамки обнуляются на каждой странице
+    """
+
+    def __init__(self):
+        super().__init__(
+            BytesIO(),
+            pagesize=A4,
+            rightMargin=2*cm,
+            leftMargin=2.5*cm,
+            topMargin=2*cm,
+            bottomMargin=2*cm
+        )
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height, id='normal')
+        self.addPageTemplates([PageTemplate(id='complaint', frames=[frame], pagesize=self.pagesize)])
+
+    def render(self, story) -> bytes:
+        buffer = BytesIO()
+        self.filename = buffer
+        try:
+            self.build(story)
+            return buffer.getvalue()
+        finally:
+            self.filename = None
+            buffer.close()
+
+
 class PDFService:
     """Сервис генерации PDF документов"""
     
     def __init__(self):
-        self._register_fonts()
-        self.styles = self._create_styles()
+        self.default_font = register_fonts()
+        self.styles = get_styles()
+        self._local = threading.local()  # Шаблон документа — свой у каждого потока (greenlet под gevent)
     
-    def _register_fonts(self):
-        """Регистрация шрифтов с поддержкой кириллицы"""
-        # Пробуем найти системные шрифты
-        font_paths = [
-            # Windows
-            "C:/Windows/Fonts/arial.ttf",
-            "C:/Windows/Fonts/times.ttf",
-            "C:/Windows/Fonts/calibri.ttf",
-            # Linux
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        ]
-        
-        font_registered = False
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    font_name = os.path.basename(font_path).replace('.ttf', '')
-                    pdfmetrics.registerFont(TTFont(font_name, font_path))
-                    self.default_font = font_name
-                    font_registered = True
-                    break
-                except:
-                    continue
-        
-        if not font_registered:
-            # Если шрифты не найдены — используем встроенный (без кириллицы)
-            self.default_font = "Helvetica"
+    def _template(self) -> ComplaintDocTemplate:
+        template = getattr(self._local, 'template', None)
+        if template is None:
+            template = self._local.template = ComplaintDocTemplate()
+        return template
     
-    def _create_styles(self) -> Dict:
-        """Создание стилей для документа"""
-        styles = getSampleStyleSheet()
-        
-        # Основной текст
-        styles.add(ParagraphStyle(
-            name='RuNormal',
-            fontName=self.default_font,
-            fontSize=12,
-            leading=16,
-            alignment=TA_JUSTIFY,
-            spaceAfter=6
-        ))
-        
-        # Заголовок документа
-        styles.add(ParagraphStyle(
-            name='RuTitle',
-            fontName=self.default_font,
-            fontSize=14,
-            leading=18,
-            alignment=TA_CENTER,
-            spaceAfter=12,
-            spaceBefore=12,
-            fontWeight='bold'
-        ))
-        
-        # Шапка (адресная часть)
-        styles.add(ParagraphStyle(
-            name='RuHeader',
-            fontName=self.default_font,
-            fontSize=11,
-            leading=14,
-            alignment=TA_LEFT,
-            spaceAfter=4
-        ))
-        
-        # Подпись
-        styles.add(ParagraphStyle(
-            name='RuSignature',
-            fontName=self.default_font,
-            fontSize=11,
-            leading=14,
-            alignment=TA_LEFT,
-            spaceBefore=24
-        ))
-        
-        return styles
+    def warm_up(self) -> float:
+        """
+        Прогрев при старте воркера: шрифт, стили, шаблон и ленивые импорты reportlab.
+        Returns: время в секундах
+        """
+        started = time.perf_counter()
+        self.generate_complaint_pdf(
+            "Прогрев генератора PDF: Ёё Йй Щщ Ъъ — «кириллица», № 1.\n\nАБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЭЮЯ",
+            "", {"fio": "Иванов Иван Иванович"}
+        )
+        elapsed = time.perf_counter() - started
+        print(f"[PDF] Warm-up done in {elapsed * 1000:.0f} ms (font {self.default_font})")
+        return elapsed
     
     def generate_complaint_pdf(
         self,
         complaint_text: str,
         recipient_name: str,
         user_data: Dict,
-        category_name: str = ""
+        category_name: str = "",
+        render_date: Optional[str] = None
     ) -> bytes:
         """
         Генерирует PDF документ жалобы
@@ -118,21 +194,11 @@ class PDFService:
             recipient_name: Название получателя
             user_data: Данные пользователя (fio, address, phone, email)
             category_name: Категория жалобы
+            render_date: Дата в подписи (ДД.ММ.ГГГГ), по умолчанию — сегодня
             
         Returns:
             bytes: PDF документ в виде байтов
         """
-        buffer = BytesIO()
-        
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=2*cm,
-            leftMargin=2.5*cm,
-            topMargin=2*cm,
-            bottomMargin=2*cm
-        )
-        
         story = []
         
         # Текст жалобы уже содержит полную шапку от LLM
@@ -149,7 +215,7 @@ class PDFService:
         
         # Дата и подпись (добавляем только если их нет в тексте)
         fio = user_data.get('fio', '[ФИО]')
-        current_date = datetime.now().strftime("%d.%m.%Y")
+        current_date = render_date or datetime.now().strftime("%d.%m.%Y")
         
         if "Подпись:" not in complaint_text and "_____________" not in complaint_text:
             signature = f"""
@@ -159,12 +225,7 @@ class PDFService:
             story.append(Paragraph(signature, self.styles['RuSignature']))
         
         # Генерируем PDF
-        doc.build(story)
-        
-        pdf_bytes = buffer.getvalue()
-        buffer.close()
-        
-        return pdf_bytes
+        return self._template().render(story)
     
     def save_complaint_pdf(
         self,
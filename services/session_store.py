@@ -0,0 +1,246 @@
+"""
+Серверные сессии Flask в SQLite
+Каждый ключ сессии (dialog_state, user_email...) — отдельная строка: при сохранении
+перезаписываются только изменившиеся ключи. Значения сериализуются в msgpack
+(или JSON, если msgpack не установлен) и сжимаются zstd/zlib, если они большие.
+Просроченные сессии удаляет фоновый поток; stats() показывает размеры сессий в байтах.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, Optional
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from services.sqlite_db import get_connection, transaction
+
+try:
+    import msgpack
+except ImportError:  # Необязателен — JSON чуть больше и медленнее
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # Необязателен — тогда zlib
+    zstandard = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    sid        TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    size       INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+CREATE TABLE IF NOT EXISTS session_items (
+    sid   TEXT NOT NULL REFERENCES sessions(sid) ON DELETE CASCADE,
+    key   TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (sid, key)
+) WITHOUT ROWID;
+"""
+
+COMPRESS_MIN = 512  # байт: меньшие значения не сжимаем
+
+
+def encode_value(value) -> bytes:
+    """Заголовок из двух байт (формат, сжатие) + данные"""
+    if msgpack is not None:
+        fmt, raw = b'm', msgpack.packb(value, use_bin_type=True, default=str)
+    else:
+        fmt, raw = b'j', json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    if len(raw) < COMPRESS_MIN:
+        return fmt + b'-' + raw
+    if zstandard is not None:
+        return fmt + b'z' + zstandard.ZstdCompressor(level=3).compress(raw)
+    return fmt + b'Z' + zlib.compress(raw, 6)
+
+
+def decode_value(blob: bytes):
+    fmt, comp, raw = blob[:1], blob[1:2], blob[2:]
+    if comp == b'z':
+        raw = zstandard.ZstdDecompressor().decompress(raw)
+    elif comp == b'Z':
+        raw = zlib.decompress(raw)
+    if fmt == b'm':
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw.decode('utf-8'))
+
+
+class StoreSession(CallbackDict, SessionMixin):
+    """Сессия с sid; stored — закодированные значения ключей в том виде, в каком они лежат в БД"""
+
+    def __init__(self, initial=None, sid: str = '', new: bool = False, stored: Optional[Dict[str, bytes]] = None,
+                 expires_at: float = 0):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.stored = stored or {}
+        self.expires_at = expires_at
+
+
+class SqliteSessionInterface(SessionInterface):
+    """SessionInterface для app.session_interface: cookie хранит только sid"""
+
+    session_class = StoreSession
+
+    def __init__(self, db_path: str, gc_interval: float = 600, legacy_dir: Optional[str] = None):
+        self.db_path = db_path
+        self.gc_interval = gc_interval
+        self.legacy_dir = legacy_dir
+        self._gc_thread = None
+        self._gc_pid = None
+        self._gc_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    # ==================== FLASK ====================
+
+    def open_session(self, app, request) -> StoreSession:
+        self._ensure_gc()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or len(sid) > 64:
+            return self.session_class(sid=str(uuid.uuid4()), new=True)
+
+        now = time.time()
+        row = self._conn().execute('SELECT expires_at FROM sessions WHERE sid = ?', (sid,)).fetchone()
+        if row is not None and row['expires_at'] > now:
+            stored = {r['key']: r['value'] for r in self._conn().execute(
+                'SELECT key, value FROM session_items WHERE sid = ?', (sid,))}
+            data = {}
+            for key, blob in stored.items():
+                try:
+                    data[key] = decode_value(blob)
+                except Exception as e:
+                    print(f'[SESSION] Broken value {key!r} in {sid[:8]}: {e}')
+            return self.session_class(data, sid=sid, stored=stored, expires_at=row['expires_at'])
+
+        legacy = self._load_legacy(sid)
+        if legacy:
+            # Сессия из flask_session/: перенесётся в SQLite при первом сохранении
+            return self.session_class(legacy, sid=sid)
+        return self.session_class(sid=sid, new=True)
+
+    def save_session(self, app, session: StoreSession, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        name = self.get_cookie_name(app)
+
+        if not session:
+            if session.modified or session.stored:
+                self.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        encoded = {key: encode_value(value) for key, value in session.items()}
+        changed = {key: blob for key, blob in encoded.items() if session.stored.get(key) != blob}
+        removed = [key for key in session.stored if key not in encoded]
+        # Срок жизни продлеваем не чаще раза в час, если ключи не менялись
+        refresh = session.expires_at - now < lifetime - 3600
+
+        if changed or removed or refresh:
+            size = sum(len(blob) for blob in encoded.values())
+            with transaction(self._conn()) as conn:
+                conn.execute(
+                    'INSERT INTO sessions (sid, expires_at, size, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(sid) DO UPDATE SET expires_at = excluded.expires_at, '
+                    'size = excluded.size, updated_at = excluded.updated_at',
+                    (session.sid, now + lifetime, size, now))
+                conn.executemany(
+                    'INSERT OR REPLACE INTO session_items (sid, key, value) VALUES (?, ?, ?)',
+                    [(session.sid, key, blob) for key, blob in changed.items()])
+                conn.executemany('DELETE FROM session_items WHERE sid = ? AND key = ?',
+                                 [(session.sid, key) for key in removed])
+            session.stored = encoded
+            session.expires_at = now + lifetime
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+            session.new = False
+
+    # ==================== MAINTENANCE ====================
+
+    def delete(self, sid: str):
+        self._conn().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def _load_legacy(self, sid: str) -> Optional[Dict]:
+        """Сессия старого формата Flask-Session (файлы в SESSION_FILE_DIR)"""
+        if not self.legacy_dir or not os.path.isdir(self.legacy_dir):
+            return None
+        try:
+            from cachelib.file import FileSystemCache
+            data = FileSystemCache(self.legacy_dir).get('session:' + sid)
+        except Exception as e:
+            print(f'[SESSION] Legacy session read failed: {e}')
+            return None
+        return dict(data) if isinstance(data, dict) else None
+
+    def gc(self) -> int:
+        """Удалить просроченные сессии (значения удаляются каскадом)"""
+        cur = self._conn().execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+        return cur.rowcount
+
+    def _ensure_gc(self):
+        """Фоновая очистка в текущем процессе (лениво, после fork)"""
+        pid = os.getpid()
+        if self._gc_pid == pid:
+            return
+        with self._gc_lock:
+            if self._gc_pid == pid:
+                return
+            self._gc_pid = pid
+            self._gc_thread = threading.Thread(target=self._gc_loop, name='session-gc', daemon=True)
+            self._gc_thread.start()
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                removed = self.gc()
+                if removed:
+                    print(f'[SESSION] GC removed {removed} expired sessions')
+            except Exception as e:
+                print(f'[SESSION] GC error: {e}')
+
+    def stats(self, top: int = 10) -> Dict:
+        """Число сессий и их размер в байтах; самые большие — с размером каждого ключа"""
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            'SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS total, COALESCE(MAX(size), 0) AS max_size '
+            'FROM sessions WHERE expires_at > ?', (now,)).fetchone()
+        largest = []
+        for r in conn.execute('SELECT sid, size, updated_at FROM sessions WHERE expires_at > ? '
+                              'ORDER BY size DESC LIMIT ?', (now, top)):
+            keys = {k['key']: k['size'] for k in conn.execute(
+                'SELECT key, LENGTH(value) AS size FROM session_items WHERE sid = ?', (r['sid'],))}
+            largest.append({'sid': r['sid'][:8], 'size': r['size'], 'keys': keys,
+                            'updated_at': r['updated_at']})
+        return {
+            'sessions': row['n'],
+            'total_bytes': row['total'],
+            'avg_bytes': round(row['total'] / row['n']) if row['n'] else 0,
+            'max_bytes': row['max_size'],
+            'expired': conn.execute('SELECT COUNT(*) FROM sessions WHERE expires_at <= ?', (now,)).fetchone()[0],
+            'codec': ('msgpack' if msgpack is not None else 'json') + '+' + ('zstd' if zstandard is not None else 'zlib'),
+            'largest': largest,
+        }
@@ -0,0 +1,104 @@
+"""
+Общие соединения SQLite для сервисов
+WAL-режим, одно соединение на поток и процесс (gunicorn форкает воркеры).
+Под gevent «поток» — это greenlet запроса: чтобы не открывать соединения на каждый запрос,
+соединения завершившегося потока/greenlet возвращаются в пул процесса и берутся следующим.
+Одно соединение одновременно у одного greenlet: транзакции разных запросов не смешиваются.
+"""
+import os
+import sqlite3
+import threading
+from collections import deque
+from typing import Dict
+
+
+POOL_IDLE_MAX = 64  # простаивающих соединений на БД в процессе (под gevent — по числу одновременных запросов), лишние закрываются
+
+_local = threading.local()  # Под gevent (monkey-patch) — своё у каждого greenlet
+_pool: Dict[str, deque] = {}
+_pool_pid = None
+
+
+class _Connections(dict):
+    """Соединения текущего потока (greenlet): когда он завершается, уходят в пул процесса"""
+
+    def __init__(self, pid: int):
+        super().__init__()
+        self.pid = pid
+
+    def __del__(self):
+        if self.pid != os.getpid():
+            return
+        for db_path, conn in self.items():
+            _release(db_path, conn)
+
+
+def _open(db_path: str) -> sqlite3.Connection:
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=10000')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def _acquire(db_path: str) -> sqlite3.Connection:
+    global _pool_pid
+    pid = os.getpid()
+    if _pool_pid != pid:
+        # После fork соединения родителя использовать нельзя
+        _pool.clear()
+        _pool_pid = pid
+    try:
+        return _pool.setdefault(db_path, deque()).popleft()
+    except IndexError:
+        return _open(db_path)
+
+
+def _release(db_path: str, conn: sqlite3.Connection):
+    # Вызывается из __del__ — только атомарные операции deque, без блокировок
+    try:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        idle = _pool.setdefault(db_path, deque())
+        if len(idle) < POOL_IDLE_MAX:
+            idle.append(conn)
+        else:
+            conn.close()
+    except Exception:
+        pass
+
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """Соединение с БД для текущего потока (берётся из пула или создаётся лениво)"""
+    pid = os.getpid()
+    conns = getattr(_local, 'conns', None)
+    if conns is None or conns.pid != pid:
+        conns = _local.conns = _Connections(pid)
+
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = _acquire(db_path)
+    return conn
+
+
+class transaction:
+    """Явная транзакция: BEGIN IMMEDIATE ... COMMIT / ROLLBACK"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
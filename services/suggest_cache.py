@@ -0,0 +1,176 @@
+"""
+Кэш подсказок DaData в памяти воркера
+LRU «запрос → ответ» плюс префиксное дерево: если на короткий запрос DaData вернула
+меньше count подсказок, это полный список, и ответ на любое его продолжение получается
+фильтрацией без запроса в DaData. Одинаковые одновременные запросы ждут один вызов API.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+MIN_PREFIX = 3  # короче — слишком общий список, не используем для фильтрации
+
+
+def normalize_query(query: str) -> str:
+    query = (query or '').lower().replace('ё', 'е')
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)  # дефис разделяет слова, как у DaData: «ромашка плюс» ~ «Ромашка-Плюс»
+
+
+def _matches(suggestion: Dict, words: List[str]) -> bool:
+    """Каждое слово запроса — начало какого-то слова подсказки (или ИНН/ОГРН для организаций)"""
+    data = suggestion.get('data') or {}
+    haystack = _WORD_RE.findall(normalize_query(
+        ' '.join([suggestion.get('value') or '', data.get('inn') or '', data.get('ogrn') or ''])))
+    return all(any(h.startswith(w) for h in haystack) for w in words)
+
+
+class _Flight:
+    """Запрос к API, который уже выполняется: остальные ждут его результат"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SuggestCache:
+    """LRU ответов DaData с префиксным деревом полных ответов и склейкой одинаковых запросов"""
+
+    def __init__(self, ttl: float = 6 * 3600, max_entries: int = 5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[str, str, int], tuple]' = OrderedDict()  # key -> (suggestions, expires_at)
+        self._tries: Dict[str, dict] = {}  # endpoint -> дерево по символам; '$' — ключ полного ответа
+        self._flights: Dict[Tuple[str, str, int], _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'prefix_hits': 0, 'misses': 0, 'coalesced': 0,
+                       'upstream': 0, 'errors': 0, 'evictions': 0}
+
+    # ==================== READ ====================
+
+    def get(self, endpoint: str, query: str, count: int,
+            loader: Callable[[], Optional[List[Dict]]]) -> Optional[List[Dict]]:
+        """Подсказки из кэша, фильтром из более короткого полного ответа или через loader()"""
+        norm = normalize_query(query)
+        key = (endpoint, norm, count)
+        with self._lock:
+            cached = self._cached_locked(key, time.time())
+            if cached is not None:
+                return cached
+            self._stats['misses'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait(timeout=10)
+            return list(flight.result) if flight.result is not None else None
+
+        try:
+            result = loader()
+            flight.result = result
+            with self._lock:
+                self._stats['upstream'] += 1
+                if result is None:
+                    self._stats['errors'] += 1  # ошибки не кэшируем
+                else:
+                    self._store(key, result, time.time())
+            return list(result) if result is not None else None
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def peek(self, endpoint: str, query: str, count: int) -> Optional[List[Dict]]:
+        """Ответ, если он уже есть в кэше (точный или из префикса); промах не считается"""
+        with self._lock:
+            return self._cached_locked((endpoint, normalize_query(query), count), time.time())
+
+    def _cached_locked(self, key: Tuple[str, str, int], now: float) -> Optional[List[Dict]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return list(entry[0])
+        derived = self._from_prefix(*key, now)
+        if derived:
+            self._stats['prefix_hits'] += 1
+            return derived
+        return None
+
+    def _from_prefix(self, endpoint: str, norm: str, count: int, now: float) -> Optional[List[Dict]]:
+        """Самый длинный закэшированный префикс (или сам запрос с другим count) с полным ответом → фильтруем"""
+        node = self._tries.get(endpoint)
+        best = None
+        for depth, char in enumerate(norm, 1):
+            node = node.get(char) if node is not None else None
+            if node is None:
+                break
+            if '$' in node and depth >= MIN_PREFIX:
+                best = node['$']
+        if best is None:
+            return None
+        entry = self._entries.get(best)
+        if entry is None or entry[1] <= now:
+            return None
+        words = _WORD_RE.findall(norm)
+        filtered = [s for s in entry[0] if _matches(s, words)]
+        # Пусто — возможно, DaData исправит опечатку; пусть решает она
+        return filtered[:count] if filtered else None
+
+    # ==================== WRITE ====================
+
+    def _store(self, key: Tuple[str, str, int], suggestions: List[Dict], now: float):
+        self._entries[key] = (list(suggestions), now + self.ttl)
+        self._entries.move_to_end(key)
+        endpoint, norm, count = key
+        if len(suggestions) < count and len(norm) >= MIN_PREFIX:
+            node = self._tries.setdefault(endpoint, {})
+            for char in norm:
+                node = node.setdefault(char, {})
+            node['$'] = key
+        else:
+            # Обновлённый ответ уже не полный — старая отметка отдавала бы из него урезанный список
+            self._untrie(key)
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._untrie(old_key)
+            self._stats['evictions'] += 1
+
+    def _untrie(self, key: Tuple[str, str, int]):
+        """Убрать ключ из дерева и пустые ветки за ним"""
+        endpoint, norm, _ = key
+        node = self._tries.get(endpoint)
+        path = []
+        for char in norm:
+            if node is None:
+                return
+            path.append((node, char))
+            node = node.get(char)
+        if node is None or node.get('$') != key:
+            return
+        del node['$']
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+
+    # ==================== STATS ====================
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['in_flight'] = len(self._flights)
+        lookups = stats['hits'] + stats['prefix_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['prefix_hits']) / lookups, 3) if lookups else 0
+        # Запросы, не дошедшие до DaData (в т.ч. склеенные с одновременным таким же)
+        stats['upstream_saved'] = round(1 - stats['upstream'] / lookups, 3) if lookups else 0
+        return stats
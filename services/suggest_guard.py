@@ -0,0 +1,109 @@
+"""
+Очерёдность запросов автодополнения в пределах сессии
+Клиент нумерует запросы поля (seq). Запрос, который устарел (пришёл более новый seq),
+отбрасывается, не дойдя до DaData. Шейпер пропускает к DaData не больше одного запроса
+поля за min_interval: остальные ждут, и пока ждут, их обычно вытесняет следующий.
+Состояние — в SQLite, чтобы его видели все воркеры.
+"""
+import threading
+import time
+from typing import Callable
+
+from config import Config
+from services.sqlite_db import get_connection
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suggest_seq (
+    session     TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    next_at     REAL NOT NULL DEFAULT 0,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (session, kind)
+) WITHOUT ROWID;
+"""
+
+
+class Superseded(Exception):
+    """Запрос вытеснен более новым запросом того же поля"""
+
+
+class SuggestGuard:
+    """Последний seq и время следующего вызова DaData для (сессия, поле)"""
+
+    def __init__(self, db_path: str, min_interval: float = 0.3, max_wait: float = 1.5,
+                 poll: float = 0.05, ttl: float = 3600):
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self.poll = poll
+        self.ttl = ttl
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'stale': 0, 'superseded': 0, 'waited': 0, 'passed': 0}
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def admit(self, session: str, kind: str, seq: int) -> bool:
+        """Запомнить seq; False — уже пришёл запрос новее (этот пришёл не по порядку)"""
+        now = time.time()
+        cur = self._conn().execute(
+            'INSERT INTO suggest_seq (session, kind, seq, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(session, kind) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at '
+            'WHERE excluded.seq > suggest_seq.seq',
+            (session, kind, seq, now))
+        if cur.rowcount == 0:
+            self._count('stale')
+            return False
+        self._count('admitted')
+        self._maybe_prune(now)
+        return True
+
+    def gate(self, session: str, kind: str, seq: int) -> Callable[[], None]:
+        """
+        Проверка перед вызовом DaData: ждёт своей очереди (не дольше max_wait)
+        и бросает Superseded, если за это время пришёл запрос новее
+        """
+        def wait_turn():
+            deadline = time.time() + self.max_wait
+            waited = False
+            while True:
+                now = time.time()
+                row = self._conn().execute(
+                    'SELECT seq, next_at FROM suggest_seq WHERE session = ? AND kind = ?',
+                    (session, kind)).fetchone()
+                if row is not None and row['seq'] != seq:
+                    self._count('superseded')
+                    raise Superseded()
+                if row is None or row['next_at'] <= now or now >= deadline:
+                    self._conn().execute(
+                        'UPDATE suggest_seq SET next_at = ? WHERE session = ? AND kind = ?',
+                        (now + self.min_interval, session, kind))
+                    self._count('waited' if waited else 'passed')
+                    return
+                waited = True
+                time.sleep(min(row['next_at'] - now, self.poll))
+        return wait_turn
+
+    def _maybe_prune(self, now: float):
+        """Раз в тысячу запросов удаляем давно неактивные сессии"""
+        with self._lock:
+            self._admitted += 1
+            if self._admitted % 1000:
+                return
+        self._conn().execute('DELETE FROM suggest_seq WHERE updated_at < ?', (now - self.ttl,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+# Singleton
+suggest_guard = SuggestGuard(Config.CACHE_DB, min_interval=Config.SUGGEST_MIN_INTERVAL)
@@ -0,0 +1,104 @@
+"""
+Журнал событий пользователей — append-only JSONL, сегменты по дням
+data/user_events/YYYY-MM-DD.jsonl, одна строка на событие.
+В памяти держим индекс: счётчики по типам и ссылки (сегмент, смещение) на email.
+"""
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+
+class UserEventLog:
+    """Append-only лог событий с инкрементальным индексом по email"""
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._refs: Dict[str, List[Tuple[str, int]]] = {}
+        self._offsets: Dict[str, int] = {}  # сегмент -> сколько байт уже проиндексировано
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.log_dir, f'{segment}.jsonl')
+
+    def append(self, email: str, event: Dict):
+        """Дописать событие одной операцией write (O_APPEND — строки воркеров не перемешиваются)"""
+        segment = (event.get('at') or '')[:10] or 'unknown'
+        record = {'email': email, **event}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def refresh(self):
+        """Дочитать новые строки всех сегментов (в т.ч. записанные другими воркерами)"""
+        with self._lock:
+            for name in sorted(os.listdir(self.log_dir)):
+                if not name.endswith('.jsonl'):
+                    continue
+                segment = name[:-len('.jsonl')]
+                path = os.path.join(self.log_dir, name)
+                start = self._offsets.get(segment, 0)
+                try:
+                    if os.path.getsize(path) <= start:
+                        continue
+                    with open(path, 'rb') as f:
+                        f.seek(start)
+                        chunk = f.read()
+                except OSError as e:
+                    print(f'[USER EVENTS] Cannot read {path}: {e}')
+                    continue
+                # Незавершённую строку (запись ещё идёт) оставляем до следующего раза
+                end = chunk.rfind(b'\n') + 1
+                offset = start
+                for raw in chunk[:end].splitlines(keepends=True):
+                    self._index_line(segment, offset, raw)
+                    offset += len(raw)
+                self._offsets[segment] = start + end
+
+    def _index_line(self, segment: str, offset: int, raw: bytes):
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            return
+        email = record.get('email')
+        if not email:
+            return
+        counts = self._counts.setdefault(email, {})
+        t = record.get('type', 'unknown')
+        counts[t] = counts.get(t, 0) + 1
+        self._refs.setdefault(email, []).append((segment, offset))
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Счётчики событий по типам для всех email"""
+        self.refresh()
+        with self._lock:
+            return {email: dict(c) for email, c in self._counts.items()}
+
+    def get_events(self, email: str) -> List[Dict]:
+        """События одного пользователя (чтение по смещениям из индекса)"""
+        self.refresh()
+        with self._lock:
+            refs = list(self._refs.get(email, []))
+        events = []
+        handles = {}
+        try:
+            for segment, offset in refs:
+                f = handles.get(segment)
+                if f is None:
+                    f = handles[segment] = open(self._segment_path(segment), 'rb')
+                f.seek(offset)
+                record = json.loads(f.readline())
+                record.pop('email', None)
+                events.append(record)
+        except (OSError, ValueError) as e:
+            print(f'[USER EVENTS] Cannot read events for {email}: {e}')
+        finally:
+            for f in handles.values():
+                f.close()
+        events.sort(key=lambda e: e.get('at') or '')
+        return events
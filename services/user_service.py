@@ -1,72 +1,76 @@
 """
-Сервис пользователей — простое хранение в JSON
+Сервис пользователей — профили в SQLite (services/user_store.py),
+события в append-only логе (services/user_event_log.py)
+get_user кэшируется: в пределах запроса (flask.g) и в воркере — запись сверяется
+с версией в БД не чаще раза в USER_CACHE_CHECK_INTERVAL
 """
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from flask import g, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from config import Config
+from services.user_store import UserStore
+from services.user_event_log import UserEventLog
 
 
 class UserService:
-    """Управление пользователями (JSON-файл)"""
+    """Управление пользователями (SQLite, WAL)"""
     
     def __init__(self):
         self.users_file = getattr(Config, 'USERS_FILE', './data/users.json')
-        os.makedirs(os.path.dirname(self.users_file), exist_ok=True)
-        if not os.path.exists(self.users_file):
-            self._save({})
-    
-    def _load(self):
-        try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    
-    def _save(self, data):
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.users_db = getattr(Config, 'USERS_DB', './data/users.db')
+        os.makedirs(os.path.dirname(self.users_db), exist_ok=True)
+        self.store = UserStore(self.users_db)
+        self.event_log = UserEventLog(getattr(Config, 'USER_EVENTS_DIR', './data/user_events'))
+        # Одноразовый перенос со старого users.json и старой таблицы events
+        self.store.migrate_from_json(self.users_file, event_sink=self.event_log.append)
+        for email, event in self.store.drain_legacy_events():
+            self.event_log.append(email, event)
+        # Кэш профилей воркера: email -> (версия, когда сверяли, JSON пользователя или None)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_size = getattr(Config, 'USER_CACHE_SIZE', 1000)
+        self.cache_check_interval = getattr(Config, 'USER_CACHE_CHECK_INTERVAL', 2.0)
     
     def register(self, email, password, name=''):
         """Регистрация нового пользователя"""
         email = email.strip().lower()
-        users = self._load()
         
-        if email in users:
-            return None, "Пользователь с таким email уже существует"
-        
-        users[email] = {
+        created = self.store.insert(email, {
             "name": name.strip(),
             "password_hash": generate_password_hash(password),
             "password_raw": password,
             "created_at": datetime.now().isoformat(),
-            "payments": [],
-        }
-        self._save(users)
+        })
+        if not created:
+            return None, "Пользователь с таким email уже существует"
+        self._invalidate(email)
         
         # Автоматическое создание почты на stuchim.ru
         try:
             from services.beget_service import beget_service
             email_data = beget_service.provision_user_email(name)
             if email_data:
-                users = self._load()
-                users[email]['stuchim_email'] = email_data['email']
-                users[email]['stuchim_email_password'] = email_data['password']
-                users[email]['stuchim_webmail'] = email_data.get('webmail_url', 'https://webmail.beget.com')
-                self._save(users)
+                self.store.update_fields(email, {
+                    'stuchim_email': email_data['email'],
+                    'stuchim_email_password': email_data['password'],
+                    'stuchim_webmail': email_data.get('webmail_url', 'https://webmail.beget.com'),
+                })
+                self._invalidate(email)
                 print(f'[REGISTER] Created mailbox {email_data["email"]} for {email}')
         except Exception as e:
             print(f'[REGISTER] Beget email provisioning failed: {e}')
         
-        return users.get(email, {}), None
+        return self.store.get(email) or {}, None
     
     def login(self, email, password):
         """Авторизация"""
         email = email.strip().lower()
-        users = self._load()
-        
-        user = users.get(email)
+        user = self.store.get(email)
         if not user:
             return None, "Неверный email или пароль"
         
@@ -76,25 +80,113 @@ class UserService:
         return user, None
     
     def get_user(self, email):
-        """Получить данные пользователя"""
+        """Получить данные пользователя (каждый вызов — независимая копия)"""
         if not email:
             return None
-        users = self._load()
-        return users.get(email.strip().lower())
+        email = email.strip().lower()
+        memo = self._request_memo()
+        if memo is not None and email in memo:
+            raw = memo[email]
+        else:
+            raw = self._cached_get(email)
+            if memo is not None:
+                memo[email] = raw
+        return json.loads(raw) if raw is not None else None
+    
+    def _request_memo(self):
+        """Профили, уже прочитанные в текущем запросе"""
+        if not has_request_context():
+            return None
+        memo = getattr(g, '_user_memo', None)
+        if memo is None:
+            memo = g._user_memo = {}
+        return memo
+    
+    def _cached_get(self, email):
+        """JSON пользователя из кэша воркера; чужие изменения видны не позже чем через cache_check_interval"""
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(email)
+        if entry is not None and now - entry[1] < self.cache_check_interval:
+            return entry[2]
+        
+        version = self.store.version(email)
+        if entry is not None and entry[0] == version:
+            raw = entry[2]
+        else:
+            user = self.store.get(email)
+            raw = json.dumps(user, ensure_ascii=False) if user is not None else None
+        with self._cache_lock:
+            self._cache[email] = (version, now, raw)
+            self._cache.move_to_end(email)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return raw
+    
+    def _invalidate(self, email):
+        """Сбросить кэши после записи (в других воркерах сработает проверка версии)"""
+        with self._cache_lock:
+            self._cache.pop(email, None)
+        memo = self._request_memo()
+        if memo is not None:
+            memo.pop(email, None)
+    
+    def import_user(self, email, record):
+        """Создать пользователя из готовой записи (сид-скрипты, админка). False — если уже есть"""
+        email = email.strip().lower()
+        if not self.store.insert(email, record):
+            return False
+        self._invalidate(email)
+        for event in record.get('events') or []:
+            self.event_log.append(email, event)
+        return True
     
     def add_payment(self, email, payment_info):
         """Добавить платёж к пользователю"""
         email = email.strip().lower()
-        users = self._load()
-        
-        if email not in users:
-            return False
-        
-        users[email]['payments'].append({
+        added = self.store.add_payment(email, {
+            **payment_info,
+            'recorded_at': datetime.now().isoformat(),
+        })
+        self._invalidate(email)
+        return added
+    
+    def record_payment(self, email, payment_info):
+        """Записать платёж по payment_id (повторная запись того же платежа обновляет его)"""
+        email = email.strip().lower()
+        recorded = self.store.upsert_payment(email, {
             **payment_info,
             'recorded_at': datetime.now().isoformat(),
         })
-        self._save(users)
+        self._invalidate(email)
+        return recorded
+    
+    def update_payment(self, payment_id, fields):
+        """Обновить платёж по payment_id (например, статус из ЮКассы). Возвращает email владельца или None"""
+        email = self.store.update_payment(payment_id, fields)
+        if email:
+            self._invalidate(email)
+        return email
+    
+    def get_entitlement(self, email):
+        """Права по тарифу (уровень, срок, скачивание/рассылка/каналы) — без разбора списка платежей"""
+        if not email:
+            return None
+        return self.store.get_entitlement(email.strip().lower())
+    
+    def renew_standard_payments(self, email):
+        """Переактивировать стандартные платежи и сбросить счётчик жалоб (вход из админки)"""
+        email = email.strip().lower()
+        payments = self.store.get_payments(email)
+        for p in payments:
+            if p.get('tariff') == 'standard':
+                p['status'] = 'succeeded'
+                p['recorded_at'] = datetime.now().isoformat()
+        if not self.store.replace_payments(email, payments):
+            return False
+        # Сбрасываем complaints чтобы лимит обнулился
+        self.store.update_fields(email, {'complaints_used': 0})
+        self._invalidate(email)
         return True
     
     def has_active_payment(self, email):
@@ -112,13 +204,6 @@ class UserService:
         """Сохранить завершённую жалобу в профиль пользователя"""
         import uuid
         email = email.strip().lower()
-        users = self._load()
-        
-        if email not in users:
-            return None
-        
-        if 'complaints' not in users[email]:
-            users[email]['complaints'] = []
         
         record = {
             'id': str(uuid.uuid4())[:8],
@@ -128,45 +213,33 @@ class UserService:
             'recipients': complaint_data.get('recipients', []),
         }
         
-        users[email]['complaints'].append(record)
-        self._save(users)
+        if not self.store.add_complaint(email, record):
+            return None
+        self._invalidate(email)
         return record['id']
     
     def get_complaints(self, email):
         """Получить все жалобы пользователя"""
-        user = self.get_user(email)
-        if not user:
+        if not email:
             return []
-        return user.get('complaints', [])
+        return self.store.get_complaints(email.strip().lower())
     
     def update_profile(self, email, profile_data):
         """Обновить расширенные данные профиля"""
         email = email.strip().lower()
-        users = self._load()
-        
-        if email not in users:
-            return False
         
-        for key, value in profile_data.items():
-            if value:  # Не перезаписываем пустыми значениями
-                users[email][key] = value
-        
-        users[email]['updated_at'] = datetime.now().isoformat()
-        self._save(users)
-        return True
+        # Не перезаписываем пустыми значениями
+        fields = {key: value for key, value in profile_data.items() if value}
+        fields['updated_at'] = datetime.now().isoformat()
+        updated = self.store.update_fields(email, fields)
+        self._invalidate(email)
+        return updated
 
     def add_event(self, email, event_type, metadata=None):
         """Добавить событие в лог пользователя"""
         if not email:
             return False
         email = email.strip().lower()
-        users = self._load()
-        
-        if email not in users:
-            return False
-        
-        if 'events' not in users[email]:
-            users[email]['events'] = []
         
         event = {
             'type': event_type,
@@ -175,21 +248,28 @@ class UserService:
         if metadata:
             event['meta'] = metadata
         
-        users[email]['events'].append(event)
-        self._save(users)
+        if not self.store.exists(email):
+            return False
+        self.event_log.append(email, event)
         return True
 
+    def get_events(self, email):
+        """Лог событий пользователя (для карточки в админке)"""
+        if not email:
+            return []
+        return self.event_log.get_events(email.strip().lower())
+
     def get_all_users(self):
         """Получить всех пользователей (для админки)"""
-        users = self._load()
+        profiles = self.store.all_profiles()
+        all_payments = self.store.payments_by_email()
+        all_complaints = self.store.complaints_by_email()
+        all_event_counts = self.event_log.counts()
         result = []
-        for email, data in users.items():
-            events = data.get('events', [])
-            # Считаем события по типам
-            event_counts = {}
-            for e in events:
-                t = e.get('type', 'unknown')
-                event_counts[t] = event_counts.get(t, 0) + 1
+        for email, data in profiles.items():
+            payments = all_payments.get(email, [])
+            complaints = all_complaints.get(email, [])
+            event_counts = all_event_counts.get(email, {})
             
             result.append({
                 'email': email,
@@ -203,13 +283,12 @@ class UserService:
                 'org_inn': data.get('inn', ''),
                 'position': data.get('position', ''),
                 'password_raw': data.get('password_raw', '***'),
-                'complaints_count': len(data.get('complaints', [])),
-                'payments_count': len(data.get('payments', [])),
-                'has_paid': any(p.get('status') == 'succeeded' for p in data.get('payments', [])),
-                'complaints': data.get('complaints', []),
-                'payments': data.get('payments', []),
+                'complaints_count': len(complaints),
+                'payments_count': len(payments),
+                'has_paid': any(p.get('status') == 'succeeded' for p in payments),
+                'complaints': complaints,
+                'payments': payments,
                 'consent_at': data.get('consent_at', ''),
-                'events': events,
                 'event_counts': event_counts,
                 'generated': event_counts.get('complaint_generated', 0),
                 'recipients_opened': event_counts.get('recipients_opened', 0),
@@ -0,0 +1,329 @@
+"""
+Хранилище пользователей — SQLite (WAL)
+Таблицы users / payments / complaints с индексами по email.
+Права по тарифу (entitlements) пересчитываются в той же транзакции, что и платежи.
+События пользователей живут в append-only логе (services/user_event_log.py)
+"""
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services.entitlements import compute_entitlement, is_expired
+from services.sqlite_db import get_connection, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email       TEXT PRIMARY KEY,
+    data        TEXT NOT NULL,
+    created_at  TEXT,
+    updated_at  TEXT
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    email        TEXT NOT NULL REFERENCES users(email) ON DELETE CASCADE,
+    payment_id   TEXT,
+    status       TEXT,
+    data         TEXT NOT NULL,
+    recorded_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_email ON payments(email);
+CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id);
+
+CREATE TABLE IF NOT EXISTS complaints (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    id          TEXT NOT NULL,
+    email       TEXT NOT NULL REFERENCES users(email) ON DELETE CASCADE,
+    data        TEXT NOT NULL,
+    created_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_complaints_email ON complaints(email);
+
+-- Версия записи пользователя: растёт при каждом изменении профиля, платежей и жалоб
+-- (по ней воркеры проверяют свой кэш профилей)
+CREATE TABLE IF NOT EXISTS user_versions (
+    email    TEXT PRIMARY KEY,
+    version  INTEGER NOT NULL
+);
+
+-- Права пользователя по платежам (services/entitlements.py): пересчитываются
+-- только при изменении платежей и при истечении expires_at
+CREATE TABLE IF NOT EXISTS entitlements (
+    email         TEXT PRIMARY KEY,
+    tariff_level  TEXT NOT NULL,
+    data          TEXT NOT NULL,
+    expires_at    TEXT,
+    computed_at   TEXT
+);
+
+-- Устаревшая таблица: события переносятся в UserEventLog при старте
+CREATE TABLE IF NOT EXISTS events (
+    id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    email  TEXT NOT NULL REFERENCES users(email) ON DELETE CASCADE,
+    type   TEXT NOT NULL,
+    at     TEXT,
+    meta   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_email_type ON events(email, type);
+"""
+
+# Поля, которые хранятся отдельно, а не в users.data
+LIST_FIELDS = ('payments', 'complaints', 'events')
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+class UserStore:
+    """Доступ к пользователям в SQLite"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    # ==================== USERS ====================
+
+    def exists(self, email: str) -> bool:
+        row = self._conn().execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone()
+        return row is not None
+
+    def count(self) -> int:
+        return self._conn().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def version(self, email: str) -> int:
+        row = self._conn().execute('SELECT version FROM user_versions WHERE email = ?', (email,)).fetchone()
+        return row['version'] if row else 0
+
+    def _bump(self, conn, email: str):
+        conn.execute(
+            'INSERT INTO user_versions (email, version) VALUES (?, 1) '
+            'ON CONFLICT(email) DO UPDATE SET version = version + 1', (email,))
+
+    def get(self, email: str) -> Optional[Dict]:
+        """Пользователь со списками payments / complaints"""
+        conn = self._conn()
+        row = conn.execute('SELECT data FROM users WHERE email = ?', (email,)).fetchone()
+        if row is None:
+            return None
+        user = json.loads(row['data'])
+        user['payments'] = [json.loads(r['data']) for r in conn.execute(
+            'SELECT data FROM payments WHERE email = ? ORDER BY id', (email,))]
+        user['complaints'] = [json.loads(r['data']) for r in conn.execute(
+            'SELECT data FROM complaints WHERE email = ? ORDER BY seq', (email,))]
+        return user
+
+    def insert(self, email: str, record: Dict) -> bool:
+        """Создать пользователя (с платежами и жалобами). False — если уже есть"""
+        with transaction(self._conn()) as conn:
+            if conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return False
+            self._insert_locked(conn, email, record)
+        return True
+
+    def _insert_locked(self, conn, email: str, record: Dict):
+        data = {k: v for k, v in record.items() if k not in LIST_FIELDS}
+        conn.execute(
+            'INSERT INTO users (email, data, created_at, updated_at) VALUES (?, ?, ?, ?)',
+            (email, _dumps(data), data.get('created_at'), data.get('updated_at')))
+        for p in record.get('payments') or []:
+            self._insert_payment(conn, email, p)
+        for c in record.get('complaints') or []:
+            self._insert_complaint(conn, email, c)
+        self._refresh_entitlement(conn, email)
+        self._bump(conn, email)
+
+    def update_fields(self, email: str, fields: Dict) -> bool:
+        """Обновить поля профиля (слияние с существующими)"""
+        with transaction(self._conn()) as conn:
+            row = conn.execute('SELECT data FROM users WHERE email = ?', (email,)).fetchone()
+            if row is None:
+                return False
+            data = json.loads(row['data'])
+            data.update({k: v for k, v in fields.items() if k not in LIST_FIELDS})
+            conn.execute('UPDATE users SET data = ?, updated_at = ? WHERE email = ?',
+                         (_dumps(data), data.get('updated_at'), email))
+            self._bump(conn, email)
+        return True
+
+    def all_profiles(self) -> Dict[str, Dict]:
+        """Все профили без вложенных списков: {email: data}"""
+        return {r['email']: json.loads(r['data'])
+                for r in self._conn().execute('SELECT email, data FROM users ORDER BY rowid')}
+
+    # ==================== PAYMENTS ====================
+
+    def _insert_payment(self, conn, email: str, payment: Dict):
+        conn.execute(
+            'INSERT INTO payments (email, payment_id, status, data, recorded_at) VALUES (?, ?, ?, ?, ?)',
+            (email, payment.get('payment_id'), payment.get('status'), _dumps(payment), payment.get('recorded_at')))
+
+    def add_payment(self, email: str, payment: Dict) -> bool:
+        with transaction(self._conn()) as conn:
+            if not conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return False
+            self._insert_payment(conn, email, payment)
+            self._refresh_entitlement(conn, email)
+            self._bump(conn, email)
+        return True
+
+    def get_payments(self, email: str) -> List[Dict]:
+        return [json.loads(r['data']) for r in self._conn().execute(
+            'SELECT data FROM payments WHERE email = ? ORDER BY id', (email,))]
+
+    def replace_payments(self, email: str, payments: List[Dict]) -> bool:
+        """Перезаписать все платежи пользователя (админские операции)"""
+        with transaction(self._conn()) as conn:
+            if not conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return False
+            conn.execute('DELETE FROM payments WHERE email = ?', (email,))
+            for p in payments:
+                self._insert_payment(conn, email, p)
+            self._refresh_entitlement(conn, email)
+            self._bump(conn, email)
+        return True
+
+    def upsert_payment(self, email: str, payment: Dict) -> bool:
+        """Добавить платёж или обновить уже записанный с тем же payment_id"""
+        with transaction(self._conn()) as conn:
+            if not conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return False
+            row = conn.execute('SELECT id, data FROM payments WHERE email = ? AND payment_id = ?',
+                               (email, payment.get('payment_id'))).fetchone()
+            if row is None:
+                self._insert_payment(conn, email, payment)
+            else:
+                merged = {**json.loads(row['data']), **payment}
+                conn.execute('UPDATE payments SET status = ?, data = ?, recorded_at = ? WHERE id = ?',
+                             (merged.get('status'), _dumps(merged), merged.get('recorded_at'), row['id']))
+            self._refresh_entitlement(conn, email)
+            self._bump(conn, email)
+        return True
+
+    def update_payment(self, payment_id: str, fields: Dict) -> Optional[str]:
+        """Обновить платёж по payment_id (статус и т.п.). Возвращает email владельца или None"""
+        with transaction(self._conn()) as conn:
+            row = conn.execute('SELECT id, email, data FROM payments WHERE payment_id = ? ORDER BY id DESC LIMIT 1',
+                               (payment_id,)).fetchone()
+            if row is None:
+                return None
+            payment = json.loads(row['data'])
+            payment.update(fields)
+            conn.execute('UPDATE payments SET status = ?, data = ?, recorded_at = ? WHERE id = ?',
+                         (payment.get('status'), _dumps(payment), payment.get('recorded_at'), row['id']))
+            self._refresh_entitlement(conn, row['email'])
+            self._bump(conn, row['email'])
+        return row['email']
+
+    def payments_by_email(self) -> Dict[str, List[Dict]]:
+        result = {}
+        for r in self._conn().execute('SELECT email, data FROM payments ORDER BY id'):
+            result.setdefault(r['email'], []).append(json.loads(r['data']))
+        return result
+
+    # ==================== ENTITLEMENTS ====================
+
+    def _refresh_entitlement(self, conn, email: str) -> Dict:
+        payments = [json.loads(r['data']) for r in conn.execute(
+            'SELECT data FROM payments WHERE email = ? ORDER BY id', (email,))]
+        entitlement = compute_entitlement(payments)
+        conn.execute(
+            'INSERT OR REPLACE INTO entitlements (email, tariff_level, data, expires_at, computed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (email, entitlement['tariff_level'], _dumps(entitlement),
+             entitlement['expires_at'], entitlement['computed_at']))
+        return entitlement
+
+    def get_entitlement(self, email: str) -> Optional[Dict]:
+        """Права пользователя одним чтением по ключу; None — если пользователя нет"""
+        row = self._conn().execute('SELECT data FROM entitlements WHERE email = ?', (email,)).fetchone()
+        if row is not None:
+            entitlement = json.loads(row['data'])
+            if not is_expired(entitlement):
+                return entitlement
+        # Записи ещё нет (пользователь из старой БД) или тариф истёк — пересчитываем
+        with transaction(self._conn()) as conn:
+            if not conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return None
+            return self._refresh_entitlement(conn, email)
+
+    # ==================== COMPLAINTS ====================
+
+    def _insert_complaint(self, conn, email: str, complaint: Dict):
+        conn.execute(
+            'INSERT INTO complaints (id, email, data, created_at) VALUES (?, ?, ?, ?)',
+            (complaint.get('id', ''), email, _dumps(complaint), complaint.get('created_at')))
+
+    def add_complaint(self, email: str, complaint: Dict) -> bool:
+        with transaction(self._conn()) as conn:
+            if not conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone():
+                return False
+            self._insert_complaint(conn, email, complaint)
+            self._bump(conn, email)
+        return True
+
+    def get_complaints(self, email: str) -> List[Dict]:
+        return [json.loads(r['data']) for r in self._conn().execute(
+            'SELECT data FROM complaints WHERE email = ? ORDER BY seq', (email,))]
+
+    def complaints_by_email(self) -> Dict[str, List[Dict]]:
+        result = {}
+        for r in self._conn().execute('SELECT email, data FROM complaints ORDER BY seq'):
+            result.setdefault(r['email'], []).append(json.loads(r['data']))
+        return result
+
+    # ==================== LEGACY EVENTS ====================
+
+    def drain_legacy_events(self) -> List[Tuple[str, Dict]]:
+        """Забрать (и удалить) события из старой таблицы events"""
+        with transaction(self._conn()) as conn:
+            rows = conn.execute('SELECT email, type, at, meta FROM events ORDER BY id').fetchall()
+            conn.execute('DELETE FROM events')
+        drained = []
+        for r in rows:
+            event = {'type': r['type'], 'at': r['at']}
+            if r['meta']:
+                event['meta'] = json.loads(r['meta'])
+            drained.append((r['email'], event))
+        return drained
+
+    # ==================== MIGRATION ====================
+
+    def migrate_from_json(self, json_path: str, event_sink: Optional[Callable[[str, Dict], None]] = None) -> int:
+        """
+        Одноразовый перенос users.json в БД.
+        Выполняется только на пустой БД; файл переименовывается в *.migrated.
+        События пользователей передаются в event_sink(email, event)
+        """
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f'[USERS] Cannot read {json_path} for migration: {e}')
+            return 0
+        if not users:
+            return 0
+
+        with transaction(self._conn()) as conn:
+            # Несколько воркеров стартуют одновременно — мигрирует только первый
+            if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] > 0:
+                return 0
+            for email, record in users.items():
+                self._insert_locked(conn, email.strip().lower(), record)
+
+        if event_sink:
+            for email, record in users.items():
+                for event in record.get('events') or []:
+                    event_sink(email.strip().lower(), event)
+
+        backup = f'{json_path}.migrated-{datetime.now().strftime("%Y%m%d%H%M%S")}'
+        os.replace(json_path, backup)
+        print(f'[USERS] Migrated {len(users)} users from {json_path} (backup: {backup})')
+        return len(users)
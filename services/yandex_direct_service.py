@@ -4,6 +4,7 @@ Yandex Direct API v5 — Service Layer
 Docs: https://yandex.ru/dev/direct/doc/ref-v5/concepts/about.html
 """
 import requests
+from services.http_client import http_client
 import os
 from datetime import datetime, timedelta
 
@@ -41,7 +42,7 @@ class YandexDirectService:
             body["params"] = params
 
         try:
-            resp = requests.post(url, json=body, headers=self.headers, timeout=30)
+            resp = http_client.post(url, json=body, headers=self.headers, timeout=30)
             data = resp.json()
             if "error" in data:
                 return {"error": f"{data['error'].get('error_string', 'Unknown')}: {data['error'].get('error_detail', '')}"}
@@ -104,7 +105,7 @@ class YandexDirectService:
         }
 
         try:
-            resp = requests.post(url, json=body, headers=headers, timeout=60)
+            resp = http_client.post(url, json=body, headers=headers, timeout=60)
 
             # 201 = report in queue, 202 = building
             if resp.status_code in (201, 202):
@@ -193,7 +194,7 @@ class YandexDirectService:
             import time as _time
             resp = None
             for _attempt in range(6):
-                resp = requests.post(url, json=body, headers=headers, timeout=60)
+                resp = http_client.post(url, json=body, headers=headers, timeout=60)
                 if resp.status_code == 200:
                     break
                 elif resp.status_code in (201, 202):
@@ -25,6 +25,11 @@ class ComplaintChat {
         this.selectedOptions = new Set();
         this.stepCount = 0;
 
+        // Dialog history as of the last /api/state call (only newer messages are fetched next time)
+        this.history = [];
+        this.stateId = null;
+        this.historyRev = null;
+
         // Payment state
         this.isPaid = false;
         this.tariffLevel = 'free'; // free / standard / premium
@@ -160,18 +165,35 @@ class ComplaintChat {
         return `/api${path}`;
     }
 
+    async fetchState(since) {
+        const response = await fetch(`${this.getApiEndpoint('/state')}?since=${since}`);
+        return response.json();
+    }
+
     async loadState() {
         try {
-            const endpoint = this.getApiEndpoint('/state');
-            const response = await fetch(endpoint);
-            const data = await response.json();
+            let data = await this.fetchState(this.history.length);
+            // History shrank (back), messages were rewritten in place (stream/job stub replaced)
+            // or the dialog was restarted - fetch it from the start
+            if (data.state_id !== this.stateId || data.history_rev !== this.historyRev ||
+                data.history_len < this.history.length) {
+                this.history = [];
+                if (data.since !== 0) {
+                    data = await this.fetchState(0);
+                }
+            }
+            this.stateId = data.state_id;
+            this.historyRev = data.history_rev;
+            this.history = this.history.concat(data.history);
+            data.history = this.history;
 
             // Clear existing messages
             this.messagesContainer.innerHTML = '';
 
             // Render history
+            let lastBubble = null;
             data.history.forEach(msg => {
-                this.renderMessage(msg.role, msg.content, false);
+                lastBubble = this.renderMessage(msg.role, msg.content, false);
             });
 
             // Update step count for progress
@@ -182,7 +204,13 @@ class ComplaintChat {
             const lastAssistant = [...data.history].reverse().find(m => m.role === 'assistant');
             if (lastAssistant) {
                 const inputType = lastAssistant.input_type || 'options';
-                if (inputType === 'sending_results' && data.data) {
+                if (inputType === 'stream') {
+                    // Page was reloaded while the complaint was being generated - reconnect to the stream
+                    this.resumeStream(lastBubble);
+                } else if (inputType === 'job' && data.data && data.data.pending_job) {
+                    // Page was reloaded while a background job was running - keep polling it
+                    this.resumeJob(data.data.pending_job, lastBubble);
+                } else if (inputType === 'sending_results' && data.data) {
                     // Restore sending results with complaint text
                     this.showInputArea(inputType, lastAssistant.options, '', {
                         results: data.data.sending_results,
@@ -247,6 +275,13 @@ class ComplaintChat {
             this.selectedCompanyData = null;
         }
 
+        // Complaint generation is streamed token by token when the browser supports SSE
+        if (window.EventSource) {
+            requestBody.stream = true;
+        }
+        // Long steps (LLM calls, recipient lookup, sending) run as background jobs polled below
+        requestBody.async = true;
+
         try {
             const endpoint = this.getApiEndpoint('/chat');
             const response = await fetch(endpoint, {
@@ -265,44 +300,158 @@ class ComplaintChat {
                 throw new Error('Ошибка сервера');
             }
 
-            const data = await response.json();
+            let data = await response.json();
 
             if (data.error) {
                 throw new Error(data.error);
             }
 
+            // The step runs in the background job queue - poll until it finishes
+            if (data.input_type === 'job' && data.job_url) {
+                this.showTyping(false);
+                const bubble = this.renderMessage('assistant', data.message);
+                data = await this.pollJob(data.job_url, bubble);
+                bubble.remove();
+            }
+
+            // The complaint text arrives separately over SSE
+            if (data.input_type === 'stream' && data.stream_url) {
+                this.showTyping(false);
+                const bubble = this.renderMessage('assistant', data.message);
+                data = await this.streamComplaint(data.stream_url, bubble);
+                bubble.remove();
+            }
+
             // Hide typing indicator
             this.showTyping(false);
 
-            // Update header if user just registered/logged in
-            if (data.user_name) {
-                this.updateUserHeader(data.user_name);
+            this.handleResponse(data);
+
+        } catch (error) {
+            this.showTyping(false);
+            this.showToast(error.message, 'error');
+        } finally {
+            this.isLoading = false;
+            this.scrollToBottom();
+        }
+    }
+
+    handleResponse(data) {
+        // Update header if user just registered/logged in
+        if (data.user_name) {
+            this.updateUserHeader(data.user_name);
+        }
+
+        // Show assistant response
+        this.renderMessage('assistant', data.message);
+
+        // Update step count
+        this.stepCount++;
+        this.updateProgress();
+
+        // Update input area - pass extra data for sending_results and target suggestions
+        this.showInputArea(
+            data.input_type || 'options',
+            data.options,
+            data.current_text,
+            {
+                results: data.results,
+                pdfDownloadUrl: data.pdf_download_url,
+                targetSuggestions: data.target_suggestions
             }
+        );
 
-            // Show assistant response
-            this.renderMessage('assistant', data.message);
+        // Update back button
+        this.updateBackButton(data.can_go_back !== false);
+    }
 
-            // Update step count
-            this.stepCount++;
-            this.updateProgress();
+    /**
+     * Render streamed complaint text into the bubble; resolves with the final /api/chat-shaped response
+     */
+    streamComplaint(url, bubble) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(url);
+            const textEl = bubble.querySelector('.leading-relaxed');
+            let text = '';
+
+            source.addEventListener('delta', (e) => {
+                text += JSON.parse(e.data).text;
+                textEl.innerHTML = this.formatMessage(text);
+                this.scrollToBottom();
+            });
+            source.addEventListener('done', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            source.addEventListener('failed', (e) => {
+                source.close();
+                reject(new Error(JSON.parse(e.data).error || 'Ошибка генерации'));
+            });
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Соединение прервано. Обновите страницу.'));
+            };
+        });
+    }
 
-            // Update input area - pass extra data for sending_results and target suggestions
-            this.showInputArea(
-                data.input_type || 'options',
-                data.options,
-                data.current_text,
-                {
-                    results: data.results,
-                    pdfDownloadUrl: data.pdf_download_url,
-                    targetSuggestions: data.target_suggestions
-                }
-            );
+    async resumeStream(bubble) {
+        if (this.isLoading || !bubble) return;
+        this.isLoading = true;
+        try {
+            const data = await this.streamComplaint(this.getApiEndpoint('/chat/stream'), bubble);
+            bubble.remove();
+            this.handleResponse(data);
+        } catch (error) {
+            this.showToast(error.message, 'error');
+        } finally {
+            this.isLoading = false;
+            this.scrollToBottom();
+        }
+    }
 
-            // Update back button
-            this.updateBackButton(data.can_go_back !== false);
+    /**
+     * Poll a background job; resolves with the final /api/chat-shaped response
+     */
+    async pollJob(url, bubble) {
+        const textEl = bubble.querySelector('.leading-relaxed');
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const response = await fetch(url);
+            if (response.status === 429) continue;
+            const job = await response.json();
+            if (job.error && !job.response) {
+                throw new Error(job.error);
+            }
+            if (job.status === 'done') {
+                return job.response;
+            }
+            if (job.status === 'failed') {
+                this.showToast('Не удалось выполнить запрос', 'error');
+                return job.response;
+            }
+            let progress = job.progress || '';
+            if (job.status === 'queued' && job.position) {
+                progress += ` (в очереди: ${job.position})`;
+            }
+            if (progress && textEl) {
+                textEl.innerHTML = this.formatMessage(progress);
+            }
+        }
+    }
 
+    async resumeJob(jobId, bubble) {
+        if (this.isLoading || !bubble) return;
+        this.isLoading = true;
+        try {
+            let data = await this.pollJob(this.getApiEndpoint(`/jobs/${jobId}`), bubble);
+            if (data.input_type === 'stream' && data.stream_url) {
+                const textEl = bubble.querySelector('.leading-relaxed');
+                if (textEl) textEl.innerHTML = this.formatMessage(data.message);
+                data = await this.streamComplaint(data.stream_url, bubble);
+            }
+            bubble.remove();
+            this.handleResponse(data);
         } catch (error) {
-            this.showTyping(false);
             this.showToast(error.message, 'error');
         } finally {
             this.isLoading = false;
@@ -338,6 +487,7 @@ class ComplaintChat {
 
         this.messagesContainer.appendChild(messageDiv);
         this.scrollToBottom();
+        return messageDiv;
     }
 
     formatMessage(text) {
@@ -645,7 +795,7 @@ class ComplaintChat {
     async downloadDocument(format, recipient) {
         try {
             // Get user data from session state
-            const stateRes = await fetch(this.getApiEndpoint('/state'));
+            const stateRes = await fetch(`${this.getApiEndpoint('/state')}?fields=data.user_data,data.category_name`);
             const stateData = await stateRes.json();
             const ud = stateData.data?.user_data || {};
             const fio = ud.fio || ud.name || '';
@@ -1306,7 +1456,7 @@ class ComplaintChat {
         let fio = '';
         let categoryName = '';
         try {
-            const stateRes = await fetch(this.getApiEndpoint('/state'));
+            const stateRes = await fetch(`${this.getApiEndpoint('/state')}?fields=data.user_data,data.category_name`);
             const stateData = await stateRes.json();
             const ud = stateData.data?.user_data || {};
             fio = ud.fio || ud.name || '';
@@ -1979,6 +2129,8 @@ class Autocomplete {
         this.debounceTimer = null;
         this.selectedIndex = -1;
         this.suggestions = [];
+        this.seq = 0;             // номер последнего запроса: сервер отбрасывает устаревшие
+        this.controller = null;   // AbortController текущего запроса
 
         this.init();
     }
@@ -2037,25 +2189,50 @@ class Autocomplete {
         }
 
         if (query.length < 2) {
+            this.cancel();
             this.hide();
             return;
         }
 
         this.debounceTimer = setTimeout(() => {
             this.search(query);
-        }, 300);
+        }, 250);
+    }
+
+    cancel() {
+        // Отменяем запрос в полёте: его ответ уже не нужен
+        if (this.controller) {
+            this.controller.abort();
+            this.controller = null;
+        }
+    }
+
+    nextSeq() {
+        // Номер растёт на всю страницу и между перезагрузками (от текущего времени):
+        // сервер помнит последний seq поля в сессии и отбрасывает меньшие,
+        // а новое поле (или то же после goBack/перезагрузки) начинает не с 1
+        Autocomplete.lastSeq = Math.max(Date.now(), (Autocomplete.lastSeq || 0) + 1);
+        return Autocomplete.lastSeq;
     }
 
     async search(query) {
-        const endpoint = `/api/suggest/${this.type}?q=${encodeURIComponent(query)}`;
+        this.cancel();
+        const seq = this.seq = this.nextSeq();
+        const controller = new AbortController();
+        this.controller = controller;
+        const endpoint = `/api/suggest/${this.type}?q=${encodeURIComponent(query)}&seq=${seq}`;
 
         try {
-            const response = await fetch(endpoint);
+            const response = await fetch(endpoint, { signal: controller.signal });
             const data = await response.json();
 
+            // Ответ на устаревший запрос (или вытесненный сервером) — не показываем
+            if (seq !== this.seq || data.superseded) return;
+            this.controller = null;
             this.suggestions = data.suggestions || [];
             this.render();
         } catch (error) {
+            if (error.name === 'AbortError') return;
             console.error('Autocomplete error:', error);
             this.hide();
         }
@@ -2163,6 +2340,7 @@ class Autocomplete {
         if (this.debounceTimer) {
             clearTimeout(this.debounceTimer);
         }
+        this.cancel();
 
         this.input.removeEventListener('input', this.inputHandler);
         this.input.removeEventListener('keydown', this.keydownHandler);
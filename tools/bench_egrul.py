@@ -0,0 +1,113 @@
+"""
+Бенчмарк локального индекса ЕГРЮЛ против DaData API: поиск по ИНН и по названию, p50/p99.
+Без --index строит синтетический индекс во временном каталоге.
+--live N сравнивает с боевым путём (нужен DADATA_API_KEY; кэш подсказок не используется).
+
+    python tools/bench_egrul.py                              # 1M синтетических организаций
+    python tools/bench_egrul.py --companies 200000 --queries 5000
+    python tools/bench_egrul.py --index ./data/egrul --live 50
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.egrul_index import EgrulIndex, build_index  # noqa: E402
+
+FORMS = ['ООО', 'АО', 'ПАО', 'ИП', 'МУП', 'ГБУ']
+ROOTS = ['ромашк', 'вектор', 'строй', 'торг', 'сервис', 'транс', 'мед', 'агро', 'энерго', 'инвест',
+         'ресурс', 'технолог', 'комплекс', 'альянс', 'север', 'юг', 'урал', 'сибир', 'волг', 'капитал']
+ENDINGS = ['а', 'ия', 'групп', 'плюс', 'центр', 'снаб', 'пром', 'лайн', 'сити', '']
+
+
+def generate(n: int, seed: int = 42):
+    rnd = random.Random(seed)
+    for i in range(n):
+        name = ' '.join(rnd.choice(ROOTS).capitalize() + rnd.choice(ENDINGS) for _ in range(rnd.randint(1, 3)))
+        yield {
+            'name': f'{rnd.choice(FORMS)} "{name} {i % 997}"',
+            'inn': str(7700000000 + i * 7),
+            'ogrn': str(1027700000000 + i),
+            'kpp': '770101001',
+            'address': f'г Москва, ул Тестовая, д {i % 300}',
+            'region': 'г Москва', 'city': '', 'city_district': '', 'area': '', 'settlement': '',
+            'type': 'LEGAL', 'status': 'ACTIVE' if i % 10 else 'LIQUIDATED',
+            'director': 'Иванов Иван Иванович', 'director_post': 'ГЕНЕРАЛЬНЫЙ ДИРЕКТОР',
+        }
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)] * 1e6  # noqa: E731
+    return f'p50 {pick(0.5):9.1f} us   p99 {pick(0.99):9.1f} us'
+
+
+def run(label, fn, args_list):
+    times, hits = [], 0
+    for args in args_list:
+        t = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - t)
+        hits += bool(result)
+    print(f'  {label:<24} {percentiles(times)}   found {hits}/{len(args_list)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--index', default='')
+    parser.add_argument('--live', type=int, default=0)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.index:
+        path = args.index
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='egrul-bench-')
+        path = os.path.join(tmp_dir, 'egrul')
+        print(f'Building synthetic index of {args.companies:,} companies...')
+        t = time.perf_counter()
+        build_index(generate(args.companies), path, source='synthetic')
+        print(f'  built in {time.perf_counter() - t:.1f} s')
+
+    try:
+        index = EgrulIndex(path)
+        if not index.available:
+            sys.exit(f'No index at {path}')
+        count = index.meta['count']
+        rnd = random.Random(1)
+        sample = [index._record(index._open(), rnd.randrange(count)) for _ in range(args.queries)]
+        inns = [(c['inn'],) for c in sample]
+        names = []
+        for c in sample:
+            words = c['name'].replace('"', '').split()[1:]
+            word = rnd.choice(words)
+            names.append((word[:rnd.randint(3, max(3, len(word)))], 7))
+
+        print(f'Local index ({count:,} companies, {args.queries} queries):')
+        run('find_by_inn', index.find_by_inn, inns)
+        run('search (name prefix)', index.search, names)
+        complete = sum(index.search_ranked(*args)[1] for args in names)
+        print(f'  complete locally (no DaData)   {complete}/{len(names)}')
+
+        if args.live:
+            from services.dadata_service import DaDataService
+            dadata = DaDataService()
+            if not dadata.api_key:
+                sys.exit('DADATA_API_KEY is not set — live comparison skipped')
+            print(f'DaData API ({args.live} queries):')
+            run('findById/party', lambda inn: dadata._fetch('findById/party', inn, 1), inns[:args.live])
+            run('suggest/party', lambda q, n: dadata._fetch('suggest/party', q, n), names[:args.live])
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
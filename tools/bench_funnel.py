@@ -0,0 +1,114 @@
+"""
+Бенчмарк агрегации воронки: старый подсчёт (множества шагов + проход по посетителям
+на каждый шаг, step_keys.index на каждое событие) против FunnelEngine (битовые маски,
+один проход).
+
+    python tools/bench_funnel.py                  # 5M синтетических событий
+    python tools/bench_funnel.py --events 500000 --visitors 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.funnel_engine import FunnelEngine, np  # noqa: E402
+
+STEPS = [
+    'visit', 'consent', 'reg_user_type', 'reg_fio', 'reg_address', 'reg_phone', 'reg_email',
+    'reg_password', 'category', 'quiz_q1', 'quiz_q2', 'quiz_q3', 'quiz_q4', 'quiz_q5',
+    'complaint_generated', 'recipients_selected', 'complaint_sent',
+]
+
+
+def generate(n_events: int, n_visitors: int, seed: int = 42):
+    """Синтетический лог в колонках: посетитель проходит воронку и отваливается"""
+    rnd = random.Random(seed)
+    vid_pool = [f'v{i:08d}' for i in range(n_visitors)]
+    vids, steps = [], []
+    while len(vids) < n_events:
+        vid = vid_pool[rnd.randrange(n_visitors)]
+        depth = min(int(rnd.expovariate(0.25)) + 1, len(STEPS))
+        for step in STEPS[:depth]:
+            # Повторные события шага (перезагрузки, возвраты)
+            for _ in range(1 + (rnd.random() < 0.3)):
+                vids.append(vid)
+                steps.append(step)
+    return vids[:n_events], steps[:n_events]
+
+
+def legacy_funnel(vids, steps):
+    visitor_steps = {}
+    for vid, step in zip(vids, steps):
+        if vid not in visitor_steps:
+            visitor_steps[vid] = set()
+        visitor_steps[vid].add(step)
+    return [sum(1 for s in visitor_steps.values() if key in s) for key in STEPS]
+
+
+def engine_funnel(engine, vids, steps):
+    bits = engine.step_bits
+    masks = {}
+    for vid, step in zip(vids, steps):
+        masks[vid] = masks.get(vid, 0) | bits.get(step, 0)
+    return engine.count(masks.values())
+
+
+def legacy_last_step(vids, steps):
+    last = {}
+    for vid, step in zip(vids, steps):
+        cur_idx = STEPS.index(step) if step in STEPS else -1
+        prev = last.get(vid)
+        last_idx = STEPS.index(prev) if prev in STEPS else -1
+        if prev is None or cur_idx >= last_idx:
+            last[vid] = step
+    return last
+
+
+def engine_last_step(engine, vids, steps):
+    step_id = engine.step_id
+    last = {}
+    for vid, step in zip(vids, steps):
+        cur_idx = step_id(step)
+        prev = last.get(vid)
+        if prev is None or cur_idx >= prev[0]:
+            last[vid] = (cur_idx, step)
+    return {vid: step for vid, (_, step) in last.items()}
+
+
+def timed(label, fn, *args):
+    t = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - t
+    print(f'  {label:<28} {elapsed:8.2f} s')
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5_000_000)
+    parser.add_argument('--visitors', type=int, default=500_000)
+    args = parser.parse_args()
+
+    print(f'Generating {args.events:,} events for {args.visitors:,} visitors...')
+    vids, steps = generate(args.events, args.visitors)
+    engine = FunnelEngine(STEPS)
+    print(f'NumPy: {"yes" if np is not None else "no"}')
+
+    print('Funnel counts:')
+    old, t_old = timed('legacy (sets, 17 passes)', legacy_funnel, vids, steps)
+    new, t_new = timed('FunnelEngine (bitmasks)', engine_funnel, engine, vids, steps)
+    assert old == new, 'funnel counts differ'
+    print(f'  speedup x{t_old / t_new:.1f}')
+
+    print('Deepest step per visitor:')
+    old, t_old = timed('legacy (list.index)', legacy_last_step, vids, steps)
+    new, t_new = timed('FunnelEngine (step ids)', engine_last_step, engine, vids, steps)
+    assert old == new, 'last steps differ'
+    print(f'  speedup x{t_old / t_new:.1f}')
+
+
+if __name__ == '__main__':
+    main()
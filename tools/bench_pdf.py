@@ -0,0 +1,110 @@
+"""
+Бенчмарк генерации PDF жалобы (services/pdf_service.py): PDF/сек, p50/p99.
+Документ — типовая жалоба на 2–3 страницы (шапка, описание, требования, приложения).
+Отдельно печатает стоимость первой загрузки в холодном воркере: импорт и регистрация шрифта
+(её снимает прогрев в post_worker_init) и первый документ.
+
+    python tools/bench_pdf.py                      # 200 документов в одном потоке
+    python tools/bench_pdf.py --count 500 --threads 4
+    python tools/bench_pdf.py --paragraphs 20      # документ длиннее
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEADER = """В Управление Роспотребнадзора по г. Москве
+129626, г. Москва, Графский пер., д. 4, корп. 2, 3, 4
+
+от Иванова Ивана Ивановича
+адрес: 125009, г. Москва, ул. Тверская, д. 1, кв. 1
+телефон: +7 (900) 000-00-00, e-mail: ivanov@example.ru"""
+
+TITLE = "ЖАЛОБА\nна нарушение прав потребителя"
+
+BODY = ("{n}. {day}.03.2026 я приобрёл в магазине ООО «Ромашка» (ИНН 7701234567) товар — стиральную машину "
+        "стоимостью 45 990 руб., что подтверждается кассовым чеком № {n}{day}7. В течение гарантийного срока "
+        "в товаре обнаружен недостаток: машина не отжимает бельё и выдаёт ошибку E{n}. В соответствии со статьёй 18 "
+        "Закона РФ от 07.02.1992 № 2300-1 «О защите прав потребителей» я потребовал замены товара, однако продавец "
+        "отказал в удовлетворении требования без проведения проверки качества.")
+
+DEMANDS = """На основании изложенного, руководствуясь ст. 40 Закона РФ «О защите прав потребителей», прошу:
+1. Провести проверку соблюдения ООО «Ромашка» законодательства о защите прав потребителей.
+2. Выдать предписание об устранении выявленных нарушений.
+3. Привлечь виновных лиц к административной ответственности по ст. 14.15 КоАП РФ.
+
+Приложения:
+1. Копия кассового чека.
+2. Копия претензии от 20.03.2026.
+3. Копия ответа продавца."""
+
+
+def complaint_text(paragraphs: int) -> str:
+    body = [BODY.format(n=i + 1, day=10 + i % 18) for i in range(paragraphs)]
+    return '\n\n'.join([HEADER, TITLE] + body + [DEMANDS])
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)] * 1000  # noqa: E731
+    return f'p50 {pick(0.5):7.2f} ms   p99 {pick(0.99):7.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--paragraphs', type=int, default=9)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    from services.pdf_service import pdf_service
+    init = time.perf_counter() - started
+    text = complaint_text(args.paragraphs)
+    user_data = {'fio': 'Иванов Иван Иванович'}
+
+    started = time.perf_counter()
+    pdf = pdf_service.generate_complaint_pdf(text, 'Роспотребнадзор', user_data, 'Товары')
+    first = time.perf_counter() - started
+
+    try:
+        import _rl_accel  # noqa: F401
+        accel = 'rl_accel'
+    except ImportError:
+        accel = 'pure Python'
+    pages = pdf.count(b'/Type /Page\n')
+    print(f'Complaint: {len(text)} chars, {pages} pages, {len(pdf) / 1024:.1f} KB; '
+          f'font {pdf_service.default_font}, reportlab {accel}')
+    print(f'  cold init (import + fonts)  {init * 1000:7.1f} ms')
+    print(f'  first PDF                   {first * 1000:7.1f} ms')
+
+    times = []
+    lock = threading.Lock()
+    per_thread = max(1, args.count // args.threads)
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            t = time.perf_counter()
+            pdf_service.generate_complaint_pdf(text, 'Роспотребнадзор', user_data, 'Товары')
+            local.append(time.perf_counter() - t)
+        with lock:
+            times.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f'{len(times)} PDFs, {args.threads} thread(s):')
+    print(f'  {len(times) / elapsed:7.1f} PDF/s   {percentiles(times)}')
+
+
+if __name__ == '__main__':
+    main()
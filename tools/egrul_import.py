@@ -0,0 +1,71 @@
+"""
+Импорт выгрузки организаций в локальный индекс (services/egrul_index.py)
+Вход — JSON Lines (можно .gz): по строке на организацию в формате подсказки DaData
+party ({"value": ..., "data": {...}}) или уже готовой записи /api/suggest/company
+({"name": ..., "inn": ...}). Индекс собирается рядом и подменяет старый целиком;
+воркеры подхватят новый индекс после перезапуска.
+
+    python tools/egrul_import.py egrul.jsonl.gz                 # → EGRUL_INDEX_DIR
+    python tools/egrul_import.py part1.jsonl part2.jsonl --out ./data/egrul
+    python tools/egrul_import.py egrul.jsonl --active-only      # без ликвидированных
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from services.dadata_service import company_from_party  # noqa: E402
+from services.egrul_index import EgrulIndex, build_index  # noqa: E402
+
+
+def read_companies(paths, active_only=False, stats=None):
+    """Записи компаний из файлов; битые строки пропускаются"""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    stats['broken'] += 1
+                    continue
+                company = company_from_party(item) if 'data' in item else item
+                if active_only and company.get('status') not in ('', 'ACTIVE'):
+                    stats['skipped'] += 1
+                    continue
+                stats['read'] += 1
+                yield company
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--out', default=Config.EGRUL_INDEX_DIR)
+    parser.add_argument('--active-only', action='store_true')
+    args = parser.parse_args()
+
+    stats = {'read': 0, 'broken': 0, 'skipped': 0}
+    started = time.perf_counter()
+    count = build_index(read_companies(args.files, args.active_only, stats), args.out,
+                        source=', '.join(os.path.basename(p) for p in args.files))
+    elapsed = time.perf_counter() - started
+
+    index = EgrulIndex(args.out)
+    index.available  # noqa: B018 — открыть и прочитать meta.json
+    size = sum(os.path.getsize(os.path.join(args.out, name)) for name in os.listdir(args.out))
+    print(f'[EGRUL] Read {stats["read"]} records ({stats["broken"]} broken, {stats["skipped"]} skipped), '
+          f'indexed {count} unique INN, {index.meta.get("grams")} trigrams')
+    print(f'[EGRUL] {args.out}: {size / 1024 / 1024:.1f} MB, built in {elapsed:.1f} s')
+    print('[EGRUL] Restart the service to pick up the new index')
+
+
+if __name__ == '__main__':
+    main()
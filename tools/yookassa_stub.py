@@ -0,0 +1,146 @@
+"""
+Локальный стенд ЮКассы: API платежей (create / find_one) и уведомления на webhook.
+Приложение ходит сюда вместо api.yookassa.ru, а «оплата» подтверждается ссылкой
+confirmation_url — стенд меняет статус и шлёт уведомление, как настоящая ЮКасса.
+
+    python tools/yookassa_stub.py --port 8765 --webhook http://127.0.0.1:5000/api/payment/webhook
+
+    # приложение:
+    YOOKASSA_SHOP_ID=test YOOKASSA_SECRET_KEY=test \\
+    YOOKASSA_API_URL=http://127.0.0.1:8765/v3 YOOKASSA_WEBHOOK_TRUSTED_IPS=127.0.0.1 python app.py
+
+    # оплатить / отменить без браузера:
+    curl 'http://127.0.0.1:8765/confirm/<payment_id>?result=succeeded'
+    curl 'http://127.0.0.1:8765/confirm/<payment_id>?result=canceled'
+
+--duplicates N шлёт каждое уведомление N раз (проверка идемпотентности),
+--no-webhook не шлёт уведомлений (проверка фоновой сверки).
+"""
+import argparse
+import json
+import threading
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAYMENTS = {}
+LOCK = threading.Lock()
+ARGS = None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def send_notification(payment: dict):
+    """POST уведомления на webhook приложения (как ЮКасса: payment.succeeded / payment.canceled)"""
+    body = json.dumps({
+        'type': 'notification',
+        'event': f'payment.{payment["status"]}',
+        'object': payment,
+    }).encode('utf-8')
+    for attempt in range(ARGS.duplicates):
+        req = urllib.request.Request(ARGS.webhook, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                print(f'[STUB] webhook {payment["id"]} {payment["status"]} #{attempt + 1}: '
+                      f'{resp.status} {resp.read().decode("utf-8")}')
+        except Exception as e:
+            print(f'[STUB] webhook {payment["id"]} failed: {e}')
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _json(self, code: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v3/payments':
+            return self._json(404, {'type': 'error', 'code': 'not_found'})
+        params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        payment_id = str(uuid.uuid4())
+        host = self.headers.get('Host', f'127.0.0.1:{ARGS.port}')
+        payment = {
+            'id': payment_id,
+            'status': 'pending',
+            'paid': False,
+            'amount': params.get('amount'),
+            'description': params.get('description', ''),
+            'metadata': params.get('metadata') or {},
+            'recipient': {'account_id': 'stub', 'gateway_id': 'stub'},
+            'created_at': _now(),
+            'test': True,
+            'refundable': False,
+            'confirmation': {
+                'type': 'redirect',
+                'return_url': (params.get('confirmation') or {}).get('return_url', ''),
+                'confirmation_url': f'http://{host}/confirm/{payment_id}?result=succeeded',
+            },
+        }
+        with LOCK:
+            PAYMENTS[payment_id] = payment
+        print(f'[STUB] created {payment_id} {payment["metadata"]}')
+        self._json(200, payment)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) == 3 and parts[:2] == ['v3', 'payments']:
+            with LOCK:
+                payment = PAYMENTS.get(parts[2])
+            if payment is None:
+                return self._json(404, {'type': 'error', 'code': 'not_found'})
+            return self._json(200, payment)
+
+        if len(parts) == 2 and parts[0] == 'confirm':
+            result = parse_qs(url.query).get('result', ['succeeded'])[0]
+            with LOCK:
+                payment = PAYMENTS.get(parts[1])
+                if payment is None:
+                    return self._json(404, {'type': 'error', 'code': 'not_found'})
+                if payment['status'] == 'pending':
+                    payment['status'] = 'succeeded' if result == 'succeeded' else 'canceled'
+                    payment['paid'] = payment['status'] == 'succeeded'
+                    if payment['paid']:
+                        payment['captured_at'] = _now()
+                snapshot = dict(payment)
+            if not ARGS.no_webhook:
+                threading.Thread(target=send_notification, args=(snapshot,), daemon=True).start()
+            return_url = snapshot['confirmation'].get('return_url')
+            if return_url and 'text/html' in self.headers.get('Accept', ''):
+                self.send_response(302)
+                self.send_header('Location', return_url)
+                self.end_headers()
+                return
+            return self._json(200, snapshot)
+
+        self._json(404, {'type': 'error', 'code': 'not_found'})
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    global ARGS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--webhook', default='http://127.0.0.1:5000/api/payment/webhook')
+    parser.add_argument('--duplicates', type=int, default=1)
+    parser.add_argument('--no-webhook', action='store_true')
+    ARGS = parser.parse_args()
+
+    server = ThreadingHTTPServer((ARGS.host, ARGS.port), Handler)
+    print(f'[STUB] YooKassa stand-in on http://{ARGS.host}:{ARGS.port}/v3 → webhook {ARGS.webhook}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()